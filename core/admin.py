@@ -18,16 +18,23 @@ from core.models import (
     NewsletterSubscriber,
     Address,
     Order,
-    Contact
+    Contact,
+    ImageAsset,
+    ImageJob,
 )
 
 
 class DynamicModelAdmin(admin.ModelAdmin):
     def get_list_display(self, request):
         """
-        Retorna todos os campos do modelo para a exibição da lista.
+        Retorna todos os campos do modelo para a exibição da lista
+        (relações reversas, como `CupcakeImage.jobs`, ficam de fora).
         """
-        return [field.name for field in self.model._meta.get_fields()]
+        return [
+            field.name
+            for field in self.model._meta.get_fields()
+            if field.concrete or not field.auto_created
+        ]
 
     def get_search_fields(self, request):
         """
@@ -53,6 +60,8 @@ admin.site.register(Profile, DynamicModelAdmin)
 admin.site.register(Review, DynamicModelAdmin)
 admin.site.register(Contact, DynamicModelAdmin)
 admin.site.register(Order, DynamicModelAdmin)
+admin.site.register(ImageJob, DynamicModelAdmin)
+admin.site.register(ImageAsset, DynamicModelAdmin)
 
 
 
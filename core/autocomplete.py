@@ -0,0 +1,133 @@
+"""
+Sugestões da busca da loja enquanto o usuário digita (`views.autocomplete`).
+
+Os títulos dos cupcakes e os nomes das categorias ficam em uma árvore de
+prefixos (trie) em memória, em cada processo. Cada nó guarda as melhores
+AUTOCOMPLETE_MAX_RESULTS entradas com aquele prefixo, já ordenadas, então uma
+consulta só percorre os caracteres do prefixo digitado.
+
+Os textos são normalizados (minúsculas, sem acentos) e cada um é inserido a
+partir de cada palavra, assim "mor" encontra "Cupcake de Morango". Prefixos
+mais longos que MAX_DEPTH caracteres param no nó dessa profundidade e as
+entradas dele são filtradas com `startswith`.
+
+A árvore é reconstruída a cada AUTOCOMPLETE_TTL segundos ou logo depois de
+uma alteração em `Cupcake`/`Categoria` feita no próprio processo.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from core.search import WORD_RE, normalize
+
+# Profundidade máxima da árvore, em caracteres
+MAX_DEPTH = 12
+
+_lock = threading.Lock()
+_trie = None
+_built_at = 0.0
+
+
+class PrefixTrie:
+    def __init__(self, max_results):
+        self.max_results = max_results
+        # nó: [filhos {caractere: nó}, entradas]
+        self._root = [{}, []]
+
+    def add(self, text, entry):
+        """
+        Insere `entry` sob o texto normalizado `text` e sob cada sufixo dele
+        que começa em uma palavra. As entradas devem ser inseridas da melhor
+        para a pior: cada nó guarda as primeiras que recebe.
+        """
+        starts = [match.start() for match in WORD_RE.finditer(text)]
+        for start in starts:
+            node = self._root
+            for char in text[start : start + MAX_DEPTH]:
+                node = node[0].setdefault(char, [{}, []])
+                top = node[1]
+                if len(top) < self.max_results and entry not in top:
+                    top.append(entry)
+
+    def find(self, prefix):
+        """
+        Entradas (texto normalizado, dados) cujo texto tem uma palavra começando com `prefix`.
+        """
+        node = self._root
+        for char in prefix[:MAX_DEPTH]:
+            node = node[0].get(char)
+            if node is None:
+                return []
+
+        if len(prefix) <= MAX_DEPTH:
+            return node[1]
+        return [entry for entry in node[1] if _has_word_prefix(entry[0], prefix)]
+
+
+def normalize_words(text):
+    """
+    Texto normalizado com as palavras separadas por um espaço ("Cupcake - Morango" -> "cupcake morango").
+    """
+    return " ".join(WORD_RE.findall(normalize(text or "")))
+
+
+def _has_word_prefix(text, prefix):
+    return any(text.startswith(prefix, match.start()) for match in WORD_RE.finditer(text))
+
+
+def build(max_results=None):
+    """
+    Monta as árvores de cupcakes e categorias a partir do banco.
+    """
+    from core.models import Categoria, Cupcake
+
+    max_results = max_results or settings.AUTOCOMPLETE_MAX_RESULTS
+    cupcakes = PrefixTrie(max_results)
+    # Destaques e os mais avaliados primeiro
+    rows = Cupcake.objects.order_by("-esta_em_destaque", "-rating_count", "titulo").values_list("pk", "titulo")
+    for pk, titulo in rows.iterator(chunk_size=2000):
+        text = normalize_words(titulo)
+        cupcakes.add(text, (text, pk, titulo))
+
+    categorias = PrefixTrie(max_results)
+    for pk, nome in Categoria.objects.order_by("nome_categoria").values_list("pk", "nome_categoria"):
+        text = normalize_words(nome)
+        categorias.add(text, (text, pk, nome))
+
+    return {"cupcakes": cupcakes, "categorias": categorias}
+
+
+def get_tries():
+    global _trie, _built_at
+
+    if _trie is not None and time.monotonic() - _built_at < settings.AUTOCOMPLETE_TTL:
+        return _trie
+
+    with _lock:
+        # Outra thread pode ter reconstruído enquanto esta esperava
+        if _trie is None or time.monotonic() - _built_at >= settings.AUTOCOMPLETE_TTL:
+            _trie = build()
+            _built_at = time.monotonic()
+    return _trie
+
+
+def invalidate():
+    global _built_at
+
+    _built_at = 0.0
+
+
+def suggest(query, limit):
+    """
+    Até `limit` cupcakes e `limit` categorias com uma palavra começando com `query`.
+    """
+    prefix = normalize_words(query)
+    if not prefix:
+        return {"cupcakes": [], "categorias": []}
+
+    tries = get_tries()
+    return {
+        "cupcakes": [(pk, titulo) for _, pk, titulo in tries["cupcakes"].find(prefix)[:limit]],
+        "categorias": [(pk, nome) for _, pk, nome in tries["categorias"].find(prefix)[:limit]],
+    }
@@ -0,0 +1,240 @@
+"""
+Navegação facetada da loja: categoria, etiqueta, cobertura, promoção e faixa
+de preço, com a quantidade de cupcakes de cada opção.
+
+As contagens saem de uma única consulta agrupada (`cube`), que conta os
+cupcakes por combinação de (categoria, etiqueta, cobertura, promoção, faixa
+de preço). O número de combinações cresce com o vocabulário do catálogo, não
+com o número de cupcakes, e a partir delas são calculadas em Python:
+
+- as contagens de cada faceta, aplicando os filtros das *outras* facetas
+  (marcar "Chocolate" não zera as demais categorias, só as restringe);
+- o total de resultados, usado para numerar os links de paginação.
+
+Sem busca, o resultado da consulta (o catálogo inteiro) fica guardado no
+processo por FACETS_CACHE_TTL segundos e é descartado pelos sinais de
+`Cupcake`/`Categoria`; com busca, a consulta roda sobre os ids ranqueados.
+
+As opções marcadas vêm da query string, com valores repetidos para marcar
+mais de uma opção da mesma faceta (`?categoria=1&categoria=3&preco=5-10`):
+opções da mesma faceta se somam (OU) e facetas diferentes se restringem (E).
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from core.models import Categoria
+
+# (parâmetro da query string, título na barra lateral)
+FACETS = (
+    ("categoria", "Categorias"),
+    ("etiqueta", "Etiquetas"),
+    ("cobertura", "Coberturas"),
+    ("sale", "Promoção"),
+    ("preco", "Faixa de Preço"),
+)
+
+SALE_LABELS = {"1": "Em promoção", "0": "Preço normal"}
+
+_lock = threading.Lock()
+_cube = None
+_cube_at = 0.0
+
+
+def price_bands():
+    """
+    Faixas de preço a partir dos limites de SHOP_PRICE_BANDS (5, 10, 20 ->
+    até 5, 5 a 10, 10 a 20, acima de 20): `[(chave, mínimo, máximo, rótulo)]`.
+    """
+    limits = sorted(settings.SHOP_PRICE_BANDS)
+    bands = []
+    for low, high in zip([None] + limits, limits + [None]):
+        key = f"{low or 0}-{high or ''}"
+        if low is None:
+            label = f"Até ${high}"
+        elif high is None:
+            label = f"Acima de ${low}"
+        else:
+            label = f"${low} a ${high}"
+        bands.append((key, low, high, label))
+    return bands
+
+
+def band_expression():
+    """
+    Chave da faixa de preço de `preco_efetivo`, calculada no banco.
+    """
+    bands = price_bands()
+    return Case(
+        *[When(preco_efetivo__lt=high, then=Value(key)) for key, _, high, _ in bands[:-1]],
+        default=Value(bands[-1][0]),
+        output_field=CharField(),
+    )
+
+
+def with_price(queryset):
+    """
+    Anota `preco_efetivo`: o preço promocional quando houver, como na vitrine.
+    """
+    return queryset.annotate(preco_efetivo=Coalesce("preco_sale", "preco"))
+
+
+def selected_options(params):
+    """
+    Opções marcadas em `params` (o `request.GET`), por faceta, ignorando valores inválidos.
+    """
+    bands = {key for key, *_ in price_bands()}
+    selected = {}
+    for name, _ in FACETS:
+        values = {value.strip() for value in params.getlist(name) if value.strip()}
+        if name == "categoria":
+            values = {value for value in values if value.isdigit()}
+        elif name == "sale":
+            values &= set(SALE_LABELS)
+        elif name == "preco":
+            values &= bands
+        if values:
+            selected[name] = values
+    return selected
+
+
+def filter_queryset(queryset, selected):
+    """
+    Restringe `queryset` às opções marcadas.
+    """
+    for name, values in selected.items():
+        if name == "categoria":
+            queryset = queryset.filter(categoria_id__in=values)
+        elif name in ("etiqueta", "cobertura"):
+            queryset = queryset.filter(**{f"{name}__in": values})
+        elif name == "sale":
+            queryset = queryset.filter(sale__in=[value == "1" for value in values])
+        elif name == "preco":
+            condition = Q()
+            for key, low, high, _ in price_bands():
+                if key in values:
+                    band = Q()
+                    if low is not None:
+                        band &= Q(preco_efetivo__gte=low)
+                    if high is not None:
+                        band &= Q(preco_efetivo__lt=high)
+                    condition |= band
+            queryset = with_price(queryset).filter(condition)
+    return queryset
+
+
+def cube(queryset):
+    """
+    Quantidade de cupcakes por combinação de opções, em uma consulta agrupada:
+    `[({faceta: valor}, quantidade), ...]`.
+    """
+    rows = (
+        with_price(queryset.order_by())
+        .annotate(faixa=band_expression())
+        .values_list("categoria_id", "etiqueta", "cobertura", "sale", "faixa")
+        .annotate(total=Count("pk"))
+    )
+    return [
+        (
+            {
+                "categoria": str(categoria_id),
+                "etiqueta": etiqueta,
+                "cobertura": cobertura,
+                "sale": "1" if sale else "0",
+                "preco": faixa,
+            },
+            count,
+        )
+        for categoria_id, etiqueta, cobertura, sale, faixa, count in rows
+    ]
+
+
+def catalog_cube(queryset):
+    """
+    `cube` do catálogo inteiro, guardado no processo por FACETS_CACHE_TTL segundos.
+    """
+    global _cube, _cube_at
+
+    if _cube is not None and time.monotonic() - _cube_at < settings.FACETS_CACHE_TTL:
+        return _cube
+
+    with _lock:
+        if _cube is None or time.monotonic() - _cube_at >= settings.FACETS_CACHE_TTL:
+            _cube = cube(queryset)
+            _cube_at = time.monotonic()
+    return _cube
+
+
+def invalidate():
+    global _cube
+
+    _cube = None
+
+
+def _matches(values, selected, skip=None):
+    return all(values[name] in options for name, options in selected.items() if name != skip)
+
+
+def total(rows, selected):
+    """
+    Quantidade de cupcakes com todas as opções marcadas.
+    """
+    return sum(count for values, count in rows if _matches(values, selected))
+
+
+def facet_counts(rows, selected, params):
+    """
+    Facetas para a barra lateral: `[{"name", "title", "options": [{"value",
+    "label", "count", "selected", "query"}]}]`, em que `query` é a query
+    string que marca ou desmarca a opção (sem a página).
+    """
+    bands = price_bands()
+    categorias = dict(Categoria.objects.values_list("pk", "nome_categoria"))
+
+    facets = []
+    for name, title in FACETS:
+        counts = Counter()
+        for values, count in rows:
+            if _matches(values, selected, skip=name):
+                counts[values[name]] += count
+        chosen = selected.get(name, set())
+
+        if name == "categoria":
+            labels = {str(pk): nome for pk, nome in categorias.items()}
+            order = sorted(counts.keys() | chosen, key=lambda value: labels.get(value, "").lower())
+        elif name == "sale":
+            labels = SALE_LABELS
+            order = [value for value in SALE_LABELS if value in counts or value in chosen]
+        elif name == "preco":
+            labels = {key: label for key, _, _, label in bands}
+            order = [key for key, *_ in bands if key in counts or key in chosen]
+        else:
+            labels = {}
+            order = sorted(counts.keys() | chosen, key=lambda value: (-counts[value], value.lower()))
+
+        options = []
+        for value in order:
+            if value not in labels and name in ("categoria", "sale", "preco"):
+                continue
+            # Um novo filtro volta à página 1: o cursor da página atual não vale para o novo resultado
+            query = params.copy()
+            for param in ("page", "cursor", "csrfmiddlewaretoken"):
+                query.pop(param, None)
+            others = [other for other in query.getlist(name) if other != value]
+            query.setlist(name, others if value in chosen else others + [value])
+            options.append(
+                {
+                    "value": value,
+                    "label": labels.get(value, value),
+                    "count": counts[value],
+                    "selected": value in chosen,
+                    "query": query.urlencode(),
+                }
+            )
+        if options:
+            facets.append({"name": name, "title": title, "options": options})
+    return facets
@@ -0,0 +1,341 @@
+"""
+Busca tolerante a erros de digitação ("cupckae de morango") nos títulos e
+etiquetas dos cupcakes, com um índice de trigramas em memória em cada
+processo (worker do gunicorn).
+
+O índice guarda o vocabulário do catálogo: cada palavra distinta dos títulos,
+etiquetas e coberturas aponta para os cupcakes que a contêm, e cada trigrama
+aponta para as palavras que o contêm. Uma busca corrige cada palavra da
+consulta para as palavras mais parecidas do vocabulário (similaridade de
+Jaccard entre os trigramas, como o `pg_trgm`) e soma as similaridades por
+cupcake. Como o vocabulário é bem menor que o catálogo, uma busca toca poucas
+listas e leva microssegundos mesmo com dezenas de milhares de cupcakes.
+
+A view só consulta este índice quando a busca textual do banco
+(`core.search`) não encontra nada, como correção de erros de digitação. O
+índice é construído em uma thread na primeira dessas buscas do processo; até
+lá, `search` retorna `None`.
+Depois disso ele é mantido incrementalmente: os sinais de `Cupcake` do
+próprio processo atualizam o índice na hora, e a cada FUZZY_SYNC_INTERVAL
+segundos as alterações feitas por outros processos são lidas do banco pelo
+campo `atualizado_em`.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+from core.search import WORD_RE, normalize
+
+logger = logging.getLogger('django')
+
+# Peso das palavras do título em relação às das etiquetas e coberturas
+TITLE_WEIGHT = 2.0
+TAG_WEIGHT = 1.0
+
+# Correções consideradas por palavra da consulta
+CANDIDATES_PER_WORD = 5
+
+# Buscas guardadas por processo até a próxima alteração do índice
+RESULT_CACHE_SIZE = 256
+
+# Combinações de correções avaliadas por busca (ver `TrigramIndex._rank`)
+MAX_COMBINATIONS = 1000
+
+# Palavras comuns que não ajudam a distinguir cupcakes ("cupcake de morango com calda")
+STOPWORDS = frozenset(
+    "a o as os e de da do das dos com sem em na no nas nos para por ao um uma".split()
+)
+
+
+def trigrams(word):
+    """
+    Trigramas de uma palavra normalizada, com as bordas marcadas como no
+    `pg_trgm` ("bolo" -> "  b", " bo", "bol", "olo", "lo ").
+    """
+    padded = f"  {word} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+def document_words(titulo, etiqueta, cobertura):
+    """
+    Palavras de um cupcake com o peso de cada uma (o maior, se repetida).
+    """
+    words = {}
+    for text, weight in ((etiqueta, TAG_WEIGHT), (cobertura, TAG_WEIGHT), (titulo, TITLE_WEIGHT)):
+        for word in WORD_RE.findall(normalize(text or "")):
+            if word in STOPWORDS:
+                continue
+            words[word] = max(weight, words.get(word, 0))
+    return words
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # pk -> {palavra: peso}
+        self._docs = {}
+        # palavra -> {peso: conjunto de pks}
+        self._postings = {}
+        # trigrama -> conjunto de palavras
+        self._trigrams = defaultdict(set)
+        # palavra -> quantidade de trigramas
+        self._sizes = {}
+        # Resultados das últimas buscas, descartados a cada alteração do índice
+        self._results = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, pk, titulo, etiqueta, cobertura):
+        words = document_words(titulo, etiqueta, cobertura)
+        with self._lock:
+            self._remove(pk)
+            self._docs[pk] = words
+            for word, weight in words.items():
+                if word not in self._postings:
+                    self._postings[word] = {}
+                    grams = trigrams(word)
+                    self._sizes[word] = len(grams)
+                    for gram in grams:
+                        self._trigrams[gram].add(word)
+                self._postings[word].setdefault(weight, set()).add(pk)
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        self._results.clear()
+        for word, weight in self._docs.pop(pk, {}).items():
+            postings = self._postings[word]
+            postings[weight].discard(pk)
+            if not postings[weight]:
+                del postings[weight]
+            if postings:
+                continue
+            # Palavra que não aparece em mais nenhum cupcake sai do vocabulário
+            del self._postings[word]
+            del self._sizes[word]
+            for gram in trigrams(word):
+                self._trigrams[gram].discard(word)
+                if not self._trigrams[gram]:
+                    del self._trigrams[gram]
+
+    def ids(self):
+        with self._lock:
+            return set(self._docs)
+
+    def similar_words(self, word, threshold):
+        """
+        Palavras do vocabulário com similaridade >= `threshold`, as mais
+        parecidas primeiro: `[(palavra, similaridade), ...]`.
+        """
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] += 1
+
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + self._sizes[candidate] - count)
+            if similarity >= threshold:
+                similar.append((candidate, similarity))
+        similar.sort(key=lambda item: item[1], reverse=True)
+        return similar[:CANDIDATES_PER_WORD]
+
+    def search(self, query, limit=None, threshold=None):
+        """
+        Ids dos cupcakes mais parecidos com `query`, do mais relevante para o menos.
+
+        Como no índice textual, todas as palavras reconhecidas da consulta
+        precisam aparecer (cada uma por alguma das suas correções); se nenhum
+        cupcake tiver todas, valem os que têm alguma.
+        """
+        threshold = settings.FUZZY_THRESHOLD if threshold is None else threshold
+        limit = limit or settings.SEARCH_MAX_RESULTS
+        key = (normalize(query), limit, threshold)
+
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+
+            terms = []
+            for word in WORD_RE.findall(key[0]):
+                if word not in STOPWORDS:
+                    similar = self.similar_words(word, threshold)
+                    if similar:
+                        terms.append(similar)
+
+            ranked = self._rank(terms, limit)
+
+            if len(self._results) >= RESULT_CACHE_SIZE:
+                self._results.clear()
+            self._results[key] = ranked
+        return ranked
+
+    def _groups(self, similar):
+        """
+        Grupos `(pontuação, pks)` de uma palavra da consulta: cada correção
+        com cada peso (título ou etiqueta) tem uma pontuação fixa.
+        """
+        groups = [
+            (similarity * weight, pks)
+            for word, similarity in similar
+            for weight, pks in self._postings[word].items()
+        ]
+        groups.sort(key=lambda group: group[0], reverse=True)
+        return groups
+
+    def _rank(self, terms, limit):
+        """
+        Percorre as combinações de grupos (um por palavra da consulta) da maior
+        para a menor pontuação total, emitindo a interseção de cada uma até
+        completar `limit`. A primeira combinação em que um cupcake aparece é a
+        de maior pontuação para ele, e as interseções de conjuntos rodam em C,
+        então os cupcakes não são pontuados um a um.
+        """
+        if not terms:
+            return []
+
+        groups = [self._groups(similar) for similar in terms]
+        # Limita o número de combinações em consultas com muitas palavras
+        per_term = max(1, int(MAX_COMBINATIONS ** (1 / len(groups))))
+        combinations = [
+            (sum(score for score, _ in combination), [pks for _, pks in combination])
+            for combination in itertools.product(*(term[:per_term] for term in groups))
+        ]
+        combinations.sort(key=lambda combination: combination[0], reverse=True)
+
+        ranked, seen = [], set()
+        for _, sets in combinations:
+            sets.sort(key=len)
+            found = sets[0].intersection(*sets[1:]) - seen
+            ranked += heapq.nsmallest(limit - len(ranked), found)
+            if len(ranked) == limit:
+                return ranked
+            seen |= found
+
+        if not ranked and len(groups) > 1:
+            # Nenhum cupcake tem todas as palavras: vale o melhor grupo de qualquer uma delas
+            for _, pks in sorted((group for term in groups for group in term), key=lambda group: group[0], reverse=True):
+                ranked += heapq.nsmallest(limit - len(ranked), pks - seen)
+                if len(ranked) == limit:
+                    return ranked
+                seen |= pks
+        return ranked
+
+
+_index = None
+_lock = threading.Lock()
+_building = False
+_synced_at = None  # valor de `atualizado_em` até onde o índice foi sincronizado
+_checked_at = 0.0  # momento (time.monotonic) da última sincronização
+
+
+def search(query, limit=None):
+    """
+    Busca tolerante a erros no índice do processo. Retorna `None` enquanto o
+    índice ainda não foi construído (a construção começa na primeira chamada).
+    """
+    if _index is None:
+        _start(build)
+        return None
+
+    if time.monotonic() - _checked_at > settings.FUZZY_SYNC_INTERVAL:
+        _start(sync)
+    return _index.search(query, limit)
+
+
+def update_cupcake(cupcake):
+    if _index is not None:
+        _index.add(cupcake.pk, cupcake.titulo, cupcake.etiqueta, cupcake.cobertura)
+
+
+def remove_cupcake(pk):
+    if _index is not None:
+        _index.remove(pk)
+
+
+def _start(target):
+    """
+    Executa `target` em uma thread, se nenhuma construção ou sincronização
+    estiver em andamento neste processo.
+    """
+    global _building
+
+    with _lock:
+        if _building:
+            return
+        _building = True
+    threading.Thread(target=_run, args=(target,), name="fuzzy-index", daemon=True).start()
+
+
+def _run(target):
+    global _building
+
+    try:
+        target()
+    except Exception:
+        logger.exception("Erro ao atualizar o índice de busca aproximada.")
+    finally:
+        # Cada construção/sincronização roda em uma thread nova, com conexões próprias
+        connections.close_all()
+        _building = False
+
+
+def build():
+    """
+    Constrói o índice com todos os cupcakes e o publica para as buscas.
+    """
+    from core.models import Cupcake
+
+    global _index, _synced_at, _checked_at
+
+    started = time.perf_counter()
+    index = TrigramIndex()
+    synced_at = None
+    rows = Cupcake.objects.values_list("pk", "titulo", "etiqueta", "cobertura", "atualizado_em")
+    for pk, titulo, etiqueta, cobertura, atualizado_em in rows.iterator(chunk_size=2000):
+        index.add(pk, titulo, etiqueta, cobertura)
+        synced_at = max(synced_at, atualizado_em) if synced_at else atualizado_em
+
+    _index, _synced_at, _checked_at = index, synced_at, time.monotonic()
+    logger.info(
+        f"Índice de busca aproximada construído: {len(index)} cupcakes em "
+        f"{(time.perf_counter() - started) * 1000:.0f}ms."
+    )
+
+
+def sync():
+    """
+    Aplica ao índice as alterações feitas no banco por outros processos:
+    cupcakes criados ou alterados desde a última sincronização e, se o total
+    não bater, os excluídos.
+    """
+    from core.models import Cupcake
+
+    global _synced_at, _checked_at
+
+    rows = Cupcake.objects.values_list("pk", "titulo", "etiqueta", "cobertura", "atualizado_em")
+    if _synced_at is not None:
+        # >= : alterações no mesmo instante da última sincronização são reaplicadas
+        rows = rows.filter(atualizado_em__gte=_synced_at)
+
+    synced_at = _synced_at
+    for pk, titulo, etiqueta, cobertura, atualizado_em in rows.iterator(chunk_size=2000):
+        _index.add(pk, titulo, etiqueta, cobertura)
+        synced_at = max(synced_at, atualizado_em) if synced_at else atualizado_em
+
+    if Cupcake.objects.count() != len(_index):
+        existing = set(Cupcake.objects.values_list("pk", flat=True).iterator(chunk_size=10000))
+        for pk in _index.ids() - existing:
+            _index.remove(pk)
+
+    _synced_at, _checked_at = synced_at, time.monotonic()
@@ -0,0 +1,257 @@
+"""
+Cache em disco das imagens transformadas por `views.get_image`.
+
+`/image/home/banner/1-1.png/?w=600&fm=webp&q=75` gera, na primeira
+requisição, uma cópia da imagem com 600px de largura em WebP e a grava em
+IMAGE_TRANSFORM_CACHE_DIR; as requisições seguintes servem o arquivo do cache.
+
+A chave de cada entrada inclui a data de modificação e o tamanho da imagem
+original, então substituir o arquivo original invalida as transformações
+antigas. Cada acerto atualiza a data de modificação da entrada e, quando o
+cache passa de IMAGE_TRANSFORM_CACHE_MAX_BYTES, as entradas usadas há mais
+tempo são apagadas (LRU).
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils._os import safe_join
+
+from core import imaging
+
+logger = logging.getLogger('django')
+
+# Depois de uma limpeza o cache fica com esta fração do tamanho máximo
+EVICT_TO_RATIO = 0.9
+
+# Intervalo mínimo (segundos) entre duas atualizações da data de acesso de uma entrada
+TOUCH_INTERVAL = 60
+
+_lock = threading.Lock()
+
+# Tamanho estimado do cache, calculado na primeira gravação deste processo
+_cache_size = None
+
+
+def cache_dir():
+    return str(settings.IMAGE_TRANSFORM_CACHE_DIR)
+
+
+def parse_transform(params, name):
+    """
+    Lê os parâmetros `w` (largura), `fm` (formato) e `q` (qualidade) da query string.
+
+    A largura é arredondada para cima até uma das larguras de
+    IMAGE_TRANSFORM_WIDTHS, limitando o número de variantes por imagem.
+    Sem `fm`, ou com um formato que o Pillow instalado não grava, a imagem sai
+    no formato original quando ele é um dos formatos de saída, ou em PNG.
+
+    Retorna `None` se nenhuma transformação foi pedida e levanta `ValueError`
+    para parâmetros inválidos.
+    """
+    if not any(key in params for key in ("w", "fm", "q")):
+        return None
+
+    width = None
+    if params.get("w"):
+        try:
+            width = int(params["w"])
+        except ValueError:
+            raise ValueError(f"Largura inválida: {params['w']}")
+        if width <= 0:
+            raise ValueError(f"Largura inválida: {width}")
+        widths = sorted(settings.IMAGE_TRANSFORM_WIDTHS)
+        width = next((allowed for allowed in widths if allowed >= width), widths[-1])
+
+    image_format = params.get("fm")
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format and image_format not in imaging.OUTPUT_FORMATS:
+        raise ValueError(f"Formato inválido: {image_format}")
+    if not image_format:
+        image_format = fallback_format(name)
+    elif not imaging._format_supported(image_format):
+        logger.warning(f"Formato {image_format} não suportado pelo Pillow; usando {fallback_format(name)}.")
+        image_format = fallback_format(name)
+
+    quality = None
+    if params.get("q"):
+        try:
+            quality = int(params["q"])
+        except ValueError:
+            raise ValueError(f"Qualidade inválida: {params['q']}")
+        if not 1 <= quality <= 100:
+            raise ValueError(f"Qualidade inválida: {quality}")
+
+    return {"width": width, "image_format": image_format, "quality": quality}
+
+
+def source_format(name):
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    return "jpeg" if extension in ("jpg", "jpeg") else extension
+
+
+def fallback_format(name):
+    """
+    Formato de saída quando nenhum outro foi pedido (ou pode ser gravado): o da
+    imagem original se for um dos OUTPUT_FORMATS suportados (GIF, BMP... não
+    são) ou PNG, que o Pillow sempre grava e mantém a transparência.
+    """
+    image_format = source_format(name)
+    if image_format in imaging.OUTPUT_FORMATS and imaging._format_supported(image_format):
+        return image_format
+    return "png"
+
+
+def media_path(page, _type, name):
+    """
+    Caminho em MEDIA_ROOT da imagem de `views.get_image` (`page` "null" = sem subpasta).
+
+    Levanta `SuspiciousFileOperation` para caminhos fora de MEDIA_ROOT.
+    """
+    parts = [_type, name] if page == "null" else [page, _type, name]
+    return safe_join(settings.MEDIA_ROOT, *parts)
+
+
+def source_width(path):
+    """
+    Largura em pixels da imagem `path`, lida apenas do cabeçalho e guardada
+    enquanto o arquivo não mudar, ou `None` se ela não puder ser lida.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _read_width(path, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _read_width(path, mtime_ns, size):
+    try:
+        return imaging.image_size(path)[0]
+    except (OSError, ValueError):
+        return None
+
+
+def transformed_name(name, width=None, image_format=None, quality=None):
+    """
+    Nome de exibição (Content-Disposition e tipo MIME) da imagem transformada.
+    """
+    stem = os.path.splitext(name)[0]
+    extension = imaging.OUTPUT_FORMATS[image_format][1]
+    suffix = f"_{width}w" if width else ""
+    return f"{stem}{suffix}.{extension}"
+
+
+def cache_key(source_path, st, width, image_format, quality):
+    raw = f"{source_path}|{st.st_mtime_ns}|{st.st_size}|{width}|{image_format}|{quality}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_transformed(source_path, width=None, image_format=None, quality=None):
+    """
+    Retorna `(caminho, chave)` da imagem transformada no cache, gerando-a se necessário.
+
+    Levanta `FileNotFoundError` se a imagem original não existir.
+    """
+    st = os.stat(source_path)
+    key = cache_key(source_path, st, width, image_format, quality)
+    extension = imaging.OUTPUT_FORMATS[image_format][1]
+    folder = os.path.join(cache_dir(), key[:2])
+    name = f"{key}.{extension}"
+    path = os.path.join(folder, name)
+
+    try:
+        cached = os.stat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        if time.time() - cached.st_mtime > TOUCH_INTERVAL:
+            _touch(path)
+        return path, key
+
+    imaging.transform_image(source_path, folder, name, width, image_format, quality)
+    logger.info(f"Imagem transformada gerada: {os.path.basename(source_path)} -> {name}")
+
+    _account(os.path.getsize(path))
+    return path, key
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def _scan():
+    """
+    Lista as entradas do cache como `(mtime, tamanho, caminho)`.
+    """
+    entries = []
+    try:
+        folders = list(os.scandir(cache_dir()))
+    except FileNotFoundError:
+        return entries
+
+    for folder in folders:
+        if not folder.is_dir(follow_symlinks=False):
+            continue
+        with os.scandir(folder.path) as files:
+            for entry in files:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    return entries
+
+
+def _account(size):
+    global _cache_size
+
+    with _lock:
+        if _cache_size is None:
+            _cache_size = sum(entry[1] for entry in _scan())
+        else:
+            _cache_size += size
+
+        if _cache_size > settings.IMAGE_TRANSFORM_CACHE_MAX_BYTES:
+            _cache_size = evict()
+
+
+def evict(max_bytes=None):
+    """
+    Apaga as entradas usadas há mais tempo até o cache ocupar no máximo
+    EVICT_TO_RATIO de `max_bytes`, preservando as usadas nos últimos
+    TOUCH_INTERVAL segundos. Retorna o tamanho final do cache.
+
+    Outros processos podem estar limpando o cache ao mesmo tempo; arquivos que
+    já sumiram são ignorados.
+    """
+    max_bytes = settings.IMAGE_TRANSFORM_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = _scan()
+    total = sum(entry[1] for entry in entries)
+    if total <= max_bytes:
+        return total
+
+    target = max_bytes * EVICT_TO_RATIO
+    # Entradas usadas há pouco podem estar sendo servidas neste momento
+    recent = time.time() - TOUCH_INTERVAL
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= target or mtime > recent:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+
+    logger.info(f"Cache de imagens: {removed} entradas removidas ({total} bytes restantes).")
+    return total
@@ -0,0 +1,775 @@
+"""
+Pipeline de processamento das imagens dos cupcakes.
+
+As funções deste módulo rodam dentro dos processos do worker
+(`manage.py image_worker`) e não acessam o banco de dados: recebem o caminho
+do arquivo enviado e devolvem os nomes (relativos a MEDIA_ROOT) das variantes
+geradas. Quem grava os nomes no `CupcakeImage` é `core.tasks.complete_job`.
+
+PIL, rembg e onnxruntime são importados dentro das funções: só os processos
+que de fato processam imagens pagam o tempo de importação e a memória dessas
+bibliotecas (os workers web e o processo pai do `image_worker` não as carregam).
+"""
+import base64
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger('django')
+
+NORMAL_DIR = "cupcakes-fotos/"
+LARGE_DIR = "cupcakes-fotos/large-size"
+SMALL_DIR = "cupcakes-fotos/small-size"
+
+# (campo do CupcakeImage, pasta, tamanho, sufixo do arquivo)
+VARIANTS = (
+    ("normal", NORMAL_DIR, (400, 400), "normal"),
+    ("large_size", LARGE_DIR, (600, 600), "_large"),
+    ("small_size", SMALL_DIR, (140, 140), "_small"),
+)
+
+# Miniatura embutida no HTML enquanto a imagem carrega (LQIP)
+PLACEHOLDER_SIZE = (16, 16)
+PLACEHOLDER_QUALITY = 50
+
+# Cópia do arquivo enviado, usada para gerar as variantes de novo
+ORIGINALS_DIR = "cupcakes-fotos/originals"
+
+# Como o fundo foi removido (IMAGE_BACKGROUND_TIER "auto" escolhe entre os dois por imagem)
+BACKGROUND_MATTE = "matte"
+BACKGROUND_REMBG = "rembg"
+
+# Fração mínima da foto ocupada pelo objeto (e pelo fundo) para o recorte rápido ser confiável
+MATTE_MIN_FOREGROUND = 0.02
+
+# Modelos do rembg cuja sessão aceita várias imagens em uma única inferência
+BATCHED_MODELS = ("u2net", "u2netp", "u2net_human_seg", "silueta")
+
+# Variantes responsivas (srcset), uma por largura em IMAGE_SRCSET_WIDTHS e formato em IMAGE_OUTPUT_FORMATS
+RESPONSIVE_DIR = "cupcakes-fotos/responsive"
+
+# Avatares dos perfis: quadrados de AVATAR_SIZE pixels em JPEG e WebP
+AVATAR_DIR = "profile_images/small"
+
+# formato -> (formato do Pillow, extensão, tipo MIME)
+OUTPUT_FORMATS = {
+    "avif": ("AVIF", "avif", "image/avif"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "png": ("PNG", "png", "image/png"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+# Sessão do rembg (modelo ONNX carregado) compartilhada por todos os jobs do processo
+_session = None
+
+# Pool de threads que gera as variantes de um upload em paralelo (ver `get_encoder`)
+_encoder = None
+
+# Tempo acumulado por etapa do pipeline, preenchido apenas dentro de `measure_stages`
+_stage_times = None
+_stage_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Retorna a sessão do rembg deste processo, carregando o modelo na primeira chamada.
+
+    O modelo é definido por `REMBG_MODEL` e o número de threads do ONNX runtime
+    por `REMBG_INTRA_OP_THREADS` e `REMBG_INTER_OP_THREADS` (0 deixa o ONNX
+    runtime decidir).
+    """
+    global _session
+
+    if _session is None:
+        import onnxruntime as ort
+        from rembg.sessions import sessions_class
+
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = settings.REMBG_INTRA_OP_THREADS
+        sess_opts.inter_op_num_threads = settings.REMBG_INTER_OP_THREADS
+
+        for session_class in sessions_class:
+            if session_class.name() == settings.REMBG_MODEL:
+                break
+        else:
+            raise ValueError(f"Modelo do rembg desconhecido: {settings.REMBG_MODEL}")
+
+        _session = session_class(settings.REMBG_MODEL, sess_opts)
+
+    return _session
+
+
+def warmup():
+    """
+    Carrega o modelo e roda uma inferência pequena, para que o primeiro upload
+    processado pelo worker não pague o custo de inicialização.
+
+    Usado como `initializer` do pool de processos do `image_worker`. Com
+    IMAGE_BACKGROUND_TIER "matte" o modelo nunca é usado e não é carregado.
+    """
+    from PIL import Image
+    from rembg import remove
+
+    if settings.IMAGE_BACKGROUND_TIER == BACKGROUND_MATTE:
+        return
+
+    remove(Image.new("RGB", (64, 64), "white"), session=get_session())
+
+
+@contextmanager
+def stage(name):
+    """
+    Soma o tempo do bloco na etapa `name` quando há uma medição ativa
+    (`measure_stages`); fora dela não faz nada.
+    """
+    if _stage_times is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        # As variantes são geradas em várias threads ao mesmo tempo
+        with _stage_lock:
+            _stage_times[name] = _stage_times.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def measure_stages():
+    """
+    Mede o tempo gasto em cada etapa do pipeline (decode, matte, rembg, resize,
+    encode, write) dentro do bloco. Usado por `manage.py benchmark_images`.
+
+    As etapas executadas em paralelo por `get_encoder` somam o tempo de todas as
+    threads, então a soma das etapas pode passar do tempo total.
+
+        with measure_stages() as times:
+            resize_and_rename_images(...)
+    """
+    global _stage_times
+
+    _stage_times = {}
+    try:
+        yield _stage_times
+    finally:
+        _stage_times = None
+
+
+def _save_image(img, media_root, folder, name, image_format="PNG", **params):
+    """
+    Salva `img` em `media_root/folder/name` e retorna o nome relativo.
+
+    A imagem é escrita em um arquivo temporário e movida com `os.replace`,
+    assim nenhum arquivo incompleto fica visível com o nome final.
+    """
+    path = os.path.join(media_root, folder, name)
+
+    with stage("encode"):
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, **params)
+
+    with stage("write"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Nome temporário único: requisições concorrentes podem gerar o mesmo arquivo
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as output:
+            output.write(buffer.getbuffer())
+        os.replace(tmp_path, path)
+
+    return os.path.join(folder, name)
+
+
+def _format_supported(image_format):
+    """
+    Verifica se o Pillow consegue gravar `image_format` ("webp", "avif"...).
+
+    Para AVIF em versões do Pillow sem suporte nativo, tenta carregar o plugin
+    opcional `pillow-avif-plugin`.
+    """
+    from PIL import features
+
+    if image_format == "png":
+        return True
+    if image_format == "jpeg":
+        return features.check("jpg")
+    if features.check(image_format):
+        return True
+
+    if image_format == "avif":
+        try:
+            import pillow_avif  # noqa
+        except ImportError:
+            return False
+        return True
+
+    return False
+
+
+def _encode_params(image_format, quality=None):
+    if image_format == "webp":
+        return {"quality": quality or settings.IMAGE_WEBP_QUALITY, "method": 4}
+    if image_format == "avif":
+        return {"quality": quality or settings.IMAGE_AVIF_QUALITY}
+    if image_format == "jpeg":
+        return {"quality": quality or settings.IMAGE_JPEG_QUALITY, "optimize": True, "progressive": True}
+    return {}
+
+
+def output_formats():
+    """
+    Formatos de IMAGE_OUTPUT_FORMATS suportados pelo Pillow instalado, na ordem
+    de preferência configurada.
+    """
+    formats = []
+    for image_format in settings.IMAGE_OUTPUT_FORMATS:
+        if image_format not in OUTPUT_FORMATS:
+            logger.warning(f"Formato de imagem desconhecido: {image_format}")
+        elif not _format_supported(image_format):
+            logger.warning(f"Formato {image_format} não suportado pelo Pillow; ignorado.")
+        else:
+            formats.append(image_format)
+    return formats
+
+
+def responsive_variants(cutout, name_prefix, media_root):
+    """
+    Gera as variantes do srcset a partir do recorte, sem ampliar a imagem.
+    Cada largura é reduzida e codificada em uma thread de `get_encoder`.
+
+    Retorna uma lista de dicionários `{"format": ..., "width": ..., "name": ...}`,
+    ordenada por largura e formato.
+    """
+    widths = sorted(set(settings.IMAGE_SRCSET_WIDTHS))
+    # Larguras maiores que o recorte seriam apenas ampliações; a menor é sempre gerada
+    widths = [width for width in widths if width <= cutout.width] or widths[:1]
+    formats = output_formats()
+
+    futures = [
+        get_encoder().submit(_responsive_width, cutout, width, formats, name_prefix, media_root)
+        for width in widths
+    ]
+    return [variant for future in futures for variant in future.result()]
+
+
+def _responsive_width(cutout, width, formats, name_prefix, media_root):
+    from PIL import Image
+
+    with stage("resize"):
+        variant = cutout.resize((width, width), Image.Resampling.LANCZOS)
+
+    responsive = []
+    for image_format in formats:
+        pillow_format, extension, _ = OUTPUT_FORMATS[image_format]
+        name = _save_image(
+            variant,
+            media_root,
+            RESPONSIVE_DIR,
+            f"{name_prefix}_{width}w.{extension}",
+            pillow_format,
+            **_encode_params(image_format),
+        )
+        responsive.append({"format": image_format, "width": width, "name": name})
+    return responsive
+
+
+def remove_backgrounds(images):
+    """
+    Remove o fundo de uma lista de imagens RGB e retorna uma lista de
+    `(recorte RGBA, tier)`, onde o tier é BACKGROUND_MATTE ou BACKGROUND_REMBG.
+
+    Com IMAGE_BACKGROUND_TIER "auto" o recorte rápido (`matte_cutout`) é
+    tentado primeiro e o rembg só roda nas imagens em que a confiança dele ficou
+    abaixo de IMAGE_MATTE_MIN_CONFIDENCE; "matte" usa sempre o recorte rápido e
+    "rembg" sempre o modelo.
+    """
+    tier = settings.IMAGE_BACKGROUND_TIER
+    results = [None] * len(images)
+    uncertain = []
+
+    for index, img in enumerate(images):
+        if tier != BACKGROUND_REMBG:
+            with stage("matte"):
+                cutout, confidence = matte_cutout(img)
+            if tier == BACKGROUND_MATTE or confidence >= settings.IMAGE_MATTE_MIN_CONFIDENCE:
+                results[index] = (cutout, BACKGROUND_MATTE)
+                continue
+            logger.info(f"Recorte rápido incerto (confiança {confidence:.2f}); usando o rembg.")
+        uncertain.append(index)
+
+    if uncertain:
+        with stage("rembg"):
+            cutouts = rembg_cutouts([images[index] for index in uncertain])
+        for index, cutout in zip(uncertain, cutouts):
+            results[index] = (cutout, BACKGROUND_REMBG)
+
+    return results
+
+
+def matte_cutout(img):
+    """
+    Recorte sem ML para fotos de estúdio, com o objeto sobre um fundo liso.
+
+    A cor do fundo é a mediana dos pixels da borda da foto. Pixels próximos
+    dessa cor (até IMAGE_MATTE_TOLERANCE em qualquer canal) e conectados à
+    borda são fundo, como em um flood fill a partir das bordas; regiões da mesma
+    cor dentro do objeto (cobertura branca, por exemplo) são preservadas.
+
+    Retorna `(recorte RGBA, confiança)`. A confiança (0 a 1) é baixa quando a
+    borda da foto não é uniforme, quando o objeto ocupa quase nada ou quase
+    tudo da foto, quando muitos pixels do objeto têm cor parecida com a do
+    fundo (sombras), quando o contorno encontrado não é nítido ou quando o
+    "fundo" inclui uma região de cor diferente do resto (objeto claro em fundo
+    claro), casos em que o recorte não é confiável.
+    """
+    import numpy as np
+    from PIL import Image, ImageFilter
+    from scipy import ndimage
+
+    tolerance = settings.IMAGE_MATTE_TOLERANCE
+    pixels = np.asarray(img, dtype=np.int16)
+
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+
+    # Distância de cada pixel até a cor do fundo: a maior diferença entre os canais
+    distance = np.abs(pixels - background).max(axis=2)
+    border_distance = np.abs(border - background).max(axis=1)
+    border_ratio = float((border_distance <= tolerance).mean())
+
+    labels, _ = ndimage.label(distance <= tolerance)
+    edge_labels = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    foreground = ~np.isin(labels, edge_labels[edge_labels != 0])
+
+    foreground_ratio = float(foreground.mean())
+    if not MATTE_MIN_FOREGROUND <= foreground_ratio <= 1 - MATTE_MIN_FOREGROUND:
+        confidence = 0.0
+    else:
+        # Sombras e reflexos: pixels do objeto só um pouco diferentes do fundo
+        shadow = foreground & (distance > tolerance) & (distance <= tolerance * 3)
+        shadow_ratio = float(shadow.sum()) / float(foreground.sum())
+
+        # Em um contorno nítido, logo depois da borda (2 a 3 px para dentro) o objeto já
+        # é bem diferente do fundo; se não for, o flood fill provavelmente invadiu o objeto
+        inner = ndimage.binary_erosion(foreground, iterations=2)
+        ring = inner & ~ndimage.binary_erosion(inner)
+        edge_ratio = float((distance[ring] > tolerance * 3).mean()) if ring.any() else 0.0
+
+        # Um objeto claro em fundo claro (cobertura branca) vira "fundo" no flood fill, mas
+        # destoa do ruído normal do fundo medido na borda da foto
+        background_mask = ~foreground
+        noise = np.percentile(border_distance, 99) + tolerance / 4
+        leak_ratio = float((distance[background_mask] > noise).mean())
+
+        confidence = min(border_ratio, edge_ratio, 1 - shadow_ratio, 1 - leak_ratio)
+
+    # Suaviza o contorno para evitar o serrilhado de uma máscara binária
+    mask = Image.fromarray(foreground.astype(np.uint8) * 255, mode="L")
+    mask = mask.filter(ImageFilter.GaussianBlur(radius=1))
+
+    cutout = img.convert("RGBA")
+    cutout.putalpha(mask)
+    return cutout, confidence
+
+
+def rembg_cutouts(images):
+    """
+    Remove o fundo com o modelo do rembg.
+
+    Com os modelos da família U2-Net as imagens são enviadas ao ONNX runtime em
+    uma única chamada (um lote com várias imagens); para os demais modelos, ou
+    se o modelo não aceitar lotes, cada imagem passa pelo `rembg.remove`.
+    """
+    from rembg import remove
+
+    session = get_session()
+    if len(images) > 1 and settings.REMBG_MODEL in BATCHED_MODELS:
+        try:
+            return _remove_backgrounds_batched(session, images)
+        except Exception as ex:
+            logger.warning(f"Inferência em lote indisponível ({ex}); processando imagem a imagem.")
+
+    return [remove(img, session=session) for img in images]
+
+
+def _remove_backgrounds_batched(session, images):
+    """
+    Equivalente a `rembg.remove` (sem pós-processamento da máscara) para um lote
+    de imagens, reproduzindo a normalização de `U2netSession.predict`.
+    """
+    import numpy as np
+    from PIL import Image
+    from rembg.bg import naive_cutout
+
+    input_name = session.inner_session.get_inputs()[0].name
+    batch = np.concatenate(
+        [
+            session.normalize(img, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))[input_name]
+            for img in images
+        ]
+    )
+    preds = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+
+    cutouts = []
+    for img, pred in zip(images, preds):
+        pred = (pred - pred.min()) / (pred.max() - pred.min())
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+        mask = mask.resize(img.size, Image.Resampling.LANCZOS)
+        cutouts.append(naive_cutout(img, mask))
+    return cutouts
+
+
+class ImageRejected(ValueError):
+    """
+    Arquivo recusado antes da decodificação por exceder IMAGE_MAX_UPLOAD_BYTES
+    ou IMAGE_MAX_PIXELS; processar de novo não adianta.
+    """
+
+
+def working_size():
+    """
+    Menor lado da imagem de trabalho: a maior saída gerada pelo pipeline
+    (variantes e larguras do srcset). Decodificar acima disso só gasta memória.
+    """
+    sizes = [max(size) for _, _, size, _ in VARIANTS] + list(settings.IMAGE_SRCSET_WIDTHS)
+    return max(sizes)
+
+
+def open_image(source_path, min_size=None):
+    """
+    Abre `source_path` verificando os limites antes de decodificar os pixels e,
+    com `min_size` (largura, altura), já reduzindo a imagem para o menor
+    tamanho que ainda cobre `min_size`.
+
+    JPEGs usam o modo draft do decodificador, que decodifica direto em 1/2, 1/4
+    ou 1/8 da resolução; os demais formatos (e o que sobrar do JPEG) são
+    reduzidos com `Image.reduce`, que é muito mais barato que um resize.
+
+    Levanta `ImageRejected` se o arquivo ou a imagem excederem os limites.
+    """
+    from PIL import Image
+
+    size = os.path.getsize(source_path)
+    if size > settings.IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageRejected(
+            f"Arquivo com {size} bytes excede o limite de {settings.IMAGE_MAX_UPLOAD_BYTES} bytes."
+        )
+
+    # Image.open lê apenas o cabeçalho; os pixels são decodificados no primeiro acesso
+    img = Image.open(source_path)
+    if img.width * img.height > settings.IMAGE_MAX_PIXELS:
+        width, height = img.size
+        img.close()
+        raise ImageRejected(
+            f"Imagem de {width}x{height} pixels excede o limite de {settings.IMAGE_MAX_PIXELS} pixels."
+        )
+
+    if min_size:
+        img = shrink(img, min_size)
+    return img
+
+
+def image_size(source_path):
+    """
+    `(largura, altura)` de `source_path`, lidas só do cabeçalho do arquivo.
+    """
+    from PIL import Image
+
+    with Image.open(source_path) as img:
+        return img.size
+
+
+def shrink(img, min_size):
+    """
+    Reduz uma imagem ainda não decodificada para o menor tamanho que cobre `min_size`.
+    """
+    if img.format == "JPEG":
+        img.draft(None, min_size)
+    factor = min(img.width // min_size[0], img.height // min_size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+
+def _open_rgb(source_path):
+    size = working_size()
+
+    with stage("decode"):
+        img = open_image(source_path, (size, size))
+
+        # O rembg trabalha em RGB; o canal alfa do recorte vem da máscara gerada por ele
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.load()
+
+    return img
+
+
+def reset_peak_rss():
+    """
+    Zera o pico de memória residente do processo (VmHWM), para medir um job
+    isoladamente. Só funciona no Linux; nos demais sistemas o pico medido é o
+    do processo inteiro.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    Pico de memória residente do processo, em bytes, desde o último `reset_peak_rss`.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _save_original(source_path, name_prefix, media_root):
+    """
+    Guarda uma cópia do arquivo enviado, usada para gerar as variantes de novo
+    (`manage.py reprocess_images`) quando tamanhos ou formatos mudarem.
+    """
+    extension = os.path.splitext(source_path)[1].lower()
+    name = os.path.join(ORIGINALS_DIR, f"{name_prefix}{extension}")
+    path = os.path.join(media_root, name)
+
+    with stage("write"):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+
+    return name
+
+
+def save_variants(cutout, name_prefix, media_root):
+    """
+    Reduz o recorte (RGBA) para cada variante de VARIANTS e para o srcset.
+
+    Cada variante (redimensionar, codificar e gravar) roda em uma thread de
+    `get_encoder`: o Pillow libera o GIL nessas etapas, então as variantes de
+    um upload são geradas em paralelo. Os nomes dependem apenas de
+    `name_prefix`, e cada arquivo aparece com o nome final de uma vez
+    (`_save_image`), independentemente da ordem em que as threads terminam.
+    """
+    encoder = get_encoder()
+    futures = {
+        field: encoder.submit(_resize_and_save, cutout, size, media_root, folder, f"{name_prefix}{suffix}.png")
+        for field, folder, size, suffix in VARIANTS
+    }
+    placeholder = encoder.submit(placeholder_data_uri, cutout)
+
+    variants = {"responsive": responsive_variants(cutout, name_prefix, media_root)}
+    for field, future in futures.items():
+        variants[field] = future.result()
+    variants["placeholder"] = placeholder.result()
+
+    return variants
+
+
+def _resize_and_save(cutout, size, media_root, folder, name):
+    from PIL import Image
+
+    with stage("resize"):
+        variant = cutout.resize(size, Image.Resampling.LANCZOS)
+    return _save_image(variant, media_root, folder, name)
+
+
+def get_encoder():
+    """
+    Pool de threads deste processo usado para gerar as variantes, com no
+    máximo IMAGE_ENCODE_THREADS threads (0 usa até 4, limitado pelo número de
+    CPUs). O pool é criado no primeiro uso, já dentro do processo do worker.
+    """
+    global _encoder
+
+    if _encoder is None:
+        threads = settings.IMAGE_ENCODE_THREADS or min(4, os.cpu_count() or 1)
+        _encoder = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-encode")
+    return _encoder
+
+
+def placeholder_data_uri(cutout):
+    """
+    Miniatura de PLACEHOLDER_SIZE pixels (WebP, ou PNG sem suporte a WebP) em
+    uma data URI, exibida pelos templates enquanto a variante real carrega.
+    Tem a mesma proporção (quadrada) das variantes.
+    """
+    from PIL import Image
+
+    image_format = "webp" if _format_supported("webp") else "png"
+    pillow_format, _, content_type = OUTPUT_FORMATS[image_format]
+
+    with stage("resize"):
+        small = cutout.resize(PLACEHOLDER_SIZE, Image.Resampling.BOX)
+    with stage("encode"):
+        buffer = io.BytesIO()
+        small.save(buffer, format=pillow_format, **_encode_params(image_format, PLACEHOLDER_QUALITY))
+
+    return f"data:{content_type};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+
+def resize_and_rename_images(name_prefix, source_path, media_root):
+    """
+    Gera as variantes normal (400x400), large (600x600) e small (140x140)
+    sem fundo a partir do arquivo `source_path`.
+
+    O fundo é removido uma única vez e todas as variantes são reduzidas a
+    partir desse mesmo recorte (RGBA). Assim o rembg roda uma vez por upload e
+    a variante large não é mais ampliada a partir da imagem de 400px. A imagem
+    enviada é decodificada já reduzida para a resolução de trabalho (ver
+    `open_image`), o que limita a memória usada com fotos grandes.
+
+    Os arquivos são nomeados a partir de `name_prefix` (derivado do hash do
+    arquivo original), então o mesmo conteúdo sempre gera os mesmos nomes.
+
+    Retorna um dicionário com os nomes relativos das variantes, no formato
+    `{"normal": ..., "large_size": ..., "small_size": ..., "responsive": [...], "original": ...}`,
+    mais `"peak_rss"`: o pico de memória (bytes) do processo durante o job.
+    """
+    reset_peak_rss()
+
+    img = _open_rgb(source_path)
+
+    # Remove o fundo uma única vez, já na resolução de trabalho
+    cutout, tier = remove_backgrounds([img])[0]
+
+    variants = save_variants(cutout, name_prefix, media_root)
+    variants["background_tier"] = tier
+    variants["original"] = _save_original(source_path, name_prefix, media_root)
+    variants["peak_rss"] = peak_rss()
+
+    return variants
+
+
+def avatar_variants(name_prefix, source_path, media_root):
+    """
+    Gera o avatar quadrado (corte central) de AVATAR_SIZE pixels em JPEG e
+    WebP a partir do arquivo `source_path`, sem remoção de fundo.
+
+    Retorna `{"small": ..., "small_webp": ..., "peak_rss": ...}`, com os nomes
+    relativos a `media_root`.
+    """
+    from PIL import Image, ImageOps
+
+    reset_peak_rss()
+    size = (settings.AVATAR_SIZE, settings.AVATAR_SIZE)
+
+    with stage("decode"):
+        img = open_image(source_path, size)
+        # Fotos de celular vêm giradas, com a orientação apenas no EXIF
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+    with stage("resize"):
+        img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+
+    variants = {}
+    for key, image_format in (("small", "jpeg"), ("small_webp", "webp")):
+        pillow_format, extension, _ = OUTPUT_FORMATS[image_format]
+        variants[key] = _save_image(
+            img, media_root, AVATAR_DIR, f"{name_prefix}.{extension}", pillow_format, **_encode_params(image_format)
+        )
+    variants["peak_rss"] = peak_rss()
+    return variants
+
+
+def reprocess_batch(items, media_root):
+    """
+    Gera novamente as variantes de um lote de assets (`manage.py reprocess_images`).
+
+    `items` é uma lista de `(name_prefix, source_path, is_cutout)`; quando
+    `is_cutout` é verdadeiro a origem já não tem fundo (a variante large de
+    assets antigos, sem original guardado) e o rembg não é executado. As
+    demais imagens do lote passam por uma única chamada de `remove_backgrounds`
+    (as que o recorte rápido não resolver vão juntas para o modelo).
+
+    Retorna uma lista, na ordem de `items`, com o dicionário de variantes (com o
+    `peak_rss` do lote) ou a exceção que impediu o processamento daquele item.
+    """
+    reset_peak_rss()
+
+    results = [None] * len(items)
+    pending = []
+    for index, (name_prefix, source_path, is_cutout) in enumerate(items):
+        try:
+            if is_cutout:
+                img = open_image(source_path).convert("RGBA")
+                results[index] = save_variants(img, name_prefix, media_root)
+            else:
+                pending.append((index, _open_rgb(source_path)))
+        except Exception as ex:
+            results[index] = ex
+
+    if pending:
+        cutouts = remove_backgrounds([img for _, img in pending])
+        for (index, _), (cutout, tier) in zip(pending, cutouts):
+            name_prefix, source_path, _ = items[index]
+            try:
+                results[index] = save_variants(cutout, name_prefix, media_root)
+                results[index]["background_tier"] = tier
+                results[index]["original"] = _save_original(source_path, name_prefix, media_root)
+            except Exception as ex:
+                results[index] = ex
+
+    # O pico é do lote inteiro
+    rss = peak_rss()
+    for result in results:
+        if isinstance(result, dict):
+            result["peak_rss"] = rss
+
+    return results
+
+
+def transform_image(source_path, dest_dir, dest_name, width=None, image_format=None, quality=None):
+    """
+    Gera uma cópia de `source_path` com no máximo `width` pixels de largura
+    (mantendo a proporção, sem ampliar), no formato `image_format` e com a
+    qualidade `quality`, salva em `dest_dir/dest_name`.
+
+    Usado pelo cache de transformações de `views.get_image` (`core.image_cache`).
+    Levanta `ImageRejected` se o arquivo não for uma imagem que o Pillow reconheça.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        img = open_image(source_path)
+    except UnidentifiedImageError:
+        raise ImageRejected(f"{os.path.basename(source_path)} não é uma imagem válida.")
+    if width and width < img.width:
+        height = max(1, round(img.height * width / img.width))
+        img = shrink(img, (width, height))
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+
+    pillow_format, _, _ = OUTPUT_FORMATS[image_format]
+    if image_format == "jpeg" and img.mode != "RGB":
+        img = img.convert("RGB")
+    elif img.mode == "P":
+        img = img.convert("RGBA")
+
+    return _save_image(img, dest_dir, "", dest_name, pillow_format, **_encode_params(image_format, quality))
@@ -0,0 +1,208 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core import imaging
+
+# Imagens de exemplo versionadas no repositório
+CORPUS = ("input_image.jpg", "default_cupcakes.jpeg")
+
+STAGES = ("decode", "matte", "rembg", "resize", "encode", "write")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o pipeline de imagens (resize_and_rename_images) sobre as imagens de exemplo "
+        "em várias resoluções e grava os resultados em JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="original,1024,2048,4032",
+            help="Lado maior das imagens geradas a partir do corpus ('original' mantém o arquivo).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Execuções por imagem; o relatório usa a mediana.",
+        )
+        parser.add_argument(
+            "--tier",
+            choices=["auto", imaging.BACKGROUND_MATTE, imaging.BACKGROUND_REMBG],
+            default=settings.IMAGE_BACKGROUND_TIER,
+            help="Tier de remoção de fundo usado no benchmark.",
+        )
+        parser.add_argument(
+            "--output",
+            default="image_benchmark.json",
+            help="Arquivo JSON com os resultados.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="JSON de uma execução anterior para comparar os tempos.",
+        )
+
+    def handle(self, *args, **options):
+        repeat = max(1, options["repeat"])
+        baseline = self.load_baseline(options["compare"])
+
+        with tempfile.TemporaryDirectory() as workdir, override_settings(
+            IMAGE_BACKGROUND_TIER=options["tier"]
+        ):
+            corpus = self.build_corpus(workdir, options["sizes"].split(","))
+
+            # Carrega as bibliotecas (e o modelo, se for usado) fora das medições
+            imaging.warmup()
+            self.run_pipeline(corpus[0][1], os.path.join(workdir, "warmup"))
+
+            cases = []
+            for case, path in corpus:
+                runs = [
+                    self.run_pipeline(path, os.path.join(workdir, f"media-{case}-{index}"))
+                    for index in range(repeat)
+                ]
+                cases.append(self.summarize(case, path, runs))
+                self.print_case(cases[-1], baseline.get(case))
+
+        results = {
+            "created_at": timezone.now().isoformat(),
+            "environment": self.environment(options["tier"]),
+            "repeat": repeat,
+            "cases": cases,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(results, output, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {options['output']}."))
+
+    def build_corpus(self, workdir, sizes):
+        """
+        Gera as versões de cada imagem do corpus com o lado maior em cada tamanho
+        de `sizes`. Retorna uma lista de `(nome do caso, caminho)`.
+        """
+        from PIL import Image
+
+        corpus = []
+        for filename in CORPUS:
+            source = os.path.join(settings.BASE_DIR, filename)
+            stem = os.path.splitext(filename)[0]
+            for size in sizes:
+                size = size.strip()
+                if size == "original":
+                    corpus.append((f"{stem}@original", source))
+                    continue
+
+                with Image.open(source) as img:
+                    scale = int(size) / max(img.size)
+                    resized = img.convert("RGB").resize(
+                        (round(img.width * scale), round(img.height * scale)),
+                        Image.Resampling.LANCZOS,
+                    )
+                path = os.path.join(workdir, f"{stem}@{size}.jpg")
+                resized.save(path, quality=90)
+                corpus.append((f"{stem}@{size}", path))
+        return corpus
+
+    def run_pipeline(self, path, media_root):
+        imaging.reset_peak_rss()
+        started = time.perf_counter()
+        with imaging.measure_stages() as stages:
+            variants = imaging.resize_and_rename_images("bench", path, media_root)
+        total = time.perf_counter() - started
+
+        names = [variants["normal"], variants["large_size"], variants["small_size"]]
+        names += [variant["name"] for variant in variants["responsive"]]
+        output_bytes = sum(os.path.getsize(os.path.join(media_root, name)) for name in names)
+
+        return {
+            "total": total,
+            "stages": dict(stages),
+            "peak_rss": variants["peak_rss"],
+            "output_bytes": output_bytes,
+            "placeholder_bytes": len(variants["placeholder"]),
+            "background_tier": variants["background_tier"],
+        }
+
+    def summarize(self, case, path, runs):
+        from PIL import Image
+
+        with Image.open(path) as img:
+            width, height = img.size
+
+        return {
+            "case": case,
+            "width": width,
+            "height": height,
+            "input_bytes": os.path.getsize(path),
+            "total_seconds": statistics.median(run["total"] for run in runs),
+            "stages_seconds": {
+                stage: statistics.median(run["stages"].get(stage, 0.0) for run in runs)
+                for stage in STAGES
+            },
+            "peak_rss_bytes": max(run["peak_rss"] or 0 for run in runs),
+            "output_bytes": runs[-1]["output_bytes"],
+            "placeholder_bytes": runs[-1]["placeholder_bytes"],
+            "background_tier": runs[-1]["background_tier"],
+        }
+
+    def print_case(self, result, previous):
+        stages = " ".join(
+            f"{stage}={seconds * 1000:.0f}ms"
+            for stage, seconds in result["stages_seconds"].items()
+            if seconds
+        )
+        line = (
+            f"{result['case']:<28} {result['width']}x{result['height']:<6} "
+            f"total={result['total_seconds'] * 1000:.0f}ms {stages} "
+            f"rss={result['peak_rss_bytes'] / 1024 / 1024:.0f}MB "
+            f"saida={result['output_bytes'] / 1024:.0f}KB tier={result['background_tier']}"
+        )
+        if previous:
+            change = (result["total_seconds"] / previous["total_seconds"] - 1) * 100
+            line += f" ({change:+.1f}% vs. anterior)"
+        self.stdout.write(line)
+
+    def load_baseline(self, path):
+        if not path:
+            return {}
+        try:
+            with open(path) as baseline_file:
+                return {case["case"]: case for case in json.load(baseline_file)["cases"]}
+        except (OSError, ValueError, KeyError) as ex:
+            raise CommandError(f"Não foi possível ler {path}: {ex}")
+
+    def environment(self, tier):
+        from PIL import __version__ as pillow_version
+
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+        except OSError:
+            commit = ""
+
+        return {
+            "commit": commit,
+            "python": platform.python_version(),
+            "pillow": pillow_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "background_tier": tier,
+            "rembg_model": settings.REMBG_MODEL,
+            "output_formats": list(settings.IMAGE_OUTPUT_FORMATS),
+            "srcset_widths": list(settings.IMAGE_SRCSET_WIDTHS),
+        }
@@ -0,0 +1,169 @@
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from core import imaging
+from core.models import ImageAsset, ImageJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove de MEDIA_ROOT os arquivos que nenhum registro referencia (variantes antigas, "
+        "uploads substituídos, temporários de gravações interrompidas)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Apenas lista os arquivos órfãos, sem apagar.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Quantidade de arquivos apagados por lote.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="Ignora arquivos modificados há menos de N segundos (uploads e jobs em andamento).",
+        )
+        parser.add_argument(
+            "--path",
+            action="append",
+            default=[],
+            help="Limita a limpeza a esta pasta de MEDIA_ROOT (pode ser repetido).",
+        )
+
+    def handle(self, *args, **options):
+        media_root = str(settings.MEDIA_ROOT)
+        roots = options["path"] or self.managed_dirs()
+        batch_size = max(1, options["batch_size"])
+        cutoff = time.time() - options["min_age"]
+
+        referenced = self.referenced_names()
+        self.stdout.write(self.style.NOTICE(f"{len(referenced)} arquivo(s) referenciado(s) no banco."))
+
+        scanned = orphans = removed = freed = 0
+        batch = []
+        for name, st in self.walk(media_root, roots):
+            scanned += 1
+            if name in referenced or st.st_mtime > cutoff:
+                continue
+
+            orphans += 1
+            freed += st.st_size
+            if options["dry_run"]:
+                self.stdout.write(f"{name} ({st.st_size} bytes)")
+                continue
+
+            batch.append(name)
+            if len(batch) >= batch_size:
+                removed += self.remove_batch(media_root, batch)
+                batch = []
+
+        if batch:
+            removed += self.remove_batch(media_root, batch)
+
+        summary = f"{scanned} arquivo(s) verificado(s), {orphans} órfão(s) ({freed / 1024 / 1024:.1f} MB)"
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{summary}; nada foi apagado (--dry-run)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{summary}; {removed} apagado(s)."))
+
+    def managed_dirs(self):
+        """
+        Pastas onde a aplicação grava arquivos: os `upload_to` dos campos de
+        arquivo e as pastas do pipeline de imagens. As demais pastas de mídia
+        (banners, logos servidos por `get_image`...) não são tocadas.
+        """
+        dirs = {
+            imaging.NORMAL_DIR,
+            imaging.LARGE_DIR,
+            imaging.SMALL_DIR,
+            imaging.RESPONSIVE_DIR,
+            imaging.ORIGINALS_DIR,
+        }
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, models.FileField) and isinstance(field.upload_to, str):
+                    dirs.add(field.upload_to)
+
+        # Pastas aninhadas já são percorridas pela pasta de cima
+        dirs = sorted(os.path.normpath(path) for path in dirs if path.strip("/"))
+        return [path for path in dirs if not any(path.startswith(f"{other}{os.sep}") for other in dirs)]
+
+    def referenced_names(self):
+        """
+        Nomes (relativos a MEDIA_ROOT) de todos os arquivos referenciados, com
+        uma consulta por campo de arquivo.
+        """
+        referenced = {settings.DEFAULT_CUPCAKE_IMAGE}
+
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, models.FileField) or not field.concrete:
+                    continue
+                if isinstance(field.default, str):
+                    referenced.add(field.default)
+                names = (
+                    model._default_manager.exclude(**{f"{field.name}__isnull": True})
+                    .exclude(**{field.name: ""})
+                    .values_list(field.name, flat=True)
+                )
+                referenced.update(names.iterator(chunk_size=2000))
+
+        assets = ImageAsset.objects.values_list("normal", "large_size", "small_size", "original", "responsive")
+        for normal, large_size, small_size, original, responsive in assets.iterator(chunk_size=2000):
+            referenced.update((normal, large_size, small_size, original))
+            referenced.update(variant["name"] for variant in responsive)
+
+        # Uploads que ainda esperam o worker
+        pending = ImageJob.objects.filter(
+            status__in=[ImageJob.PENDENTE, ImageJob.PROCESSANDO, ImageJob.AGUARDANDO]
+        )
+        referenced.update(pending.values_list("source", flat=True).iterator(chunk_size=2000))
+
+        referenced.discard("")
+        return {os.path.normpath(name) for name in referenced}
+
+    def walk(self, media_root, roots):
+        """
+        Percorre as pastas com `os.scandir`, gerando `(nome relativo, stat)` de
+        cada arquivo sem montar a lista completa em memória.
+        """
+        stack = [os.path.join(media_root, root) for root in roots]
+        while stack:
+            path = stack.pop()
+            try:
+                entries = os.scandir(path)
+            except FileNotFoundError:
+                continue
+
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        yield os.path.relpath(entry.path, media_root), st
+
+    def remove_batch(self, media_root, names):
+        removed = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(media_root, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self.stdout.write(f"{removed} arquivo(s) apagado(s) neste lote.")
+        return removed
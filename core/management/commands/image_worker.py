@@ -0,0 +1,108 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import imaging, tasks
+
+
+def format_peak(peak_rss):
+    if not peak_rss:
+        return ""
+    return f" (pico de memória: {peak_rss / 1024 / 1024:.0f} MB)"
+
+
+class Command(BaseCommand):
+    help = (
+        "Processa a fila de imagens dos cupcakes (redimensionamento e remoção de fundo) e dos "
+        "avatares em um pool de processos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.IMAGE_WORKER_PROCESSES,
+            help="Número de processos do pool.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.IMAGE_WORKER_POLL_INTERVAL,
+            help="Segundos de espera quando a fila está vazia.",
+        )
+        parser.add_argument(
+            "--no-warmup",
+            action="store_true",
+            help="Não pré-carrega o modelo do rembg ao iniciar cada processo.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Processa os jobs pendentes e encerra.",
+        )
+
+    def handle(self, *args, **options):
+        processes = max(1, options["processes"])
+
+        requeued = tasks.requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"{requeued} job(s) travado(s) devolvido(s) para a fila."))
+
+        self.stdout.write(self.style.NOTICE(f"Worker de imagens iniciado com {processes} processo(s)."))
+
+        # Os processos filhos não usam o banco; fecha as conexões antes do fork
+        connections.close_all()
+
+        # Cada processo carrega o modelo uma vez e o reutiliza em todos os jobs
+        initializer = None if options["no_warmup"] else imaging.warmup
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=initializer) as pool:
+            while True:
+                jobs = tasks.claim_jobs(processes * 2)
+
+                if not jobs:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                futures = {self.submit(pool, job): job for job in jobs}
+
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        variants = future.result()
+                    except Exception as ex:
+                        tasks.fail_job(job, ex)
+                        self.stdout.write(self.style.ERROR(f"Job {job.pk} falhou: {ex}"))
+                        continue
+
+                    if job.profile_id:
+                        tasks.complete_avatar_job(job, variants)
+                    else:
+                        tasks.complete_job(job, variants)
+                    self.stdout.write(
+                        self.style.SUCCESS(f"Job {job.pk} concluído{format_peak(variants.get('peak_rss'))}.")
+                    )
+
+        self.stdout.write(self.style.SUCCESS("Fila de imagens vazia."))
+
+    def submit(self, pool, job):
+        source_path = os.path.join(settings.MEDIA_ROOT, job.source)
+        if job.profile_id:
+            return pool.submit(
+                imaging.avatar_variants,
+                tasks.avatar_prefix(job.profile_id, job.sha256),
+                source_path,
+                str(settings.MEDIA_ROOT),
+            )
+        return pool.submit(
+            imaging.resize_and_rename_images,
+            tasks.variant_prefix(job.sha256),
+            source_path,
+            str(settings.MEDIA_ROOT),
+        )
@@ -0,0 +1,52 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import imaging, tasks
+from core.models import ImageAsset
+
+
+class Command(BaseCommand):
+    help = "Gera uma única vez as variantes da imagem padrão, compartilhadas por todos os cupcakes novos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Gera as variantes novamente mesmo que já existam.",
+        )
+
+    def handle(self, *args, **options):
+        source = settings.DEFAULT_CUPCAKE_IMAGE
+        source_path = os.path.join(settings.MEDIA_ROOT, source)
+
+        # A imagem padrão versionada no repositório é copiada para a pasta de mídia
+        if not os.path.exists(source_path):
+            os.makedirs(os.path.dirname(source_path), exist_ok=True)
+            shutil.copy(os.path.join(settings.BASE_DIR, tasks.DEFAULT_IMAGE_NAME), source_path)
+            self.stdout.write(self.style.NOTICE(f"Imagem padrão copiada para {source_path}."))
+
+        sha256 = tasks.hash_media_file(source)
+        asset = ImageAsset.objects.filter(sha256=sha256).first()
+
+        if asset and not options["force"]:
+            tasks.mark_default_asset(asset)
+            self.stdout.write(self.style.SUCCESS(f"Variantes padrão já existem ({sha256[:12]})."))
+            return
+
+        self.stdout.write(self.style.NOTICE("Gerando as variantes da imagem padrão..."))
+        variants = imaging.resize_and_rename_images(
+            tasks.variant_prefix(sha256), source_path, str(settings.MEDIA_ROOT)
+        )
+        variants.pop("peak_rss", None)
+
+        if asset:
+            # Também atualiza as imagens dos cupcakes que usam as variantes padrão
+            tasks.update_asset_variants(asset.pk, variants)
+        else:
+            asset = ImageAsset.objects.create(sha256=sha256, **variants)
+        tasks.mark_default_asset(asset)
+
+        self.stdout.write(self.style.SUCCESS(f"Variantes padrão geradas ({sha256[:12]})."))
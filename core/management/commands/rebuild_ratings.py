@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Cupcake
+from core.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recalcula a soma, a quantidade e a média das avaliações guardadas em cada cupcake"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cupcake",
+            type=int,
+            action="append",
+            default=[],
+            help="Recalcula apenas este cupcake (pode ser repetido).",
+        )
+
+    def handle(self, *args, **options):
+        cupcakes = Cupcake.objects.all()
+        if options["cupcake"]:
+            cupcakes = cupcakes.filter(pk__in=options["cupcake"])
+
+        updated = rebuild_ratings(cupcakes)
+        self.stdout.write(self.style.SUCCESS(f"Avaliações recalculadas para {updated} cupcake(s)."))
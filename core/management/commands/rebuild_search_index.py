@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import search
+from core.models import Cupcake
+
+
+class Command(BaseCommand):
+    help = "Recria o índice de busca textual dos cupcakes (FTS5 no SQLite, tsvector no PostgreSQL)"
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING(f"O banco {connection.vendor} não tem índice de busca."))
+            return
+
+        with transaction.atomic():
+            search.create_index(connection)
+            count = search.rebuild(Cupcake.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"{count} cupcake(s) indexado(s)."))
@@ -0,0 +1,255 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import imaging, tasks
+from core.models import CupcakeImage, ImageAsset, Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera novamente as variantes de todas as imagens dos cupcakes (por exemplo, depois de "
+        "mudar tamanhos ou formatos) em um pool de processos, com checkpoint para retomar"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cupcake",
+            type=int,
+            action="append",
+            default=[],
+            help="Processa apenas as imagens deste cupcake (pode ser repetido).",
+        )
+        parser.add_argument(
+            "--categoria",
+            type=int,
+            action="append",
+            default=[],
+            help="Processa apenas as imagens dos cupcakes desta categoria (pode ser repetido).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.IMAGE_WORKER_PROCESSES,
+            help="Número de processos do pool.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.IMAGE_REPROCESS_BATCH_SIZE,
+            help="Imagens enviadas juntas para uma mesma inferência do modelo.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.BASE_DIR, "reprocess_images.checkpoint.json"),
+            help="Arquivo onde o progresso é salvo.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continua a partir do checkpoint de uma execução interrompida.",
+        )
+        parser.add_argument(
+            "--avatars",
+            action="store_true",
+            help="Enfileira os avatares sem variantes para o image_worker e encerra.",
+        )
+        parser.add_argument(
+            "--no-warmup",
+            action="store_true",
+            help="Não pré-carrega o modelo do rembg ao iniciar cada processo.",
+        )
+
+    def handle(self, *args, **options):
+        if options["avatars"]:
+            return self.enqueue_avatars()
+
+        processes = max(1, options["processes"])
+        batch_size = max(1, options["batch_size"])
+        checkpoint_path = options["checkpoint"]
+        filters = {"cupcake": sorted(options["cupcake"]), "categoria": sorted(options["categoria"])}
+
+        last_pk = 0
+        if options["resume"]:
+            last_pk = self.load_checkpoint(checkpoint_path, filters)
+            self.stdout.write(self.style.NOTICE(f"Retomando a partir do asset {last_pk}."))
+
+        self.adopt_legacy_images(filters)
+
+        items = self.get_items(self.get_assets(filters).filter(pk__gt=last_pk))
+        total = len(items)
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Nenhuma imagem para processar."))
+            self.remove_checkpoint(checkpoint_path)
+            return
+
+        self.stdout.write(
+            self.style.NOTICE(
+                f"Processando {total} imagem(ns) com {processes} processo(s), lotes de {batch_size}."
+            )
+        )
+
+        # Os processos filhos não usam o banco; fecha as conexões antes do fork.
+        # Os lotes já estão em memória, então o pai só volta ao banco para
+        # gravar os resultados, depois que todos os processos foram criados.
+        connections.close_all()
+
+        initializer = None if options["no_warmup"] else imaging.warmup
+        batches = (items[start : start + batch_size] for start in range(0, total, batch_size))
+
+        done = failed = peak_rss = 0
+        started = time.perf_counter()
+        # Lotes enviados, em ordem de pk; o checkpoint avança até o primeiro lote ainda não concluído
+        in_flight = []
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=initializer) as pool:
+            futures = {}
+            exhausted = False
+
+            while True:
+                while not exhausted and len(futures) < processes * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    future = pool.submit(imaging.reprocess_batch, [item for _, item in batch], str(settings.MEDIA_ROOT))
+                    futures[future] = batch
+                    in_flight.append([batch[-1][0], False])
+
+                if not futures:
+                    break
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = futures.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as ex:
+                        results = [ex] * len(batch)
+
+                    # Todos os itens de um lote têm o mesmo pico (o do processo durante o lote)
+                    peaks = [result["peak_rss"] or 0 for result in results if isinstance(result, dict)]
+                    peak_rss = max([peak_rss] + peaks)
+
+                    for (asset_pk, _), result in zip(batch, results):
+                        if isinstance(result, Exception):
+                            failed += 1
+                            self.stdout.write(self.style.ERROR(f"Asset {asset_pk} falhou: {result}"))
+                        else:
+                            tasks.update_asset_variants(asset_pk, result)
+                            done += 1
+
+                    for entry in in_flight:
+                        if entry[0] == batch[-1][0]:
+                            entry[1] = True
+
+                while in_flight and in_flight[0][1]:
+                    last_pk = in_flight.pop(0)[0]
+                self.save_checkpoint(checkpoint_path, filters, last_pk)
+
+                elapsed = time.perf_counter() - started
+                processed = done + failed
+                rate = processed / elapsed if elapsed else 0
+                remaining = (total - processed) / rate if rate else 0
+                self.stdout.write(
+                    f"{processed}/{total} imagem(ns) - {rate:.2f} img/s - restante ~{remaining:.0f}s"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.remove_checkpoint(checkpoint_path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{done} imagem(ns) processada(s), {failed} com erro, em {elapsed:.1f}s "
+                f"({(done + failed) / elapsed:.2f} img/s, pico de memória por processo: "
+                f"{peak_rss / 1024 / 1024:.0f} MB)."
+            )
+        )
+
+    def enqueue_avatars(self):
+        default = Profile._meta.get_field("avatar").default
+        profiles = Profile.objects.filter(avatar_small="").exclude(avatar__in=["", default])
+
+        queued = 0
+        for profile in profiles.iterator():
+            try:
+                tasks.enqueue_avatar_job(profile)
+            except FileNotFoundError as ex:
+                self.stdout.write(self.style.WARNING(str(ex)))
+                continue
+            queued += 1
+        self.stdout.write(self.style.SUCCESS(f"{queued} avatar(es) enviado(s) para o image_worker."))
+
+    def get_assets(self, filters):
+        assets = ImageAsset.objects.all()
+        if filters["cupcake"]:
+            assets = assets.filter(images__cupcake_id__in=filters["cupcake"])
+        if filters["categoria"]:
+            assets = assets.filter(images__cupcake__categoria_id__in=filters["categoria"])
+        return assets.distinct().order_by("pk")
+
+    def adopt_legacy_images(self, filters):
+        """
+        Cria os assets das imagens processadas antes deles existirem (ver
+        `tasks.adopt_legacy_image`), que de outra forma não seriam reprocessadas.
+        """
+        images = CupcakeImage.objects.filter(asset__isnull=True, _processed=True).exclude(normal="")
+        if filters["cupcake"]:
+            images = images.filter(cupcake_id__in=filters["cupcake"])
+        if filters["categoria"]:
+            images = images.filter(cupcake__categoria_id__in=filters["categoria"])
+
+        adopted = 0
+        for image in list(images.order_by("pk")):
+            try:
+                if tasks.adopt_legacy_image(image):
+                    adopted += 1
+            except FileNotFoundError as ex:
+                self.stdout.write(self.style.WARNING(f"Imagem {image.pk} sem recorte: {ex}"))
+        if adopted:
+            self.stdout.write(self.style.NOTICE(f"{adopted} imagem(ns) antiga(s) ligada(s) a um asset."))
+
+    def get_items(self, assets):
+        """
+        Lista de `(asset_pk, (prefixo, caminho de origem, is_cutout))`, em ordem de pk.
+
+        É carregada inteira antes de criar os processos: nenhum cursor fica
+        aberto enquanto os resultados são gravados.
+        """
+        items = []
+        for asset in assets:
+            try:
+                source_path, is_cutout = tasks.reprocess_source(asset)
+            except FileNotFoundError as ex:
+                self.stdout.write(self.style.WARNING(str(ex)))
+                continue
+            items.append((asset.pk, (tasks.variant_prefix(asset.sha256), source_path, is_cutout)))
+        return items
+
+    def load_checkpoint(self, path, filters):
+        try:
+            with open(path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            raise CommandError(f"Checkpoint {path} não encontrado.")
+
+        if checkpoint["filters"] != filters:
+            raise CommandError(
+                f"O checkpoint foi criado com outros filtros ({checkpoint['filters']}); "
+                "use os mesmos --cupcake/--categoria ou rode sem --resume."
+            )
+        return checkpoint["last_pk"]
+
+    def save_checkpoint(self, path, filters, last_pk):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump({"filters": filters, "last_pk": last_pk}, checkpoint_file)
+        os.replace(tmp_path, path)
+
+    def remove_checkpoint(self, path):
+        if os.path.exists(path):
+            os.remove(path)
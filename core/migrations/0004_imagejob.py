@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_contact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Nome do arquivo original (relativo a MEDIA_ROOT) no momento do envio.', max_length=255)),
+                ('status', models.CharField(choices=[('Pendente', 'Pendente'), ('Processando', 'Processando'), ('Concluido', 'Concluído'), ('Falhou', 'Falhou')], default='Pendente', help_text='Status do processamento.', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Número de tentativas de processamento.')),
+                ('error', models.TextField(blank=True, help_text='Último erro ocorrido no processamento.', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('image', models.ForeignKey(help_text='A imagem que será processada.', on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='core.cupcakeimage')),
+            ],
+            options={
+                'verbose_name': 'Processamento de Imagem',
+                'verbose_name_plural': 'Processamentos de Imagens',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='core_imagej_status_c1b230_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_imagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(help_text='Hash SHA-256 do arquivo original enviado.', max_length=64, unique=True)),
+                ('normal', models.CharField(help_text='Variante normal (relativa a MEDIA_ROOT).', max_length=255)),
+                ('large_size', models.CharField(help_text='Variante large (relativa a MEDIA_ROOT).', max_length=255)),
+                ('small_size', models.CharField(help_text='Variante small (relativa a MEDIA_ROOT).', max_length=255)),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Quantidade de imagens de cupcakes que usam estas variantes.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Arquivo de Imagem',
+                'verbose_name_plural': 'Arquivos de Imagens',
+            },
+        ),
+        migrations.AddField(
+            model_name='imagejob',
+            name='sha256',
+            field=models.CharField(blank=True, help_text='Hash SHA-256 do arquivo original.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cupcakeimage',
+            name='asset',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Variantes compartilhadas usadas por esta imagem.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='images', to='core.imageasset'),
+        ),
+    ]
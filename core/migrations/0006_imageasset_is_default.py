@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_imageasset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='is_default',
+            field=models.BooleanField(default=False, help_text='Variantes da imagem padrão dos cupcakes; nunca são apagadas.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_imageasset_is_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='responsive',
+            field=models.JSONField(blank=True, default=list, help_text='Variantes do srcset: lista de {format, width, name}.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_imageasset_responsive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='original',
+            field=models.CharField(blank=True, default='', help_text='Cópia do arquivo enviado, usada para gerar as variantes de novo.', max_length=255),
+        ),
+    ]
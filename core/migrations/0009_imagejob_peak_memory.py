@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_imageasset_original'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='peak_memory',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Pico de memória (bytes) do processo do worker durante o job.', null=True),
+        ),
+    ]
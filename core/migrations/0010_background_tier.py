@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_imagejob_peak_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupcakeimage',
+            name='background_tier',
+            field=models.CharField(blank=True, choices=[('matte', 'Recorte rápido (fundo liso)'), ('rembg', 'Modelo rembg')], default='', editable=False, help_text='Como o fundo da imagem foi removido (para auditoria).', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='background_tier',
+            field=models.CharField(blank=True, choices=[('matte', 'Recorte rápido (fundo liso)'), ('rembg', 'Modelo rembg')], default='', help_text='Como o fundo da imagem foi removido.', max_length=10),
+        ),
+    ]
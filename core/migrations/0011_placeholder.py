@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_background_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupcakeimage',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Miniatura de 16px em data URI, exibida enquanto a imagem carrega.'),
+        ),
+        migrations.AddField(
+            model_name='imageasset',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', help_text='Miniatura de 16px em data URI, exibida enquanto as variantes carregam.'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='profile',
+            field=models.ForeignKey(blank=True, help_text='O perfil cujo avatar será processado.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='avatar_jobs', to='core.profile'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_small',
+            field=models.ImageField(blank=True, editable=False, help_text='Avatar quadrado reduzido em JPEG.', upload_to='profile_images/small'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_small_webp',
+            field=models.ImageField(blank=True, editable=False, help_text='Avatar quadrado reduzido em WebP.', upload_to='profile_images/small'),
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='image',
+            field=models.ForeignKey(blank=True, help_text='A imagem que será processada.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='core.cupcakeimage'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:57
+
+from django.db import migrations, models
+from django.db.models import Case, Count, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    # Autocontida (modelos históricos e expressões do Django), sem importar `core.ratings`
+    Cupcake = apps.get_model('core', 'Cupcake')
+    Review = apps.get_model('core', 'Review')
+
+    reviews = Review.objects.filter(cupcake=OuterRef('pk')).order_by().values('cupcake')
+    total = reviews.annotate(total=Sum('avaliacao')).values('total')
+    count = reviews.annotate(count=Count('pk')).values('count')
+    Cupcake.objects.update(
+        rating_sum=Coalesce(Subquery(total, output_field=IntegerField()), 0),
+        rating_count=Coalesce(Subquery(count, output_field=IntegerField()), 0),
+    )
+    # Em um UPDATE as colunas valem o que tinham antes dele; a média usa o resultado do anterior
+    Cupcake.objects.update(
+        rating_avg=Case(
+            When(rating_count=0, then=Value(0.0)),
+            default=Cast('rating_sum', FloatField()) / Cast('rating_count', FloatField()),
+            output_field=FloatField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_profile_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, help_text='Média das avaliações (0 sem avaliações).'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Quantidade de avaliações.'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Soma das estrelas de todas as avaliações.'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:59
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_histogram(apps, schema_editor):
+    Cupcake = apps.get_model('core', 'Cupcake')
+    Review = apps.get_model('core', 'Review')
+
+    reviews = Review.objects.filter(cupcake=OuterRef('pk')).order_by().values('cupcake')
+    fields = {}
+    for stars in range(1, 6):
+        bucket = reviews.filter(avaliacao=stars).annotate(count=Count('pk')).values('count')
+        fields[f'rating_{stars}'] = Coalesce(Subquery(bucket, output_field=IntegerField()), 0)
+    Cupcake.objects.update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_cupcake_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Avaliações com 1 estrela.'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Avaliações com 2 estrelas.'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Avaliações com 3 estrelas.'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Avaliações com 4 estrelas.'),
+        ),
+        migrations.AddField(
+            model_name='cupcake',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Avaliações com 5 estrelas.'),
+        ),
+        migrations.RunPython(fill_histogram, migrations.RunPython.noop),
+    ]
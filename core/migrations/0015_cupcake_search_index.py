@@ -0,0 +1,121 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# Cópia congelada do índice de `core.search` no momento desta migração: a
+# migração não importa código da aplicação, que pode mudar depois dela.
+TABLE = 'core_cupcake_search'
+WORD_RE = re.compile(r'\w+')
+PLURAL_SUFFIXES = (
+    ('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ois', 'ol'),
+    ('res', 'r'), ('les', 'l'), ('ns', 'm'), ('s', ''),
+)
+DIMINUTIVE_SUFFIXES = ('zinhos', 'zinhas', 'zinho', 'zinha', 'inhos', 'inhas', 'inho', 'inha')
+MIN_STEM = 3
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(word):
+    for suffix, replacement in PLURAL_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            if suffix == 's' and word.endswith(('ss', 'us', 'is')):
+                break
+            word = word[: -len(suffix)] + replacement
+            break
+
+    for suffix in DIMINUTIVE_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            word = word[: -len(suffix)]
+            break
+
+    if word[-1:] in ('a', 'e', 'o') and len(word) - 1 >= MIN_STEM:
+        word = word[:-1]
+    return word
+
+
+def tokens(text):
+    return ' '.join(stem(word) for word in WORD_RE.findall(normalize(text or '')))
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+
+    Cupcake = apps.get_model('core', 'Cupcake')
+    rows = Cupcake.objects.values_list('pk', 'titulo', 'etiqueta', 'cobertura', 'descricao', 'ingrediente')
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} "
+                "USING fts5(titulo, tags, corpo, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(f"DELETE FROM {TABLE}")
+            for pk, titulo, etiqueta, cobertura, descricao, ingrediente in rows.iterator(chunk_size=1000):
+                cursor.execute(
+                    f"INSERT INTO {TABLE} (rowid, titulo, tags, corpo) VALUES (%s, %s, %s, %s)",
+                    [
+                        pk,
+                        tokens(titulo),
+                        tokens(f"{etiqueta or ''} {cobertura or ''}"),
+                        tokens(f"{descricao or ''} {ingrediente or ''}"),
+                    ],
+                )
+            return
+
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        cursor.execute(
+            """
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'portuguese_unaccent') THEN
+                    CREATE TEXT SEARCH CONFIGURATION portuguese_unaccent (COPY = portuguese);
+                    ALTER TEXT SEARCH CONFIGURATION portuguese_unaccent
+                        ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+                END IF;
+            END
+            $$
+            """
+        )
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+            "cupcake_id bigint PRIMARY KEY REFERENCES core_cupcake (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document_gin ON {TABLE} USING GIN (document)")
+        # No PostgreSQL o documento é montado no próprio banco, em um único INSERT
+        cursor.execute(
+            f"""
+            INSERT INTO {TABLE} (cupcake_id, document)
+            SELECT
+                id,
+                setweight(to_tsvector('portuguese_unaccent', coalesce(titulo, '')), 'A')
+                || setweight(to_tsvector('portuguese_unaccent', coalesce(etiqueta, '') || ' ' || coalesce(cobertura, '')), 'B')
+                || setweight(to_tsvector('portuguese_unaccent', coalesce(descricao, '') || ' ' || coalesce(ingrediente, '')), 'C')
+            FROM core_cupcake
+            ON CONFLICT (cupcake_id) DO UPDATE SET document = EXCLUDED.document
+            """
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_cupcake_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_cupcake_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupcake',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, help_text='Data e hora da última alteração (usada para sincronizar o índice de `core.fuzzy`).'),
+            preserve_default=False,
+        ),
+    ]
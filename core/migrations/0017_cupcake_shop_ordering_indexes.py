@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-17 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_cupcake_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cupcake',
+            index=models.Index(fields=['titulo', 'id'], name='core_cupcak_titulo_23fa03_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cupcake',
+            index=models.Index(fields=['esta_em_destaque', 'id'], name='core_cupcak_esta_em_0b4c7d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cupcake',
+            index=models.Index(fields=['data_lancamento', 'id'], name='core_cupcak_data_la_49a6dc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cupcake',
+            index=models.Index(fields=['preco_sale', 'id'], name='core_cupcak_preco_s_4fd989_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cupcake',
+            index=models.Index(fields=['preco', 'id'], name='core_cupcak_preco_13d4ca_idx'),
+        ),
+    ]
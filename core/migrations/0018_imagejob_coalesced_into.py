@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-17 12:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_cupcake_shop_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='coalesced_into',
+            field=models.ForeignKey(blank=True, help_text='Job em andamento com o mesmo arquivo (mesmo SHA-256) cujas variantes esta imagem vai usar.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='followers', to='core.imagejob'),
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='status',
+            field=models.CharField(choices=[('Pendente', 'Pendente'), ('Processando', 'Processando'), ('Aguardando', 'Aguardando outro job'), ('Concluido', 'Concluído'), ('Falhou', 'Falhou')], default='Pendente', help_text='Status do processamento.', max_length=20),
+        ),
+    ]
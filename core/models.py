@@ -1,7 +1,8 @@
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
+from django.templatetags.static import static
 from django.utils.translation import gettext_lazy as _
 
 import PAIS
@@ -106,8 +107,29 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
 
     avatar = models.ImageField(default="profile_images/default.jpeg", upload_to="profile_images")
+    # Variantes quadradas do avatar, geradas pelo `manage.py image_worker`
+    avatar_small = models.ImageField(
+        upload_to="profile_images/small",
+        blank=True,
+        editable=False,
+        help_text="Avatar quadrado reduzido em JPEG.",
+    )
+    avatar_small_webp = models.ImageField(
+        upload_to="profile_images/small",
+        blank=True,
+        editable=False,
+        help_text="Avatar quadrado reduzido em WebP.",
+    )
     bio = models.TextField()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Avatar gravado no banco: `signals.reset_avatar_variants` compara com ele sem outra consulta
+        if "avatar" in field_names:
+            instance._saved_avatar = values[field_names.index("avatar")]
+        return instance
+
     def __str__(self):
         return self.user.username
 
@@ -122,6 +144,19 @@ class Categoria(models.Model):
         return self.nome_categoria
     
     
+class CupcakeQuerySet(models.QuerySet):
+    def with_rating(self):
+        """
+        Anota `media_avaliacao` (0 sem avaliações) e `total_avaliacoes` a partir
+        dos agregados guardados no próprio cupcake (ver `core.ratings`), sem
+        consultar as avaliações.
+        """
+        return self.annotate(
+            media_avaliacao=models.F("rating_avg"),
+            total_avaliacoes=models.F("rating_count"),
+        )
+
+
 # Modelo principal dos Cupcakes
 class Cupcake(models.Model):
     titulo = models.CharField(
@@ -188,9 +223,62 @@ class Cupcake(models.Model):
         help_text="Nome da cobertura, por exemplo, 'Chocolate', 'Baunilha', 'Morango'.",
     )
 
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        help_text="Data e hora da última alteração (usada para sincronizar o índice de `core.fuzzy`).",
+    )
+
+    # Agregados das avaliações, mantidos por `core.ratings`
+    rating_sum = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Soma das estrelas de todas as avaliações.",
+    )
+    rating_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Quantidade de avaliações.",
+    )
+    rating_avg = models.FloatField(
+        default=0,
+        editable=False,
+        help_text="Média das avaliações (0 sem avaliações).",
+    )
+    # Histograma: quantidade de avaliações com cada número de estrelas
+    rating_1 = models.PositiveIntegerField(default=0, editable=False, help_text="Avaliações com 1 estrela.")
+    rating_2 = models.PositiveIntegerField(default=0, editable=False, help_text="Avaliações com 2 estrelas.")
+    rating_3 = models.PositiveIntegerField(default=0, editable=False, help_text="Avaliações com 3 estrelas.")
+    rating_4 = models.PositiveIntegerField(default=0, editable=False, help_text="Avaliações com 4 estrelas.")
+    rating_5 = models.PositiveIntegerField(default=0, editable=False, help_text="Avaliações com 5 estrelas.")
+
+    objects = CupcakeQuerySet.as_manager()
+
+    class Meta:
+        # Uma por ordenação da loja, com o id como desempate da paginação por cursor (`core.pagination`)
+        indexes = [
+            models.Index(fields=["titulo", "id"]),
+            models.Index(fields=["esta_em_destaque", "id"]),
+            models.Index(fields=["data_lancamento", "id"]),
+            models.Index(fields=["preco_sale", "id"]),
+            models.Index(fields=["preco", "id"]),
+        ]
+
     def __str__(self):
         return self.titulo
 
+    def rating_histogram(self):
+        """
+        Distribuição das avaliações, de 5 a 1 estrela:
+        `[{"stars": 5, "count": ..., "percent": ...}, ...]`.
+        """
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f"rating_{stars}")
+            percent = round(count * 100 / self.rating_count) if self.rating_count else 0
+            histogram.append({"stars": stars, "count": count, "percent": percent})
+        return histogram
+
     def clean(self):
 
         if not self.preco_sale:
@@ -210,6 +298,74 @@ class Cupcake(models.Model):
             self.sale = True
 
 
+# Variantes processadas de um arquivo, identificadas pelo hash do conteúdo original.
+# Uploads com os mesmos bytes reutilizam as mesmas variantes.
+# Como o fundo das imagens foi removido (ver `core.imaging.remove_backgrounds`)
+BACKGROUND_TIERS = [
+    ("matte", "Recorte rápido (fundo liso)"),
+    ("rembg", "Modelo rembg"),
+]
+
+
+class ImageAsset(models.Model):
+    sha256 = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="Hash SHA-256 do arquivo original enviado.",
+    )
+    normal = models.CharField(max_length=255, help_text="Variante normal (relativa a MEDIA_ROOT).")
+    large_size = models.CharField(max_length=255, help_text="Variante large (relativa a MEDIA_ROOT).")
+    small_size = models.CharField(max_length=255, help_text="Variante small (relativa a MEDIA_ROOT).")
+    responsive = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Variantes do srcset: lista de {format, width, name}.",
+    )
+    original = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        help_text="Cópia do arquivo enviado, usada para gerar as variantes de novo.",
+    )
+    background_tier = models.CharField(
+        max_length=10,
+        blank=True,
+        default="",
+        choices=BACKGROUND_TIERS,
+        help_text="Como o fundo da imagem foi removido.",
+    )
+    placeholder = models.TextField(
+        blank=True,
+        default="",
+        help_text="Miniatura de 16px em data URI, exibida enquanto as variantes carregam.",
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Quantidade de imagens de cupcakes que usam estas variantes.",
+    )
+    is_default = models.BooleanField(
+        default=False,
+        help_text="Variantes da imagem padrão dos cupcakes; nunca são apagadas.",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Arquivo de Imagem"
+        verbose_name_plural = "Arquivos de Imagens"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} referência(s))"
+
+    @property
+    def variant_names(self):
+        names = [self.normal, self.large_size, self.small_size] + [
+            variant["name"] for variant in self.responsive
+        ]
+        if self.original:
+            names.append(self.original)
+        return names
+
+
 class CupcakeImage(models.Model):
     cupcake = models.ForeignKey(
         Cupcake,
@@ -240,9 +396,36 @@ class CupcakeImage(models.Model):
         null=True,
         blank=True,
     )
+    asset = models.ForeignKey(
+        ImageAsset,
+        on_delete=models.SET_NULL,
+        related_name="images",
+        blank=True,
+        null=True,
+        editable=False,
+        help_text="Variantes compartilhadas usadas por esta imagem.",
+    )
+
+    background_tier = models.CharField(
+        max_length=10,
+        blank=True,
+        default="",
+        choices=BACKGROUND_TIERS,
+        editable=False,
+        help_text="Como o fundo da imagem foi removido (para auditoria).",
+    )
+    placeholder = models.TextField(
+        blank=True,
+        default="",
+        editable=False,
+        help_text="Miniatura de 16px em data URI, exibida enquanto a imagem carrega.",
+    )
 
     _processed = models.BooleanField(default=False, editable=False)  # Flag interna
 
+    # Imagem exibida enquanto o worker ainda não gerou as variantes
+    PROCESSING_PLACEHOLDER = "assets/images/processing.svg"
+
     def clean(self):
         if not self.descricao:
             self.descricao = self.cupcake.descricao
@@ -250,6 +433,106 @@ class CupcakeImage(models.Model):
     def __str__(self) -> str:
         return f"{self.pk} Imagem {self.cupcake.titulo} - {self.cupcake.pk}"
 
+    @property
+    def is_processing(self):
+        return not self._processed
+
+    def _variant_url(self, field):
+        if self.is_processing or not field:
+            return static(self.PROCESSING_PLACEHOLDER)
+        return field.url
+
+    def get_normal_url(self):
+        return self._variant_url(self.normal)
+
+    def get_large_url(self):
+        return self._variant_url(self.large_size)
+
+    def get_small_url(self):
+        return self._variant_url(self.small_size)
+
+
+# Fila de processamento das imagens dos cupcakes (consumida por `manage.py image_worker`)
+class ImageJob(models.Model):
+    PENDENTE = "Pendente"
+    PROCESSANDO = "Processando"
+    AGUARDANDO = "Aguardando"
+    CONCLUIDO = "Concluido"
+    FALHOU = "Falhou"
+
+    image = models.ForeignKey(
+        CupcakeImage,
+        on_delete=models.CASCADE,
+        related_name="jobs",
+        blank=True,
+        null=True,
+        help_text="A imagem que será processada.",
+    )
+    profile = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name="avatar_jobs",
+        blank=True,
+        null=True,
+        help_text="O perfil cujo avatar será processado.",
+    )
+    source = models.CharField(
+        max_length=255,
+        help_text="Nome do arquivo original (relativo a MEDIA_ROOT) no momento do envio.",
+    )
+    sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="Hash SHA-256 do arquivo original.",
+    )
+    coalesced_into = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        related_name="followers",
+        blank=True,
+        null=True,
+        help_text="Job em andamento com o mesmo arquivo (mesmo SHA-256) cujas variantes esta imagem vai usar.",
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            (PENDENTE, "Pendente"),
+            (PROCESSANDO, "Processando"),
+            (AGUARDANDO, "Aguardando outro job"),
+            (CONCLUIDO, "Concluído"),
+            (FALHOU, "Falhou"),
+        ],
+        default=PENDENTE,
+        help_text="Status do processamento.",
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        help_text="Número de tentativas de processamento.",
+    )
+    error = models.TextField(
+        blank=True,
+        null=True,
+        help_text="Último erro ocorrido no processamento.",
+    )
+    peak_memory = models.PositiveBigIntegerField(
+        blank=True,
+        null=True,
+        help_text="Pico de memória (bytes) do processo do worker durante o job.",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+        verbose_name = "Processamento de Imagem"
+        verbose_name_plural = "Processamentos de Imagens"
+
+    def __str__(self):
+        if self.profile_id:
+            return f"Job {self.pk} - Avatar do perfil {self.profile_id} ({self.status})"
+        return f"Job {self.pk} - Imagem {self.image_id} ({self.status})"
+
 
 # Modelo de Reviews dos Cupcakes
 class Review(models.Model):
@@ -281,6 +564,11 @@ class Review(models.Model):
     def __str__(self):
         return f"Review {self.avaliacao} estrelas por {self.usuario.username}"
 
+    def save(self, *args, **kwargs):
+        # Os agregados do cupcake (atualizados no post_save) são gravados na mesma transação
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Endereco(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enderecos', null=True, blank=True)
@@ -543,8 +831,24 @@ class Testimonial(models.Model):
         return f'Testimonial by {self.user.username}'
     
 
+    def get_profile(self):
+        # Usa o perfil carregado com `select_related("user__profile")`, se houver
+        try:
+            return self.user.profile
+        except Profile.DoesNotExist:
+            return None
+
     def get_profile_picture(self):
-        profile = Profile.objects.filter(user=self.user).first()
+        profile = self.get_profile()
+        if profile and profile.avatar_small:
+            return profile.avatar_small.url
+        # Avatar ainda não processado pelo worker
         if profile and profile.avatar:
             return profile.avatar.url
-        return 'assets/images/testimonial/default.jpg'
\ No newline at end of file
+        return 'assets/images/testimonial/default.jpg'
+
+    def get_profile_picture_webp(self):
+        profile = self.get_profile()
+        if profile and profile.avatar_small_webp:
+            return profile.avatar_small_webp.url
+        return ""
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+Paginação por cursor (keyset) da listagem da loja.
+
+Em vez de `OFFSET (página - 1) * tamanho`, que obriga o banco a percorrer e
+descartar todas as linhas das páginas anteriores, cada página é buscada a
+partir da chave da última (ou da primeira) linha da página vista antes:
+
+    WHERE (titulo, id) > ('Cupcake de Limão', 42) ORDER BY titulo, id LIMIT 7
+
+Com um índice composto na mesma ordem (ver `Cupcake.Meta.indexes`), o custo
+de uma página não depende da profundidade. Toda ordenação termina no `pk`,
+com a mesma direção do primeiro campo, para que a chave seja única e o
+índice possa ser percorrido nos dois sentidos.
+
+O cursor (parâmetro `cursor`) leva o número da página e as chaves da sua
+primeira e última linha; o parâmetro `page` indica a página desejada. Para
+as páginas vizinhas o banco pula no máximo algumas páginas a partir do
+cursor. A navegação depende só das linhas lidas (cada leitura traz uma linha
+a mais para saber se há uma próxima página), nunca do total: o total das
+facetas pode estar desatualizado em relação a outros processos e serve
+apenas para mostrar os links numerados em volta da página atual.
+
+Campos que aceitam NULL (`preco_sale`) são ordenados com os nulos depois dos
+demais valores (antes, na ordem decrescente), igual no SQLite e no PostgreSQL.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+# Páginas numeradas mostradas antes e depois da atual
+PAGE_LINKS_AROUND = 2
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    """
+    Conteúdo de um cursor, ou `None` se ele estiver ausente ou inválido.
+    """
+    if not value:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+        if isinstance(data["p"], int) and isinstance(data["f"], list) and isinstance(data["l"], list):
+            return data
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def parse_ordering(model, ordering):
+    """
+    `("-preco", "-pk")` -> `[(campo, decrescente, aceita_nulo), ...]`.
+    Campos anotados (`search_rank`) são tratados como não nulos.
+    """
+    keys = []
+    for item in ordering:
+        name = item.lstrip("-")
+        try:
+            nullable = name != "pk" and model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            nullable = False
+        keys.append((name, item.startswith("-"), nullable))
+    return keys
+
+
+def order_by(keys, reverse=False):
+    expressions = []
+    for name, descending, nullable in keys:
+        descending = descending != reverse
+        if not nullable:
+            expressions.append(F(name).desc() if descending else F(name).asc())
+        elif descending:
+            expressions.append(F(name).desc(nulls_first=True))
+        else:
+            expressions.append(F(name).asc(nulls_last=True))
+    return expressions
+
+
+def _equal(name, value):
+    return Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+
+
+def _beyond(name, value, descending, nullable):
+    """
+    Condição "depois de `value`" para um campo, com NULL maior que qualquer
+    valor. `None` quando nada vem depois.
+    """
+    if descending:
+        if value is None:
+            return Q(**{f"{name}__isnull": False})
+        return Q(**{f"{name}__lt": value})
+
+    if value is None:
+        return None
+    condition = Q(**{f"{name}__gt": value})
+    if nullable:
+        condition |= Q(**{f"{name}__isnull": True})
+    return condition
+
+
+def after(keys, values, reverse=False):
+    """
+    Linhas depois da chave `values` na ordem de `keys` (antes dela, com `reverse`):
+    `(a > x) OR (a = x AND b > y) OR ...`.
+    """
+    conditions = []
+    prefix = Q()
+    for (name, descending, nullable), value in zip(keys, values):
+        beyond = _beyond(name, value, descending != reverse, nullable)
+        if beyond is not None:
+            conditions.append(prefix & beyond)
+        prefix &= _equal(name, value)
+
+    if not conditions:
+        return Q(pk__in=[])
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition |= other
+
+    # Limite redundante no primeiro campo (a >= x): permite ao banco começar a
+    # leitura do índice na chave do cursor, em vez de percorrê-lo desde o início
+    name, descending, nullable = keys[0]
+    value = values[0]
+    if value is not None and not nullable:
+        condition &= Q(**{f"{name}__{'lte' if descending != reverse else 'gte'}": value})
+    return condition
+
+
+class KeysetPage:
+    def __init__(self, object_list, number, per_page, count, has_next, cursor):
+        self.object_list = object_list
+        self.number = number
+        self.per_page = per_page
+        self.count = count
+        self.num_pages = max(1, -(-count // per_page)) if count is not None else None
+        self.has_next = has_next
+        self.has_previous = number > 1
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def start_index(self):
+        return (self.number - 1) * self.per_page + 1 if self.object_list else 0
+
+    @property
+    def end_index(self):
+        return (self.number - 1) * self.per_page + len(self.object_list)
+
+    def query(self, params, number):
+        """
+        Query string que leva de `params` (a listagem atual) à página `number`.
+        """
+        query = params.copy()
+        for name in ("page", "cursor", "csrfmiddlewaretoken"):
+            query.pop(name, None)
+        if number > 1:
+            query["page"] = number
+            if self.cursor:
+                query["cursor"] = self.cursor
+        return query.urlencode()
+
+    def links(self, params):
+        """
+        Links de navegação: primeira, anterior, próxima e, com o total
+        conhecido, as páginas numeradas em volta da atual.
+        """
+        links = {"first": None, "previous": None, "next": None, "pages": []}
+        if self.has_previous:
+            links["first"] = self.query(params, 1)
+            links["previous"] = self.query(params, self.number - 1)
+        if self.has_next:
+            links["next"] = self.query(params, self.number + 1)
+        if self.num_pages is not None:
+            start = max(1, self.number - PAGE_LINKS_AROUND)
+            end = min(max(self.num_pages, self.number), self.number + PAGE_LINKS_AROUND)
+            links["pages"] = [
+                (number, None if number == self.number else self.query(params, number))
+                for number in range(start, end + 1)
+            ]
+        return links
+
+
+def paginate(queryset, ordering, params, per_page, count=None):
+    """
+    Página pedida em `params` (`page` e `cursor`) de `queryset`, ordenado por
+    `ordering` (terminando no `pk`). `count`, se conhecido, é usado apenas
+    para os links numerados.
+    """
+    keys = parse_ordering(queryset.model, ordering)
+    cursor = decode_cursor(params.get("cursor"))
+    if cursor and (len(cursor["f"]) != len(keys) or len(cursor["l"]) != len(keys)):
+        cursor = None
+
+    try:
+        number = max(1, int(params.get("page", 1)))
+    except (TypeError, ValueError):
+        number = 1
+
+    boundary, reverse, offset = None, False, (number - 1) * per_page
+    if cursor and number > cursor["p"]:
+        boundary, offset = cursor["l"], (number - cursor["p"] - 1) * per_page
+    elif cursor and number < cursor["p"]:
+        boundary, reverse, offset = cursor["f"], True, (cursor["p"] - number - 1) * per_page
+
+    page = queryset.order_by(*order_by(keys, reverse))
+    if boundary is not None:
+        page = page.filter(after(keys, boundary, reverse))
+
+    rows = list(page[offset : offset + per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        # Lida de trás para frente a partir do cursor: a página seguinte é a do cursor
+        rows.reverse()
+        has_next = True
+    else:
+        has_next = more
+
+    page_cursor = None
+    if rows:
+        page_cursor = encode_cursor(
+            {
+                "p": number,
+                "f": [getattr(rows[0], name) for name, _, _ in keys],
+                "l": [getattr(rows[-1], name) for name, _, _ in keys],
+            }
+        )
+    return KeysetPage(rows, number, per_page, count, has_next, page_cursor)
@@ -0,0 +1,85 @@
+"""
+Agregados das avaliações (`Review`) guardados no próprio `Cupcake`.
+
+`rating_sum`, `rating_count`, `rating_avg` e o histograma de estrelas
+(`rating_1` a `rating_5`) são atualizados com UPDATEs relativos (`F()`) na
+mesma transação em que uma avaliação é criada, alterada ou excluída (ver
+`core.signals`), então as listagens e a página do produto mostram as estrelas
+sem consultar as avaliações.
+
+Alterações feitas sem passar pelos sinais (`Review.objects.update(...)`,
+SQL direto) deixam os agregados desatualizados; `manage.py rebuild_ratings`
+os recalcula a partir das avaliações.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from core.models import Cupcake, Review
+
+STARS = range(1, 6)
+
+
+def histogram_field(stars):
+    return f"rating_{stars}"
+
+
+def average_expression():
+    """
+    Média calculada a partir das colunas `rating_sum` e `rating_count`.
+    """
+    return Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast("rating_sum", FloatField()) / Cast("rating_count", FloatField()),
+        output_field=FloatField(),
+    )
+
+
+def apply_review_delta(cupcake_id, avaliacao, sign=1):
+    """
+    Adiciona (`sign=1`) ou remove (`sign=-1`) uma avaliação de `avaliacao`
+    estrelas dos agregados do cupcake e recalcula `rating_avg`.
+    """
+    fields = {
+        "rating_sum": F("rating_sum") + sign * avaliacao,
+        "rating_count": F("rating_count") + sign,
+    }
+    if avaliacao in STARS:
+        field = histogram_field(avaliacao)
+        fields[field] = F(field) + sign
+
+    with transaction.atomic():
+        cupcakes = Cupcake.objects.filter(pk=cupcake_id)
+        cupcakes.update(**fields)
+        # Em um UPDATE as colunas valem o que tinham antes dele; a média usa o resultado do anterior
+        cupcakes.update(rating_avg=average_expression())
+
+
+def rebuild_ratings(cupcakes=None, reviews=None):
+    """
+    Recalcula os agregados de `cupcakes` (todos, por padrão) a partir de
+    subconsultas agregadas sobre `reviews`, em dois UPDATEs. Retorna a
+    quantidade de cupcakes atualizados.
+
+    `cupcakes` e `reviews` podem vir dos modelos históricos de uma migração.
+    """
+    if cupcakes is None:
+        cupcakes = Cupcake.objects.all()
+    if reviews is None:
+        reviews = Review.objects.all()
+
+    reviews = reviews.filter(cupcake=OuterRef("pk")).order_by().values("cupcake")
+    total = reviews.annotate(total=Sum("avaliacao")).values("total")
+    count = reviews.annotate(count=Count("pk")).values("count")
+    fields = {
+        "rating_sum": Coalesce(Subquery(total, output_field=IntegerField()), 0),
+        "rating_count": Coalesce(Subquery(count, output_field=IntegerField()), 0),
+    }
+    for stars in STARS:
+        bucket = reviews.filter(avaliacao=stars).annotate(count=Count("pk")).values("count")
+        fields[histogram_field(stars)] = Coalesce(Subquery(bucket, output_field=IntegerField()), 0)
+
+    with transaction.atomic():
+        updated = cupcakes.update(**fields)
+        cupcakes.update(rating_avg=average_expression())
+    return updated
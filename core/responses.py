@@ -0,0 +1,138 @@
+"""
+Respostas HTTP para servir arquivos de imagem do disco.
+
+`file_response` envia o arquivo em streaming (`FileResponse`, que usa o
+`wsgi.file_wrapper`/sendfile do servidor quando disponível), com o MIME type
+correto, `ETag`/`Last-Modified` para requisições condicionais (304) e suporte
+a um intervalo de bytes por requisição (`Range`, 206).
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(st):
+    """
+    ETag derivado da data de modificação e do tamanho do arquivo.
+    """
+    return f'"{int(st.st_mtime_ns):x}-{st.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Interpreta um cabeçalho `Range` com um único intervalo de bytes.
+
+    Retorna `(start, end)` (inclusivo), `None` se o cabeçalho deve ser ignorado
+    (ausente, inválido ou com vários intervalos) ou `False` se o intervalo não
+    pode ser atendido.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # "bytes=-N": os últimos N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _read_range(path, start, length):
+    with open(path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request, path, filename=None, etag=None, last_modified=None):
+    """
+    Serve o arquivo `path` respeitando `If-None-Match`/`If-Modified-Since`
+    (304) e `Range`/`If-Range` (206/416).
+
+    `etag` e `last_modified` (timestamp) substituem os validadores derivados do
+    próprio arquivo, para arquivos cuja data de modificação não acompanha o
+    conteúdo (como as entradas do cache de transformações).
+
+    Levanta `FileNotFoundError` se o arquivo não existir.
+    """
+    st = os.stat(path)
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(path)
+
+    filename = filename or os.path.basename(path)
+    etag = etag or file_etag(st)
+    mtime = int(last_modified if last_modified is not None else st.st_mtime)
+
+    headers = HttpResponse()
+    headers["ETag"] = etag
+    headers["Last-Modified"] = http_date(mtime)
+    headers["Cache-Control"] = f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}"
+    headers["Accept-Ranges"] = "bytes"
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=mtime, response=headers
+    )
+    if not_modified is not headers:
+        return not_modified
+
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    byte_range = parse_range(request.headers.get("Range"), st.st_size)
+    if byte_range is not None and not _if_range_matches(request, etag, mtime):
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{st.st_size}"
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _read_range(path, start, length), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        response["Content-Length"] = str(length)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type, filename=filename)
+
+    for header in ("ETag", "Last-Modified", "Cache-Control", "Accept-Ranges"):
+        response[header] = headers[header]
+    return response
+
+
+def _if_range_matches(request, etag, mtime):
+    """
+    `If-Range`: o intervalo só é enviado se o validador ainda corresponder ao
+    arquivo; caso contrário, o arquivo inteiro é retornado.
+    """
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/"')):
+        return etag in parse_etags(if_range)
+    return parse_http_date_safe(if_range) == mtime
@@ -0,0 +1,259 @@
+"""
+Índice de busca textual do catálogo (`Cupcake`).
+
+O índice fica em uma tabela própria, `core_cupcake_search`, com uma linha por
+cupcake:
+
+- SQLite (desenvolvimento): tabela virtual FTS5. O texto é gravado já
+  normalizado (minúsculas, sem acentos) e reduzido pelo `stem` abaixo, um
+  stemmer leve para o português; a mesma redução é aplicada aos termos da
+  busca. O ranking é o `bm25`, com peso maior para o título.
+- PostgreSQL (produção): coluna `tsvector` com índice GIN, gerada com a
+  configuração `portuguese_unaccent` (dicionário `unaccent` seguido do
+  stemmer snowball do português). O ranking é o `ts_rank_cd`.
+
+O índice é atualizado pelos sinais `post_save`/`post_delete` de `Cupcake`
+(`core.signals`), logo depois da gravação. Eles rodam fora do bloco atômico do
+`save()`: a linha do índice só fica na mesma transação do cupcake quando quem
+grava usa `transaction.atomic`. Se a atualização do índice falhar depois de
+um commit, `manage.py rebuild_search_index` o recria do zero.
+Em outros bancos `search` retorna `None` e a view usa `icontains`.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.models import Case, IntegerField, Q, When
+
+TABLE = "core_cupcake_search"
+
+# Colunas do índice: título (peso maior), etiquetas e o restante do texto
+SEARCH_FIELDS = ("titulo", "etiqueta", "cobertura", "descricao", "ingrediente")
+
+# Pesos do bm25 por coluna do FTS5 (titulo, tags, corpo)
+FTS5_WEIGHTS = (10.0, 4.0, 1.0)
+
+WORD_RE = re.compile(r"\w+")
+
+# Sufixos removidos por `stem`, do mais longo para o mais curto em cada grupo
+PLURAL_SUFFIXES = (
+    ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"),
+    ("res", "r"), ("les", "l"), ("ns", "m"), ("s", ""),
+)
+DIMINUTIVE_SUFFIXES = ("zinhos", "zinhas", "zinho", "zinha", "inhos", "inhas", "inho", "inha")
+MIN_STEM = 3
+
+
+def normalize(text):
+    """
+    Minúsculas e sem acentos ("Açúcar" -> "acucar").
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(word):
+    """
+    Reduz uma palavra já normalizada ao seu radical: remove plural,
+    diminutivo e a vogal temática final ("morangos" -> "morang",
+    "cupcakezinhos" -> "cupcak"). Palavras curtas ficam como estão.
+    """
+    for suffix, replacement in PLURAL_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                break
+            word = word[: -len(suffix)] + replacement
+            break
+
+    for suffix in DIMINUTIVE_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            word = word[: -len(suffix)]
+            break
+
+    if word[-1:] in ("a", "e", "o") and len(word) - 1 >= MIN_STEM:
+        word = word[:-1]
+    return word
+
+
+def tokens(text):
+    return [stem(word) for word in WORD_RE.findall(normalize(text or ""))]
+
+
+def is_supported(connection=None):
+    connection = connection or default_connection
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def create_index(connection):
+    """
+    Cria a tabela do índice (e, no PostgreSQL, a configuração de busca).
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} "
+                "USING fts5(titulo, tags, corpo, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        elif connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+            cursor.execute(
+                """
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'portuguese_unaccent') THEN
+                        CREATE TEXT SEARCH CONFIGURATION portuguese_unaccent (COPY = portuguese);
+                        ALTER TEXT SEARCH CONFIGURATION portuguese_unaccent
+                            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem;
+                    END IF;
+                END
+                $$
+                """
+            )
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+                "cupcake_id bigint PRIMARY KEY REFERENCES core_cupcake (id) ON DELETE CASCADE "
+                "DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document_gin ON {TABLE} USING GIN (document)")
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def index_rows(rows, connection=None):
+    """
+    Grava no índice as linhas `(id, titulo, etiqueta, cobertura, descricao, ingrediente)`.
+    """
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+
+    with connection.cursor() as cursor:
+        for pk, titulo, etiqueta, cobertura, descricao, ingrediente in rows:
+            tags = f"{etiqueta or ''} {cobertura or ''}"
+            corpo = f"{descricao or ''} {ingrediente or ''}"
+
+            if connection.vendor == "sqlite":
+                cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [pk])
+                cursor.execute(
+                    f"INSERT INTO {TABLE} (rowid, titulo, tags, corpo) VALUES (%s, %s, %s, %s)",
+                    [pk, " ".join(tokens(titulo)), " ".join(tokens(tags)), " ".join(tokens(corpo))],
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {TABLE} (cupcake_id, document) VALUES (
+                        %s,
+                        setweight(to_tsvector('portuguese_unaccent', %s), 'A')
+                        || setweight(to_tsvector('portuguese_unaccent', %s), 'B')
+                        || setweight(to_tsvector('portuguese_unaccent', %s), 'C')
+                    )
+                    ON CONFLICT (cupcake_id) DO UPDATE SET document = EXCLUDED.document
+                    """,
+                    [pk, titulo or "", tags, corpo],
+                )
+
+
+def index_cupcake(cupcake):
+    index_rows([tuple(getattr(cupcake, field) for field in ("pk",) + SEARCH_FIELDS)])
+
+
+def remove_cupcake(pk, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+
+    column = "rowid" if connection.vendor == "sqlite" else "cupcake_id"
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {column} = %s", [pk])
+
+
+def rebuild(cupcakes, connection=None):
+    """
+    Esvazia o índice e indexa `cupcakes` (um queryset, possivelmente de uma
+    migração). Retorna a quantidade de cupcakes indexados.
+    """
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+    count = 0
+    batch = []
+    for row in cupcakes.values_list("pk", *SEARCH_FIELDS).iterator(chunk_size=1000):
+        batch.append(row)
+        if len(batch) == 1000:
+            index_rows(batch, connection)
+            count += len(batch)
+            batch = []
+    index_rows(batch, connection)
+    return count + len(batch)
+
+
+def search(query, limit=None):
+    """
+    Ids dos cupcakes que correspondem a `query`, do mais relevante para o
+    menos relevante (no máximo `limit`, padrão SEARCH_MAX_RESULTS).
+
+    Retorna `None` se o banco não tiver índice de busca.
+    """
+    if not is_supported():
+        return None
+
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    with default_connection.cursor() as cursor:
+        if default_connection.vendor == "sqlite":
+            terms = tokens(query)
+            if not terms:
+                return []
+            # Todos os termos precisam aparecer; o último também casa como prefixo (busca incompleta)
+            match = " ".join(f'"{term}"' for term in terms[:-1])
+            match = f'{match} "{terms[-1]}"*'.strip()
+            weights = ", ".join(str(weight) for weight in FTS5_WEIGHTS)
+            cursor.execute(
+                f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s "
+                f"ORDER BY bm25({TABLE}, {weights}) LIMIT %s",
+                [match, limit],
+            )
+        else:
+            cursor.execute(
+                f"""
+                SELECT cupcake_id FROM {TABLE}, websearch_to_tsquery('portuguese_unaccent', %s) AS query
+                WHERE document @@ query
+                ORDER BY ts_rank_cd(document, query) DESC
+                LIMIT %s
+                """,
+                [query, limit],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_ranked(queryset, ranked_ids):
+    """
+    Restringe `queryset` aos ids de `search`, anotando `search_rank` (a
+    posição no ranking) e ordenando por ela.
+    """
+    if not ranked_ids:
+        return queryset.none()
+
+    rank = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ranked_ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ranked_ids).annotate(search_rank=rank).order_by("search_rank")
+
+
+def fallback_filter(queryset, query):
+    """
+    Busca sem índice (outros bancos): `icontains` em todos os campos do índice.
+    """
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f"{field}__icontains": query})
+    return queryset.filter(condition)
@@ -1,16 +1,19 @@
-import hashlib
-import os
-import string
-from random import choices, randint
-
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from PIL import Image
-from rembg import remove
 
-from core.models import Cupcake, CupcakeImage, Profile, Order
-from libs.utils import generate_number
+from core.models import Categoria, Cupcake, CupcakeImage, Profile, Review
+from core import autocomplete, facets, fuzzy, search
+from core.ratings import apply_review_delta
+from core.tasks import (
+    attach_default_asset,
+    enqueue_avatar_job,
+    enqueue_image_job,
+    release_asset,
+    remove_media_file,
+)
 
 
 @receiver(post_save, sender=User)
@@ -28,117 +31,149 @@ def save_profile(sender, instance, **kwargs):
     
 
 
-@receiver(post_save, sender=Cupcake)
-def add_default_cupcake_image(sender, instance, created, **kwargs):
-    if created:
-        # Adiciona uma imagem padrão ao cupcake recém-criado
-        CupcakeImage.objects.create(
-            cupcake=instance,
-            normal="cupcakes-fotos/default_cupcakes.jpeg",  # Caminho para a imagem padrão
-            descricao="Imagem padrão",
-        )
+@receiver(pre_save, sender=Profile)
+def reset_avatar_variants(sender, instance, **kwargs):
+    # Um novo avatar invalida as variantes do anterior; até o worker gerar as
+    # novas, os depoimentos usam o arquivo enviado
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and "avatar" not in update_fields:
+        instance._avatar_changed = False
+        return
 
+    if not instance.pk:
+        previous = None
+    elif hasattr(instance, "_saved_avatar"):
+        previous = instance._saved_avatar
+    else:
+        # Perfil montado fora de uma consulta (ou com o avatar adiado)
+        previous = Profile.objects.filter(pk=instance.pk).values_list("avatar", flat=True).first()
+    instance._avatar_changed = previous != instance.avatar.name
+    if not instance._avatar_changed or not instance.avatar_small:
+        return
 
-@receiver(post_save, sender=CupcakeImage)
-def resize_and_rename_images(sender, instance, **kwargs):
-    # Evita processar novamente se já foi feito uma vez
-    if instance._processed:
+    names = [instance.avatar_small.name, instance.avatar_small_webp.name]
+    instance.avatar_small = ""
+    instance.avatar_small_webp = ""
+    for name in filter(None, names):
+        transaction.on_commit(lambda name=name: remove_media_file(name))
+
+
+@receiver(post_save, sender=Profile)
+def enqueue_avatar_processing(sender, instance, **kwargs):
+    if kwargs.get("update_fields") is None or "avatar" in kwargs["update_fields"]:
+        instance._saved_avatar = instance.avatar.name
+
+    # O avatar padrão é servido como está
+    if not getattr(instance, "_avatar_changed", False) or not instance.avatar:
+        return
+    if instance.avatar.name == Profile._meta.get_field("avatar").default:
         return
 
-    if instance.normal:
-        image_path = instance.normal.path
-        img = Image.open(image_path)
+    enqueue_avatar_job(instance)
 
-        # Verifica se a imagem normal não está no tamanho 400x400 e redimensiona se necessário
-        if img.size != (400, 400):
-            img = img.resize((400, 400), Image.Resampling.LANCZOS)
 
-        # Converte para RGB se a imagem for RGBA
-        if img.mode == "RGBA":
-            img = img.convert("RGB")
+@receiver(post_delete, sender=Profile)
+def remove_avatar_variants(sender, instance, **kwargs):
+    for name in filter(None, [instance.avatar_small.name, instance.avatar_small_webp.name]):
+        transaction.on_commit(lambda name=name: remove_media_file(name))
 
-        # Renomeia a imagem com a PK do modelo
-        code = generate_number()
-        normal_img_name = f"cupcake_{instance.pk}_{code}normal.png"
-        normal_img_path = os.path.join(os.path.dirname(image_path), normal_img_name)
 
-        # Cria o diretório se não existir
-        normal_dir = os.path.dirname(normal_img_path)
-        if not os.path.exists(normal_dir):
-            os.makedirs(normal_dir)
+@receiver(post_save, sender=Cupcake)
+def update_search_index(sender, instance, **kwargs):
+    search.index_cupcake(instance)
+    fuzzy.update_cupcake(instance)
+    autocomplete.invalidate()
+    facets.invalidate()
+
 
-        # img.save(normal_img_path, format='JPEG')
+@receiver(post_delete, sender=Cupcake)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_cupcake(instance.pk)
+    fuzzy.remove_cupcake(instance.pk)
+    autocomplete.invalidate()
+    facets.invalidate()
 
-        # Remover o fundo
-        output_image = remove(img)
 
-        # Salvar a imagem sem fundo
-        output_image.save(normal_img_path, format="PNG")
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidate_category_caches(sender, **kwargs):
+    autocomplete.invalidate()
+    facets.invalidate()
 
-        # Atualiza o campo `normal` com o novo caminho
-        instance.normal.name = os.path.join("cupcakes-fotos/", normal_img_name)
 
-        # Cria e renomeia a imagem large_size
-        large_img = img.resize((600, 600), Image.Resampling.LANCZOS)
-        code = generate_number()
-        large_img_name = f"cupcake_{instance.pk}_{code}_large.png"
-        large_img_path = os.path.join(
-            os.path.dirname(image_path),
-            "large-size",
-            large_img_name,
+@receiver(post_save, sender=Cupcake)
+def add_default_cupcake_image(sender, instance, created, **kwargs):
+    if created:
+        # Adiciona uma imagem padrão ao cupcake recém-criado, reutilizando as
+        # variantes já geradas da imagem padrão
+        if attach_default_asset(instance):
+            return
+
+        # As variantes padrão ainda não existem: o worker gera uma vez e as demais reutilizam
+        CupcakeImage.objects.create(
+            cupcake=instance,
+            normal=settings.DEFAULT_CUPCAKE_IMAGE,  # Caminho para a imagem padrão
+            descricao="Imagem padrão",
         )
 
-        # Cria o diretório se não existir
-        large_dir = os.path.dirname(large_img_path)
-        if not os.path.exists(large_dir):
-            os.makedirs(large_dir)
 
-        # large_img.save(large_img_path, format='JPEG')
+@receiver(pre_save, sender=CupcakeImage)
+def reset_processed_flag(sender, instance, **kwargs):
+    # Uma nova foto enviada para uma imagem já processada precisa passar pelo pipeline de novo
+    if not instance.pk or not instance._processed:
+        return
 
-        # Remover o fundo
-        output_image = remove(large_img)
+    previous = (
+        CupcakeImage.objects.filter(pk=instance.pk)
+        .values_list("normal", flat=True)
+        .first()
+    )
+    if previous is not None and previous != instance.normal.name:
+        instance._processed = False
 
-        # Salvar a imagem sem fundo
-        output_image.save(large_img_path, format="PNG")
 
-        # Atualiza o campo `large_size` com o novo caminho
-        instance.large_size.name = os.path.join(
-            "cupcakes-fotos/large-size", large_img_name
-        )
+@receiver(post_save, sender=CupcakeImage)
+def enqueue_image_processing(sender, instance, **kwargs):
+    # Evita processar novamente se já foi feito uma vez
+    if instance._processed or not instance.normal:
+        return
 
-        # Cria e renomeia a imagem small_size
-        small_img = img.resize((140, 140), Image.Resampling.LANCZOS)
-        code = generate_number()
-        small_img_name = f"cupcake_{instance.pk}_{code}_small.png"
-        small_img_path = os.path.join(
-            os.path.dirname(image_path),
-            "small-size",
-            small_img_name,
-        )
+    # O processamento pesado é feito pelo `manage.py image_worker`
+    enqueue_image_job(instance)
 
-        # Cria o diretório se não existir
-        small_dir = os.path.dirname(small_img_path)
-        if not os.path.exists(small_dir):
-            os.makedirs(small_dir)
 
-        # small_img.save(small_img_path, format='JPEG')
+@receiver(post_delete, sender=CupcakeImage)
+def release_image_files(sender, instance, **kwargs):
+    # As variantes são compartilhadas: só são apagadas quando nenhuma imagem usa o asset
+    if instance.asset_id:
+        release_asset(instance.asset_id)
+    elif not instance._processed and instance.normal:
+        name = instance.normal.name
+        transaction.on_commit(lambda: remove_media_file(name))
 
-        # Remover o fundo
-        output_image = remove(small_img)
 
-        # Salvar a imagem sem fundo
-        output_image.save(small_img_path, format="PNG")
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    # Valores anteriores da avaliação, para ajustar os agregados no post_save
+    instance._previous_rating = (
+        Review.objects.filter(pk=instance.pk).values_list("cupcake_id", "avaliacao").first()
+        if instance.pk
+        else None
+    )
 
-        # Atualiza o campo `small_size` com o novo caminho
-        instance.small_size.name = os.path.join(
-            "cupcakes-fotos/small-size", small_img_name
-        )
 
-        # Remove a imagem original
-        if os.path.exists(image_path):
-            if image_path.split("\\cupcakes-fotos\\")[-1] != "default_cupcakes.jpeg":
-                os.remove(image_path)
+@receiver(post_save, sender=Review)
+def update_cupcake_rating(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_rating", None)
+    if previous == (instance.cupcake_id, instance.avaliacao):
+        return
+
+    # Uma avaliação alterada sai dos agregados com os valores antigos e entra com os novos
+    if not created and previous is not None:
+        apply_review_delta(*previous, sign=-1)
+    apply_review_delta(instance.cupcake_id, instance.avaliacao)
+
 
-        # Sinaliza que o processamento foi feito
-        instance._processed = True
-        instance.save()
+@receiver(post_delete, sender=Review)
+def remove_cupcake_rating(sender, instance, **kwargs):
+    apply_review_delta(instance.cupcake_id, instance.avaliacao, sign=-1)
@@ -0,0 +1,528 @@
+"""
+Fila de processamento de imagens baseada no banco de dados.
+
+O upload de um `CupcakeImage` apenas cria um `ImageJob` pendente; o trabalho
+pesado (redimensionar e remover o fundo) é feito pelo comando
+`manage.py image_worker`, que reserva os jobs com as funções abaixo e executa
+`core.imaging.resize_and_rename_images` em um `ProcessPoolExecutor`.
+
+As variantes geradas ficam em um `ImageAsset`, identificado pelo SHA-256 do
+arquivo enviado: um upload com os mesmos bytes de um arquivo já processado é
+ligado ao asset existente sem passar pelo worker. Enquanto um arquivo ainda
+está na fila, novos uploads com os mesmos bytes (e os cupcakes criados antes
+de a imagem padrão ser processada) não geram outro processamento: o job deles
+fica "Aguardando" o job em andamento (`coalesced_into`) e recebe as mesmas
+variantes quando ele termina. O `ref_count` do asset conta quantas imagens o
+usam, e os arquivos só são apagados quando ele chega a zero.
+
+Os avatares enviados em `Profile.avatar` passam pela mesma fila (jobs com
+`profile` em vez de `image`) e viram as variantes quadradas de
+`core.imaging.avatar_variants`.
+"""
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.imaging import ImageRejected
+from core.models import CupcakeImage, ImageAsset, ImageJob, Profile
+
+logger = logging.getLogger('django')
+
+DEFAULT_IMAGE_NAME = os.path.basename(settings.DEFAULT_CUPCAKE_IMAGE)
+
+# Jobs ainda sem resultado
+ACTIVE_STATUSES = [ImageJob.PENDENTE, ImageJob.PROCESSANDO, ImageJob.AGUARDANDO]
+
+
+def hash_media_file(name):
+    """
+    Retorna o SHA-256 (hexadecimal) do arquivo `name`, relativo a MEDIA_ROOT.
+    """
+    with open(os.path.join(settings.MEDIA_ROOT, name), "rb") as media_file:
+        return hashlib.file_digest(media_file, "sha256").hexdigest()
+
+
+def variant_prefix(sha256):
+    """
+    Prefixo dos nomes das variantes geradas para um arquivo com este hash.
+    """
+    return f"cupcake_{sha256}"
+
+
+def avatar_prefix(profile_pk, sha256):
+    """
+    Prefixo dos nomes das variantes do avatar de um perfil. Inclui o perfil
+    porque as variantes de avatar não são compartilhadas entre perfis.
+    """
+    return f"avatar_{profile_pk}_{sha256}"
+
+
+def is_default_source(name):
+    return os.path.basename(name) == DEFAULT_IMAGE_NAME
+
+
+def attach_default_asset(cupcake):
+    """
+    Cria a imagem padrão de `cupcake` apontando para as variantes já geradas da
+    imagem padrão, sem nenhum processamento.
+
+    Retorna `None` se as variantes padrão ainda não existirem.
+    """
+    asset = ImageAsset.objects.filter(is_default=True).first()
+    if asset is None:
+        return None
+
+    with transaction.atomic():
+        image = CupcakeImage.objects.create(
+            cupcake=cupcake,
+            normal=asset.normal,
+            large_size=asset.large_size,
+            small_size=asset.small_size,
+            asset=asset,
+            background_tier=asset.background_tier,
+            placeholder=asset.placeholder,
+            descricao="Imagem padrão",
+            _processed=True,
+        )
+        ImageAsset.objects.filter(pk=asset.pk).update(ref_count=F("ref_count") + 1)
+
+    return image
+
+
+def enqueue_image_job(image):
+    """
+    Liga `image` às variantes de um upload idêntico, se existirem; caso
+    contrário cria um job pendente (a menos que já exista um para o mesmo
+    arquivo) ou, se outro job já processa os mesmos bytes, um job que aguarda
+    por ele.
+
+    Retorna o job ou `None` quando as variantes foram reaproveitadas.
+    """
+    sha256 = hash_media_file(image.normal.name)
+
+    asset = ImageAsset.objects.filter(sha256=sha256).first()
+    if asset and attach_asset(image.pk, image.normal.name, asset):
+        logger.info(f"Imagem {image.pk} reaproveitou as variantes de {sha256[:12]}.")
+        return None
+
+    job = ImageJob.objects.filter(
+        image=image,
+        source=image.normal.name,
+        status__in=ACTIVE_STATUSES,
+    ).first()
+    if job:
+        return job
+
+    leader = (
+        ImageJob.objects.filter(
+            image__isnull=False,
+            sha256=sha256,
+            status__in=[ImageJob.PENDENTE, ImageJob.PROCESSANDO],
+        )
+        .order_by("created_at")
+        .first()
+    )
+    if leader:
+        job = ImageJob.objects.create(
+            image=image,
+            source=image.normal.name,
+            sha256=sha256,
+            status=ImageJob.AGUARDANDO,
+            coalesced_into=leader,
+        )
+        logger.info(f"Job {job.pk} da imagem {image.pk} aguarda o job {leader.pk} ({sha256[:12]}).")
+        return job
+
+    job = ImageJob.objects.create(image=image, source=image.normal.name, sha256=sha256)
+    logger.info(f"Job {job.pk} criado para a imagem {image.pk}.")
+    return job
+
+
+def enqueue_avatar_job(profile):
+    """
+    Cria um job pendente para gerar as variantes do avatar de `profile`
+    (a menos que já exista um para o mesmo arquivo).
+    """
+    source = profile.avatar.name
+    job = ImageJob.objects.filter(
+        profile=profile,
+        source=source,
+        status__in=[ImageJob.PENDENTE, ImageJob.PROCESSANDO],
+    ).first()
+    if job:
+        return job
+
+    job = ImageJob.objects.create(profile=profile, source=source, sha256=hash_media_file(source))
+    logger.info(f"Job {job.pk} criado para o avatar do perfil {profile.pk}.")
+    return job
+
+
+def claim_jobs(limit):
+    """
+    Reserva até `limit` jobs pendentes, marcando-os como "Processando".
+
+    A troca de status é feita com um UPDATE condicional por job, então dois
+    workers concorrentes nunca reservam o mesmo job. Jobs "Aguardando" cujo
+    job em andamento foi excluído (junto com a imagem dele) voltam a ser
+    processados por conta própria.
+    """
+    claimable = Q(status=ImageJob.PENDENTE) | Q(status=ImageJob.AGUARDANDO, coalesced_into__isnull=True)
+    pending = (
+        ImageJob.objects.filter(claimable)
+        .order_by("created_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+
+    claimed = []
+    for pk in list(pending):
+        updated = ImageJob.objects.filter(claimable, pk=pk).update(
+            status=ImageJob.PROCESSANDO,
+            started_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(pk)
+
+    jobs = list(ImageJob.objects.filter(pk__in=claimed).order_by("created_at"))
+    for job in jobs:
+        # Jobs criados antes do armazenamento por hash
+        if not job.sha256:
+            job.sha256 = hash_media_file(job.source)
+            ImageJob.objects.filter(pk=job.pk).update(sha256=job.sha256)
+
+    return jobs
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Devolve para a fila os jobs presos em "Processando" há mais de `timeout` segundos
+    (por exemplo, quando o worker anterior foi encerrado no meio do trabalho).
+    """
+    timeout = timeout or settings.IMAGE_JOB_TIMEOUT
+    limit = timezone.now() - timedelta(seconds=timeout)
+    return ImageJob.objects.filter(
+        status=ImageJob.PROCESSANDO, started_at__lt=limit
+    ).update(status=ImageJob.PENDENTE)
+
+
+def remove_media_file(name):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if os.path.basename(name) != DEFAULT_IMAGE_NAME and os.path.exists(path):
+        os.remove(path)
+
+
+def attach_asset(image_pk, source, asset):
+    """
+    Aponta a imagem para as variantes de `asset` e incrementa o `ref_count`.
+
+    A troca só acontece se a imagem ainda usar o arquivo `source`; nesse caso o
+    asset usado anteriormente pela imagem é liberado e o arquivo enviado é
+    apagado depois do commit. Retorna `True` se a imagem foi atualizada.
+    """
+    with transaction.atomic():
+        image = (
+            CupcakeImage.objects.select_for_update()
+            .filter(pk=image_pk, normal=source)
+            .first()
+        )
+        if image is None:
+            return False
+
+        previous_asset_id = image.asset_id
+        CupcakeImage.objects.filter(pk=image_pk).update(
+            normal=asset.normal,
+            large_size=asset.large_size,
+            small_size=asset.small_size,
+            asset=asset,
+            background_tier=asset.background_tier,
+            placeholder=asset.placeholder,
+            _processed=True,
+        )
+        ImageAsset.objects.filter(pk=asset.pk).update(ref_count=F("ref_count") + 1)
+
+        if previous_asset_id:
+            release_asset(previous_asset_id)
+
+        if source not in asset.variant_names:
+            transaction.on_commit(lambda: remove_media_file(source))
+
+    return True
+
+
+def release_asset(asset_pk):
+    """
+    Decrementa o `ref_count` do asset e, quando ninguém mais o usa, apaga o
+    registro e os arquivos das variantes (depois do commit).
+    """
+    with transaction.atomic():
+        ImageAsset.objects.filter(pk=asset_pk, ref_count__gt=0).update(
+            ref_count=F("ref_count") - 1
+        )
+
+        # As variantes da imagem padrão ficam sempre disponíveis para novos cupcakes
+        asset = (
+            ImageAsset.objects.select_for_update()
+            .filter(pk=asset_pk, ref_count=0, is_default=False)
+            .first()
+        )
+        if asset is None:
+            return
+
+        names = asset.variant_names
+        asset.delete()
+        logger.info(f"Asset {asset.sha256[:12]} sem referências; variantes apagadas.")
+        for name in names:
+            transaction.on_commit(lambda name=name: remove_media_file(name))
+
+
+def complete_job(job, variants):
+    """
+    Registra as variantes geradas no job em um `ImageAsset` e troca
+    atomicamente as variantes do `CupcakeImage` por elas, e também as das
+    imagens cujos jobs aguardavam este.
+
+    A troca só é aplicada se a imagem ainda apontar para o arquivo original do
+    job; se nenhuma delas ainda aponta (trocadas ou excluídas enquanto o worker
+    trabalhava), um asset recém-criado e sem referências é descartado junto
+    com os arquivos.
+    """
+    is_default = is_default_source(job.source)
+
+    with transaction.atomic():
+        asset, created = ImageAsset.objects.get_or_create(
+            sha256=job.sha256,
+            defaults={
+                "normal": variants["normal"],
+                "large_size": variants["large_size"],
+                "small_size": variants["small_size"],
+                "responsive": variants.get("responsive", []),
+                "original": variants.get("original", ""),
+                "background_tier": variants.get("background_tier", ""),
+                "placeholder": variants.get("placeholder", ""),
+                "is_default": is_default,
+            },
+        )
+        if is_default and not asset.is_default:
+            mark_default_asset(asset)
+
+        attached = attach_asset(job.image_id, job.source, asset)
+
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.CONCLUIDO,
+            finished_at=timezone.now(),
+            error=None,
+            peak_memory=variants.get("peak_rss"),
+        )
+
+        # Imagens com os mesmos bytes que aguardavam este job recebem as mesmas variantes
+        followers = ImageJob.objects.filter(coalesced_into=job, status=ImageJob.AGUARDANDO)
+        for follower in followers.only("pk", "image_id", "source"):
+            if attach_asset(follower.image_id, follower.source, asset):
+                attached = True
+        followers.update(status=ImageJob.CONCLUIDO, finished_at=timezone.now(), error=None)
+
+        # Outro job com os mesmos bytes terminou primeiro com outros nomes de arquivo
+        if not created:
+            for name in set(variant_names(variants)) - set(asset.variant_names):
+                transaction.on_commit(lambda name=name: remove_media_file(name))
+
+        if not attached:
+            logger.warning(f"Imagem do job {job.pk} foi alterada; variantes não utilizadas.")
+            if created:
+                release_asset(asset.pk)
+
+    return attached
+
+
+def complete_avatar_job(job, variants):
+    """
+    Grava as variantes do avatar no perfil, se ele ainda usar o arquivo do
+    job; caso contrário (avatar trocado ou perfil excluído) os arquivos
+    gerados são apagados.
+    """
+    with transaction.atomic():
+        updated = Profile.objects.filter(pk=job.profile_id, avatar=job.source).update(
+            avatar_small=variants["small"],
+            avatar_small_webp=variants["small_webp"],
+        )
+
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.CONCLUIDO,
+            finished_at=timezone.now(),
+            error=None,
+            peak_memory=variants.get("peak_rss"),
+        )
+
+        if not updated:
+            logger.warning(f"Avatar do job {job.pk} foi alterado; variantes não utilizadas.")
+            for name in (variants["small"], variants["small_webp"]):
+                transaction.on_commit(lambda name=name: remove_media_file(name))
+
+    return bool(updated)
+
+
+def variant_names(variants):
+    """
+    Nomes dos arquivos de um dicionário de variantes devolvido por `core.imaging`.
+    """
+    names = [variants["normal"], variants["large_size"], variants["small_size"]]
+    names += [variant["name"] for variant in variants.get("responsive", [])]
+    if variants.get("original"):
+        names.append(variants["original"])
+    return names
+
+
+def reprocess_source(asset):
+    """
+    Arquivo a partir do qual as variantes de `asset` são geradas de novo.
+
+    Retorna `(caminho, is_cutout)`: o original guardado quando existe; para
+    assets anteriores a ele, a imagem padrão ou, na falta dela, a variante large
+    (que já está sem fundo).
+    """
+    candidates = []
+    if asset.original:
+        candidates.append((asset.original, False))
+    if asset.is_default:
+        candidates.append((settings.DEFAULT_CUPCAKE_IMAGE, False))
+    candidates.append((asset.large_size, True))
+
+    for name, is_cutout in candidates:
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        if os.path.exists(path):
+            return path, is_cutout
+    raise FileNotFoundError(f"Nenhum arquivo de origem para o asset {asset.sha256[:12]}.")
+
+
+def adopt_legacy_image(image):
+    """
+    Liga uma imagem processada antes dos assets existirem (sem `asset`) a um
+    `ImageAsset` com as variantes dela, para que `reprocess_images` a alcance.
+
+    Sem o original guardado, o asset é identificado pelo SHA-256 do recorte
+    (a variante large), que também é a origem ao gerar as variantes de novo.
+    Se outra imagem antiga tiver o mesmo recorte, as duas passam a usar o mesmo
+    asset e os arquivos que só esta imagem usava são apagados depois do commit.
+
+    Retorna o asset, ou `None` se a imagem já tiver um. Levanta
+    `FileNotFoundError` se o recorte não existir.
+    """
+    source = image.large_size.name or image.normal.name
+    sha256 = hash_media_file(source)
+
+    with transaction.atomic():
+        if not CupcakeImage.objects.select_for_update().filter(pk=image.pk, asset__isnull=True).exists():
+            return None
+
+        asset, _ = ImageAsset.objects.get_or_create(
+            sha256=sha256,
+            defaults={
+                "normal": image.normal.name,
+                "large_size": source,
+                "small_size": image.small_size.name or "",
+                "background_tier": image.background_tier,
+                "placeholder": image.placeholder,
+            },
+        )
+        CupcakeImage.objects.filter(pk=image.pk).update(
+            normal=asset.normal,
+            large_size=asset.large_size,
+            small_size=asset.small_size,
+            asset=asset,
+            background_tier=asset.background_tier,
+            placeholder=asset.placeholder,
+        )
+        ImageAsset.objects.filter(pk=asset.pk).update(ref_count=F("ref_count") + 1)
+
+        previous = {image.normal.name, image.large_size.name, image.small_size.name} - {None, ""}
+        for name in previous - set(asset.variant_names):
+            in_use = CupcakeImage.objects.filter(
+                Q(normal=name) | Q(large_size=name) | Q(small_size=name)
+            ).exists()
+            if not in_use:
+                transaction.on_commit(lambda name=name: remove_media_file(name))
+
+    return asset
+
+
+def update_asset_variants(asset_pk, variants):
+    """
+    Grava as variantes geradas novamente para um asset e nas imagens que o usam.
+
+    Arquivos da versão anterior que não fazem mais parte do asset (por exemplo,
+    larguras removidas de IMAGE_SRCSET_WIDTHS) são apagados depois do commit.
+    """
+    with transaction.atomic():
+        asset = ImageAsset.objects.select_for_update().filter(pk=asset_pk).first()
+        if asset is None:
+            # O asset foi liberado enquanto as variantes eram geradas
+            for name in variant_names(variants):
+                transaction.on_commit(lambda name=name: remove_media_file(name))
+            return False
+
+        previous = set(asset.variant_names)
+        fields = {
+            "normal": variants["normal"],
+            "large_size": variants["large_size"],
+            "small_size": variants["small_size"],
+            "responsive": variants.get("responsive", []),
+            "original": variants.get("original") or asset.original,
+            # Reprocessar a partir do recorte antigo não remove o fundo de novo
+            "background_tier": variants.get("background_tier") or asset.background_tier,
+            "placeholder": variants.get("placeholder", ""),
+        }
+        ImageAsset.objects.filter(pk=asset_pk).update(**fields)
+        CupcakeImage.objects.filter(asset_id=asset_pk).update(
+            normal=fields["normal"],
+            large_size=fields["large_size"],
+            small_size=fields["small_size"],
+            background_tier=fields["background_tier"],
+            placeholder=fields["placeholder"],
+        )
+
+        current = set(variant_names(fields))
+        for name in previous - current:
+            transaction.on_commit(lambda name=name: remove_media_file(name))
+
+    return True
+
+
+def mark_default_asset(asset):
+    """
+    Define `asset` como as variantes da imagem padrão dos cupcakes.
+    """
+    with transaction.atomic():
+        ImageAsset.objects.filter(is_default=True).exclude(pk=asset.pk).update(is_default=False)
+        ImageAsset.objects.filter(pk=asset.pk).update(is_default=True)
+    asset.is_default = True
+
+
+def fail_job(job, error):
+    """
+    Registra o erro do job e o devolve para a fila enquanto houver tentativas
+    (arquivos recusados por `core.imaging.open_image` falham de imediato).
+    """
+    status = ImageJob.PENDENTE
+    # Arquivos recusados pelos limites de tamanho falhariam em todas as tentativas
+    if job.attempts >= settings.IMAGE_JOB_MAX_ATTEMPTS or isinstance(error, ImageRejected):
+        status = ImageJob.FALHOU
+
+    ImageJob.objects.filter(pk=job.pk).update(
+        status=status,
+        error=str(error),
+        finished_at=timezone.now(),
+    )
+    if status == ImageJob.FALHOU:
+        # Os jobs que aguardavam este têm os mesmos bytes e falhariam da mesma forma
+        ImageJob.objects.filter(coalesced_into=job, status=ImageJob.AGUARDANDO).update(
+            status=ImageJob.FALHOU,
+            error=str(error),
+            finished_at=timezone.now(),
+        )
+    logger.error(f"Erro ao processar o job {job.pk} (tentativa {job.attempts}): {error}")
@@ -0,0 +1,104 @@
+from django import template
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from core import image_cache
+from core.imaging import OUTPUT_FORMATS, VARIANTS
+
+register = template.Library()
+
+# Tamanho da variante normal, usada como `src` do <img>
+NORMAL_SIZE = next(size for field, _, size, _ in VARIANTS if field == "normal")
+
+
+@register.simple_tag
+def responsive_image(image, sizes=None, alt="", **attrs):
+    """
+    Renderiza um `CupcakeImage` como `<picture>` com um `<source srcset sizes>`
+    por formato (AVIF, WebP...) e um `<img>` com a variante normal em PNG como fallback.
+
+    Uso: {% responsive_image produto.imagens.0 alt=produto.cupcake.titulo class="w-100" %}
+
+    O `<img>` recebe `width`/`height` da variante normal e, quando a imagem tem
+    `placeholder`, a miniatura embutida como fundo até a imagem carregar.
+
+    Imagens ainda em processamento, ou sem variantes responsivas, são
+    renderizadas como um `<img>` simples.
+    """
+    if not image:
+        return ""
+
+    # Dimensões explícitas reservam o espaço (proporção) da imagem antes de ela carregar;
+    # "height: auto" mantém a proporção quando o CSS muda a largura
+    width, height = NORMAL_SIZE
+    attrs.setdefault("width", width)
+    attrs.setdefault("height", height)
+    style = ["height: auto;"]
+
+    if image.placeholder and not image.is_processing:
+        style.append(f"background-image: url({image.placeholder}); background-size: cover;")
+        # As variantes são PNGs transparentes: a miniatura sai de trás da imagem quando ela carrega
+        attrs["onload"] = "this.style.backgroundImage='none'"
+
+    if attrs.get("style"):
+        style.append(attrs["style"])
+    attrs["style"] = " ".join(style)
+
+    extra_attrs = format_html_join("", ' {}="{}"', attrs.items())
+    img = format_html('<img src="{}" alt="{}"{}>', image.get_normal_url(), alt, extra_attrs)
+
+    if image.is_processing or not image.asset or not image.asset.responsive:
+        return img
+
+    sizes = sizes or settings.IMAGE_SRCSET_SIZES
+    sources = []
+    for image_format, (_, _, content_type) in OUTPUT_FORMATS.items():
+        srcset = ", ".join(
+            f"{default_storage.url(variant['name'])} {variant['width']}w"
+            for variant in image.asset.responsive
+            if variant["format"] == image_format
+        )
+        if srcset:
+            sources.append(
+                format_html('<source type="{}" srcset="{}" sizes="{}">', content_type, srcset, sizes)
+            )
+
+    return format_html("<picture>{}{}</picture>", mark_safe("".join(sources)), img)
+
+
+@register.simple_tag
+def image_url(page, _type, name, w=None, fm=None, q=None):
+    """
+    URL de `views.get_image` com uma transformação sob demanda.
+
+    Uso: <img src="{% image_url 'home' 'banner' '1-1.png' w=600 fm='webp' %}">
+    """
+    url = reverse("get_image", kwargs={"page": page, "_type": _type, "name": name})
+    params = {key: value for key, value in (("w", w), ("fm", fm), ("q", q)) if value}
+    return f"{url}?{urlencode(params)}" if params else url
+
+
+@register.simple_tag
+def image_srcset(page, _type, name, widths, fm=None, q=None):
+    """
+    Valor de `srcset` com uma URL de `image_url` por largura de `widths` ("400,800,1200").
+
+    As transformações não ampliam a imagem: larguras maiores que a da imagem
+    original viram uma única entrada com a largura real dela.
+
+    Uso: srcset="{% image_srcset 'home' 'banner' '1-1.png' '400,800,1200' fm='webp' %}"
+    """
+    widths = [int(width) for width in str(widths).split(",")]
+    try:
+        available = image_cache.source_width(image_cache.media_path(page, _type, name))
+    except SuspiciousFileOperation:
+        available = None
+    if available:
+        widths = sorted({min(width, available) for width in widths})
+
+    return ", ".join(f"{image_url(page, _type, name, w=width, fm=fm, q=q)} {width}w" for width in widths)
@@ -1,3 +1,1221 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.http import Http404, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import autocomplete, facets, fuzzy, image_cache, pagination, search
+from core.imaging import ImageRejected
+from core.management.commands import reprocess_images
+from core.models import Categoria, Cupcake, CupcakeImage, ImageAsset, ImageJob, Profile, Review
+from core.ratings import histogram_field, rebuild_ratings
+from core.tasks import attach_default_asset, claim_jobs, complete_job, fail_job, requeue_stale_jobs
+from core.templatetags.image_tags import image_srcset
+from core.views import SHOP_ORDERINGS, get_image
+
+# Bibliotecas de imagem que só o worker de imagens deve carregar
+HEAVY_IMAGING_MODULES = ("PIL", "rembg", "onnxruntime", "numpy", "cv2", "scipy", "numba", "pymatting")
+
+# Tempo máximo (em segundos) para importar a aplicação WSGI e as URLs
+WSGI_IMPORT_BUDGET = float(os.environ.get("WSGI_IMPORT_BUDGET", 2.0))
+
+# Arquivos estáticos sem o manifesto do `collectstatic`, para renderizar as páginas
+TEST_STORAGES = {
+    **settings.STORAGES,
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import cupcakes.wsgi, cupcakes.urls
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+class WsgiColdStartTests(SimpleTestCase):
+    """
+    Mede o cold start de `cupcakes.wsgi` em um interpretador novo, como acontece
+    em cada worker do gunicorn.
+    """
+
+    def cold_start(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_does_not_import_imaging_stack(self):
+        modules = self.cold_start()["modules"]
+        loaded = [
+            name
+            for name in HEAVY_IMAGING_MODULES
+            if name in modules or any(m.startswith(f"{name}.") for m in modules)
+        ]
+        self.assertEqual(loaded, [])
+
+    def test_import_time_budget(self):
+        # Usa a melhor de três medições para reduzir o ruído da máquina
+        elapsed = min(self.cold_start()["elapsed"] for _ in range(3))
+        self.assertLess(
+            elapsed,
+            WSGI_IMPORT_BUDGET,
+            f"Importar cupcakes.wsgi levou {elapsed:.2f}s (limite {WSGI_IMPORT_BUDGET}s).",
+        )
+
+
+class MediaTestCase(TestCase):
+    """
+    Testes com um MEDIA_ROOT temporário que já contém a imagem padrão dos
+    cupcakes (os sinais calculam o hash dos arquivos enviados).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        cls.addClassCleanup(media.disable)
+        write_media("cupcakes-fotos/default_cupcakes.jpeg", b"imagem padrao")
+        super().setUpClass()
+
+
+def write_media(name, content):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as media_file:
+        media_file.write(content)
+    return name
+
+
+def media_exists(name):
+    return os.path.exists(os.path.join(settings.MEDIA_ROOT, name))
+
+
+def create_default_asset():
+    # Com as variantes padrão já geradas, criar um cupcake não lê a imagem padrão do disco
+    return ImageAsset.objects.create(
+        sha256="0" * 64,
+        normal="cupcakes-fotos/default_cupcakes.webp",
+        large_size="cupcakes-fotos/default_cupcakes_large.webp",
+        small_size="cupcakes-fotos/default_cupcakes_small.webp",
+        is_default=True,
+    )
+
+
+def create_cupcake(categoria, sku, **fields):
+    values = {
+        "titulo": f"Cupcake {sku}",
+        "descricao": "Massa fofinha.",
+        "preco": Decimal("10.00"),
+        "quantidade_disponivel": 10,
+        "data_lancamento": datetime.date(2024, 1, 1),
+        "ingrediente": "Farinha de trigo",
+        "etiqueta": "Tradicional",
+        "cobertura": "Chantilly",
+    }
+    values.update(fields)
+    return Cupcake.objects.create(categoria=categoria, sku=sku, **values)
+
+
+class ImageJobQueueTests(MediaTestCase):
+    """
+    Fila de jobs de imagem (`core.tasks`): reserva, novas tentativas e jobs presos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nome_categoria="Chocolate")
+        cls.cupcake = create_cupcake(categoria, "FILA-1")
+        # Descarta o job da imagem padrão criada pelo sinal do cupcake
+        ImageJob.objects.all().delete()
+
+    def create_job(self, n, **fields):
+        image = CupcakeImage.objects.create(
+            cupcake=self.cupcake,
+            normal=f"cupcakes-fotos/foto{n}.png",
+            _processed=True,
+        )
+        return ImageJob.objects.create(image=image, source=image.normal.name, sha256=f"{n:064x}", **fields)
+
+    def test_claim(self):
+        jobs = [self.create_job(n) for n in range(3)]
+        self.create_job(3, status=ImageJob.CONCLUIDO)
+
+        claimed = claim_jobs(2)
+        self.assertEqual([job.pk for job in claimed], [jobs[0].pk, jobs[1].pk])
+        for job in claimed:
+            self.assertEqual(job.status, ImageJob.PROCESSANDO)
+            self.assertEqual(job.attempts, 1)
+            self.assertIsNotNone(job.started_at)
+
+        # Um job reservado não é reservado de novo por outro worker
+        self.assertEqual([job.pk for job in claim_jobs(5)], [jobs[2].pk])
+        self.assertEqual(claim_jobs(5), [])
+
+    def test_claim_orphaned_follower(self):
+        leader = self.create_job(0)
+        follower = self.create_job(1, status=ImageJob.AGUARDANDO, coalesced_into=leader)
+
+        # Enquanto o job em andamento existir, o que aguarda não é reservado
+        self.assertEqual([job.pk for job in claim_jobs(5)], [leader.pk])
+
+        leader.delete()
+        self.assertEqual([job.pk for job in claim_jobs(5)], [follower.pk])
+
+    @override_settings(IMAGE_JOB_MAX_ATTEMPTS=2)
+    def test_retry_until_max_attempts(self):
+        job = self.create_job(0)
+
+        (job,) = claim_jobs(1)
+        fail_job(job, RuntimeError("falhou"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (ImageJob.PENDENTE, 1, "falhou"))
+
+        (job,) = claim_jobs(1)
+        fail_job(job, RuntimeError("falhou de novo"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FALHOU, 2))
+        self.assertEqual(claim_jobs(1), [])
+
+    def test_rejected_fails_at_once(self):
+        leader = self.create_job(0)
+        follower = self.create_job(1, status=ImageJob.AGUARDANDO, coalesced_into=leader)
+
+        (job,) = claim_jobs(1)
+        fail_job(job, ImageRejected("grande demais"))
+        job.refresh_from_db()
+        follower.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FALHOU, 1))
+        # Quem aguardava tem os mesmos bytes e falha junto
+        self.assertEqual(follower.status, ImageJob.FALHOU)
+
+    def test_requeue_stale_jobs(self):
+        stale, recent = self.create_job(0), self.create_job(1)
+        claim_jobs(2)
+        ImageJob.objects.filter(pk=stale.pk).update(started_at=timezone.now() - datetime.timedelta(seconds=120))
+
+        self.assertEqual(requeue_stale_jobs(timeout=60), 1)
+        stale.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((stale.status, recent.status), (ImageJob.PENDENTE, ImageJob.PROCESSANDO))
+
+        # De volta à fila, é reservado de novo com mais uma tentativa
+        (job,) = claim_jobs(5)
+        self.assertEqual((job.pk, job.attempts), (stale.pk, 2))
+
+
+class ImageAssetTests(MediaTestCase):
+    """
+    Variantes compartilhadas por hash (`ImageAsset`): reaproveitamento de
+    uploads idênticos, `ref_count` e remoção dos arquivos sem referências.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nome_categoria="Chocolate")
+        cls.cupcake = create_cupcake(categoria, "ASSET-1")
+
+    def create_asset(self, content, name):
+        names = [write_media(f"cupcakes-fotos/{name}_{size}.jpeg", content) for size in ("normal", "large", "small")]
+        return ImageAsset.objects.create(
+            sha256=hashlib.sha256(content).hexdigest(),
+            normal=names[0],
+            large_size=names[1],
+            small_size=names[2],
+        )
+
+    def upload(self, content, name):
+        source = write_media(f"cupcakes-fotos/{name}.png", content)
+        with self.captureOnCommitCallbacks(execute=True):
+            image = CupcakeImage.objects.create(cupcake=self.cupcake, normal=source)
+        image.refresh_from_db()
+        return image
+
+    def test_identical_upload_reuses_asset(self):
+        asset = self.create_asset(b"foto de morango", "morango")
+
+        image = self.upload(b"foto de morango", "envio")
+        asset.refresh_from_db()
+        self.assertEqual((image.asset_id, image.normal.name, image._processed), (asset.pk, asset.normal, True))
+        self.assertEqual(asset.ref_count, 1)
+        self.assertFalse(ImageJob.objects.filter(image=image).exists())
+        # O arquivo enviado não é mais necessário
+        self.assertFalse(media_exists("cupcakes-fotos/envio.png"))
+
+    def test_completed_job_creates_asset(self):
+        image = self.upload(b"foto de coco", "coco")
+        job = ImageJob.objects.get(image=image)
+        self.assertEqual(job.sha256, hashlib.sha256(b"foto de coco").hexdigest())
+
+        variants = {
+            size: write_media(f"cupcakes-fotos/coco_{size}.jpeg", b"variante")
+            for size in ("normal", "large_size", "small_size")
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(complete_job(job, variants))
+        asset = ImageAsset.objects.get(sha256=job.sha256)
+        image.refresh_from_db()
+        self.assertEqual((image.asset_id, image.normal.name), (asset.pk, variants["normal"]))
+        self.assertEqual(asset.ref_count, 1)
+
+        # Um segundo upload com os mesmos bytes não passa pelo worker
+        other = self.upload(b"foto de coco", "coco-de-novo")
+        asset.refresh_from_db()
+        self.assertEqual((other.asset_id, asset.ref_count), (asset.pk, 2))
+        self.assertEqual(ImageJob.objects.filter(image=other).count(), 0)
+
+    def test_identical_uploads_in_queue_share_one_job(self):
+        first = self.upload(b"foto de amora", "amora-1")
+        second = self.upload(b"foto de amora", "amora-2")
+        leader = ImageJob.objects.get(image=first)
+        follower = ImageJob.objects.get(image=second)
+        self.assertEqual((leader.status, follower.status), (ImageJob.PENDENTE, ImageJob.AGUARDANDO))
+        self.assertEqual(follower.coalesced_into_id, leader.pk)
+        claimed = [job.pk for job in claim_jobs(5)]
+        self.assertIn(leader.pk, claimed)
+        self.assertNotIn(follower.pk, claimed)
+
+        variants = {
+            size: write_media(f"cupcakes-fotos/amora_{size}.jpeg", b"variante")
+            for size in ("normal", "large_size", "small_size")
+        }
+        leader.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(complete_job(leader, variants))
+        asset = ImageAsset.objects.get(sha256=leader.sha256)
+        self.assertEqual(asset.ref_count, 2)
+        for image in (first, second):
+            image.refresh_from_db()
+            self.assertEqual((image.asset_id, image.normal.name), (asset.pk, variants["normal"]))
+        follower.refresh_from_db()
+        self.assertEqual(follower.status, ImageJob.CONCLUIDO)
+
+    def test_files_removed_with_last_reference(self):
+        asset = self.create_asset(b"foto de limao", "limao")
+        first = self.upload(b"foto de limao", "limao-1")
+        second = self.upload(b"foto de limao", "limao-2")
+        asset.refresh_from_db()
+        self.assertEqual(asset.ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        asset.refresh_from_db()
+        self.assertEqual(asset.ref_count, 1)
+        self.assertTrue(all(media_exists(name) for name in asset.variant_names))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageAsset.objects.filter(pk=asset.pk).exists())
+        self.assertFalse(any(media_exists(name) for name in asset.variant_names))
+
+    def test_new_photo_releases_previous_asset(self):
+        old = self.create_asset(b"foto antiga", "antiga")
+        new = self.create_asset(b"foto nova", "nova")
+        image = self.upload(b"foto antiga", "antiga-envio")
+
+        image.normal = write_media("cupcakes-fotos/nova-envio.png", b"foto nova")
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual((image.asset_id, new.ref_count), (new.pk, 1))
+        self.assertFalse(ImageAsset.objects.filter(pk=old.pk).exists())
+        self.assertFalse(any(media_exists(name) for name in old.variant_names))
+
+
+    def test_prepare_default_image_force_updates_images(self):
+        old = self.create_asset(b"imagem padrao", "padrao-antiga")
+        ImageAsset.objects.filter(pk=old.pk).update(is_default=True, background_tier="rembg", placeholder="antigo")
+        image = attach_default_asset(self.cupcake)
+
+        variants = {
+            size: write_media(f"cupcakes-fotos/padrao-nova_{size}.webp", b"variante")
+            for size in ("normal", "large_size", "small_size")
+        }
+        variants.update(background_tier="matte", placeholder="data:image/webp;base64,novo", peak_rss=1)
+        with mock.patch("core.imaging.resize_and_rename_images", return_value=variants):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("prepare_default_image", "--force", stdout=io.StringIO())
+
+        # As imagens que usam as variantes padrão recebem as novas, como no worker
+        image.refresh_from_db()
+        self.assertEqual(
+            (image.normal.name, image.background_tier, image.placeholder),
+            (variants["normal"], "matte", "data:image/webp;base64,novo"),
+        )
+        self.assertFalse(any(media_exists(name) for name in old.variant_names))
+        self.assertEqual(ImageAsset.objects.get(is_default=True).pk, old.pk)
+
+    def legacy_image(self, name, cutout):
+        # Imagem processada antes dos assets: variantes próprias e nenhum asset
+        return CupcakeImage.objects.create(
+            cupcake=self.cupcake,
+            normal=write_media(f"cupcakes-fotos/{name}.png", b"normal"),
+            large_size=write_media(f"cupcakes-fotos/large-size/{name}.png", cutout),
+            small_size=write_media(f"cupcakes-fotos/small-size/{name}.png", b"small"),
+            background_tier="matte",
+            _processed=True,
+        )
+
+    def test_adopt_legacy_images(self):
+        first = self.legacy_image("antiga", b"recorte")
+        second = self.legacy_image("copia", b"recorte")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            command = reprocess_images.Command(stdout=io.StringIO())
+            command.adopt_legacy_images({"cupcake": [self.cupcake.pk], "categoria": []})
+
+        asset = ImageAsset.objects.get(sha256=hashlib.sha256(b"recorte").hexdigest())
+        self.assertEqual(asset.ref_count, 2)
+        self.assertEqual(
+            (asset.normal, asset.large_size, asset.background_tier),
+            (first.normal.name, first.large_size.name, "matte"),
+        )
+        for image in (first, second):
+            image.refresh_from_db()
+            self.assertEqual((image.asset_id, image.normal.name), (asset.pk, asset.normal))
+        # Os arquivos que só a cópia usava foram apagados
+        self.assertTrue(all(media_exists(name) for name in asset.variant_names))
+        self.assertFalse(media_exists("cupcakes-fotos/large-size/copia.png"))
+
+        # O asset é reprocessado a partir do recorte guardado
+        items = command.get_items(command.get_assets({"cupcake": [self.cupcake.pk], "categoria": []}))
+        source_path = os.path.join(settings.MEDIA_ROOT, asset.large_size)
+        self.assertIn((asset.pk, (f"cupcake_{asset.sha256}", source_path, True)), items)
+
+
+class ProfileAvatarTests(MediaTestCase):
+    """
+    Variantes do avatar (`signals.reset_avatar_variants`): só são descartadas
+    quando o avatar muda, sem consultar o banco a cada gravação do perfil.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("ana", password="senha")
+
+    def test_save_without_avatar_change(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar_small = "profile_images/small/ana.jpg"
+
+        # Apenas o UPDATE: o avatar anterior vem da consulta que carregou o perfil
+        profile.bio = "Adoro cupcakes."
+        with self.assertNumQueries(1):
+            profile.save()
+        with self.assertNumQueries(1):
+            profile.save(update_fields=["bio"])
+        self.assertEqual(profile.avatar_small.name, "profile_images/small/ana.jpg")
+
+        # Login: o post_save do usuário grava o perfil já carregado
+        user = User.objects.select_related("profile").get(pk=self.user.pk)
+        with self.assertNumQueries(2):
+            user.save()
+
+    def test_avatar_change(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar_small = "profile_images/small/ana.jpg"
+        profile.save()
+
+        profile.avatar = write_media("profile_images/ana.png", b"foto da ana")
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        self.assertEqual(profile.avatar_small.name, "")
+        self.assertTrue(ImageJob.objects.filter(profile=profile, source="profile_images/ana.png").exists())
+
+        # Gravar de novo o mesmo avatar não cria outro job
+        with self.assertNumQueries(1):
+            profile.save()
+
+
+class ImageResponseTests(SimpleTestCase):
+    """
+    `get_image`: requisições condicionais (304) e intervalos de bytes (206/416).
+    """
+
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        os.makedirs(os.path.join(media_root.name, "cupcakes-fotos"))
+        with open(os.path.join(media_root.name, "cupcakes-fotos", "teste.png"), "wb") as file:
+            file.write(self.CONTENT)
+
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.url = reverse("get_image", args=["null", "cupcakes-fotos", "teste.png"])
+
+    def test_full_response(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}")
+        self.assertTrue(response["ETag"])
+        self.assertTrue(response["Last-Modified"])
+
+    def test_not_modified(self):
+        first = self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], first["ETag"])
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"outra-versao"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_range(self):
+        size = len(self.CONTENT)
+        for header, start, end in (
+            ("bytes=0-99", 0, 99),
+            ("bytes=1000-", 1000, size - 1),
+            ("bytes=-24", size - 24, size - 1),
+            ("bytes=1000-5000", 1000, size - 1),
+        ):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response.streaming_content), self.CONTENT[start : end + 1])
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        size = len(self.CONTENT)
+        for header in (f"bytes={size}-", "bytes=10-5", "bytes=-0"):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], f"bytes */{size}")
+
+    def test_ignored_range(self):
+        # Vários intervalos ou um `If-Range` desatualizado: o arquivo inteiro
+        for headers in (
+            {"HTTP_RANGE": "bytes=0-9,20-29"},
+            {"HTTP_RANGE": "bytes=0-9", "HTTP_IF_RANGE": '"outra-versao"'},
+        ):
+            with self.subTest(headers=headers):
+                response = self.client.get(self.url, **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response.streaming_content), self.CONTENT)
+
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_missing_or_outside_media(self):
+        # Chama a view diretamente: a página 404 do site depende dos arquivos estáticos coletados
+        request = RequestFactory().get("/")
+        for parts in (("null", "cupcakes-fotos", "nao-existe.png"), ("..", "..", "settings.py")):
+            with self.subTest(parts=parts), self.assertRaises(Http404):
+                get_image(request, *parts)
+
+    def test_directory_is_not_found(self):
+        request = RequestFactory().get("/")
+        for parts in (("null", "null", "cupcakes-fotos"), ("cupcakes-fotos", "teste.png", "outra.png")):
+            with self.subTest(parts=parts), self.assertRaises(Http404):
+                get_image(request, *parts)
+
+    def write_image(self, name, image_format, size=(500, 250)):
+        from PIL import Image
+
+        Image.new("RGB", size, "pink").save(os.path.join(settings.MEDIA_ROOT, "cupcakes-fotos", name), image_format)
+        return reverse("get_image", args=["null", "cupcakes-fotos", name])
+
+    def transform_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = override_settings(IMAGE_TRANSFORM_CACHE_DIR=cache_dir.name)
+        cache.enable()
+        self.addCleanup(cache.disable)
+
+    def test_transform_not_an_image(self):
+        self.transform_cache()
+        response = self.client.get(self.url, {"w": 400})
+        self.assertEqual(response.status_code, 400)
+
+    def test_transform_unsupported_source_format(self):
+        # GIF não é um formato de saída: a variante sai em PNG
+        self.transform_cache()
+        url = self.write_image("teste.gif", "GIF")
+        response = self.client.get(url, {"w": 400})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+
+        with mock.patch("core.imaging._format_supported", side_effect=lambda image_format: image_format == "png"):
+            self.assertEqual(image_cache.parse_transform(QueryDict("fm=avif"), "teste.gif")["image_format"], "png")
+            self.assertEqual(image_cache.parse_transform(QueryDict("fm=webp"), "teste.jpg")["image_format"], "png")
+
+    def test_srcset_capped_at_source_width(self):
+        self.write_image("banner.png", "PNG")
+        srcset = image_srcset("null", "cupcakes-fotos", "banner.png", "280,400,600,800,1200")
+        self.assertEqual([entry.split()[-1] for entry in srcset.split(", ")], ["280w", "400w", "500w"])
+
+        # Largura desconhecida: as larguras pedidas, sem limite
+        srcset = image_srcset("null", "cupcakes-fotos", "nao-existe.png", "400,800")
+        self.assertEqual([entry.split()[-1] for entry in srcset.split(", ")], ["400w", "800w"])
+
+
+class RatingAggregateTests(TestCase):
+    """
+    Agregados das avaliações guardados no cupcake (`core.ratings`), mantidos
+    pelos sinais de `Review`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        cls.categoria = Categoria.objects.create(nome_categoria="Chocolate")
+        cls.users = [User.objects.create_user(f"cliente{n}") for n in range(3)]
+
+    def setUp(self):
+        self.cupcake = create_cupcake(self.categoria, "AVAL-1")
+
+    def review(self, user, avaliacao, cupcake=None):
+        return Review.objects.create(
+            cupcake=cupcake or self.cupcake,
+            usuario=user,
+            avaliacao=avaliacao,
+            comentario="Muito bom.",
+        )
+
+    def assertAggregates(self, rating_sum, rating_count, rating_avg, cupcake=None):
+        cupcake = cupcake or self.cupcake
+        cupcake.refresh_from_db()
+        self.assertEqual(
+            (cupcake.rating_sum, cupcake.rating_count),
+            (rating_sum, rating_count),
+        )
+        self.assertAlmostEqual(cupcake.rating_avg, rating_avg)
+
+    def test_starts_empty(self):
+        self.assertAggregates(0, 0, 0)
+
+    def test_create(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+        self.assertAggregates(7, 2, 3.5)
+
+    def test_update(self):
+        review = self.review(self.users[0], 5)
+        self.review(self.users[1], 3)
+
+        review.avaliacao = 1
+        review.save()
+        self.assertAggregates(4, 2, 2)
+
+        # Salvar sem alterar a nota não mexe nos agregados
+        review.comentario = "Mudei de ideia."
+        review.save()
+        self.assertAggregates(4, 2, 2)
+
+    def test_update_moves_to_other_cupcake(self):
+        other = create_cupcake(self.categoria, "AVAL-2")
+        review = self.review(self.users[0], 4)
+
+        review.cupcake = other
+        review.save()
+        self.assertAggregates(0, 0, 0)
+        self.assertAggregates(4, 1, 4, cupcake=other)
+
+    def test_delete(self):
+        review = self.review(self.users[0], 4)
+        self.review(self.users[1], 1)
+
+        review.delete()
+        self.assertAggregates(1, 1, 1)
+
+        Review.objects.all().delete()
+        self.assertAggregates(0, 0, 0)
+
+    def test_rebuild_ratings(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        # Alterações sem os sinais deixam os agregados desatualizados até o recálculo
+        Review.objects.update(avaliacao=1)
+        self.assertAggregates(9, 2, 4.5)
+
+        rebuild_ratings()
+        self.assertAggregates(2, 2, 1)
+
+    def test_with_rating(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+
+        queryset = Cupcake.objects.filter(pk=self.cupcake.pk).with_rating()
+        # Lê as colunas do cupcake, sem juntar as avaliações
+        self.assertNotIn(Review._meta.db_table, str(queryset.query))
+        cupcake = queryset.get()
+        self.assertEqual((cupcake.media_avaliacao, cupcake.total_avaliacoes), (3.5, 2))
+
+    def test_histogram(self):
+        review = self.review(self.users[0], 5)
+        self.review(self.users[1], 5)
+        self.review(self.users[2], 2)
+
+        review.avaliacao = 3
+        review.save()
+        self.cupcake.refresh_from_db()
+        self.assertEqual(
+            [(row["stars"], row["count"], row["percent"]) for row in self.cupcake.rating_histogram()],
+            [(5, 1, 33), (4, 0, 0), (3, 1, 33), (2, 1, 33), (1, 0, 0)],
+        )
+
+        review.delete()
+        self.cupcake.refresh_from_db()
+        self.assertEqual(
+            [getattr(self.cupcake, histogram_field(stars)) for stars in range(5, 0, -1)],
+            [1, 0, 0, 1, 0],
+        )
+
+    def test_histogram_rebuild(self):
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        Review.objects.update(avaliacao=1)
+
+        rebuild_ratings()
+        self.cupcake.refresh_from_db()
+        self.assertEqual([row["count"] for row in self.cupcake.rating_histogram()], [0, 0, 0, 0, 2])
+
+
+class SearchTests(TestCase):
+    """
+    Busca textual da loja (`core.search`): índice FTS5 no SQLite, mantido pelos
+    sinais de `Cupcake`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        categoria = Categoria.objects.create(nome_categoria="Frutas")
+        cls.titulo = create_cupcake(categoria, "BUSCA-1", titulo="Cupcake de Morango")
+        cls.cobertura = create_cupcake(categoria, "BUSCA-2", titulo="Cupcake Red Velvet", cobertura="Morango")
+        cls.descricao = create_cupcake(
+            categoria, "BUSCA-3", titulo="Cupcake de Baunilha", descricao="Recheio de geleia de morango."
+        )
+        cls.limao = create_cupcake(categoria, "BUSCA-4", titulo="Cupcake de Limão Siciliano")
+
+    def test_ranks_title_above_tags_above_body(self):
+        self.assertEqual(
+            search.search("morango"),
+            [self.titulo.pk, self.cobertura.pk, self.descricao.pk],
+        )
+
+    def test_accents_plurals_and_prefix(self):
+        self.assertEqual(search.search("limoes"), [self.limao.pk])
+        self.assertEqual(search.search("LIMÃO"), [self.limao.pk])
+        # O último termo também casa como prefixo, enquanto o usuário digita
+        self.assertEqual(search.search("cupcake sicil"), [self.limao.pk])
+        self.assertEqual(search.search("chocolate"), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.limao.titulo = "Cupcake de Maracujá"
+        self.limao.save()
+        self.assertEqual(search.search("limao"), [])
+        self.assertEqual(search.search("maracuja"), [self.limao.pk])
+
+        self.limao.delete()
+        self.assertEqual(search.search("maracuja"), [])
+
+    def test_filter_ranked(self):
+        ranked_ids = [self.descricao.pk, self.titulo.pk]
+        queryset = search.filter_ranked(Cupcake.objects.all(), ranked_ids)
+        self.assertEqual([cupcake.pk for cupcake in queryset], ranked_ids)
+        self.assertFalse(search.filter_ranked(Cupcake.objects.all(), []).exists())
+
+    def test_fallback_filter(self):
+        queryset = search.fallback_filter(Cupcake.objects.all(), "MORANGO")
+        self.assertEqual(
+            set(queryset.values_list("pk", flat=True)),
+            {self.titulo.pk, self.cobertura.pk, self.descricao.pk},
+        )
+        self.assertFalse(search.fallback_filter(Cupcake.objects.all(), "chocolate").exists())
+
+
+class TrigramIndexTests(SimpleTestCase):
+    """
+    Índice de trigramas da busca tolerante a erros de digitação (`core.fuzzy`).
+    """
+
+    def setUp(self):
+        self.index = fuzzy.TrigramIndex()
+        self.index.add(1, "Cupcake de Morango", "Tradicional", "Chantilly")
+        self.index.add(2, "Cupcake de Chocolate", "Vegano", "Morango")
+        self.index.add(3, "Cupcake de Limão", "Sem Glúten", "Merengue")
+
+    def test_typos(self):
+        self.assertEqual(self.index.search("morngo", threshold=0.3), [1, 2])
+        self.assertEqual(self.index.search("cupckae de limao", threshold=0.3), [3])
+        self.assertEqual(self.index.search("CHOCOLATTE", threshold=0.3), [2])
+
+    def test_title_above_tags(self):
+        # "Morango" é título do 1 e só cobertura do 2
+        self.assertEqual(self.index.search("morango", threshold=0.3), [1, 2])
+
+    def test_threshold(self):
+        self.assertEqual(self.index.similar_words("morango", 1.0), [("morango", 1.0)])
+        similar = dict(self.index.similar_words("morngo", 0.3))
+        self.assertIn("morango", similar)
+        self.assertLess(similar["morango"], 1.0)
+        self.assertEqual(self.index.search("morngo", threshold=similar["morango"] + 0.01), [])
+        self.assertEqual(self.index.search("abacaxi", threshold=0.3), [])
+
+    def test_all_words_then_any(self):
+        # Todas as palavras precisam aparecer no mesmo cupcake...
+        self.assertEqual(self.index.search("chocolate vegano", threshold=0.3), [2])
+        # ...e, se nenhum tiver todas, valem os que têm alguma
+        self.assertEqual(self.index.search("limao vegano", threshold=0.3), [3, 2])
+
+    def test_add_and_remove(self):
+        self.assertEqual(self.index.search("morango", threshold=0.3), [1, 2])
+
+        self.index.add(1, "Cupcake de Coco", "Tradicional", "Chantilly")
+        self.assertEqual(self.index.search("morango", threshold=0.3), [2])
+        self.assertEqual(self.index.search("coco", threshold=0.3), [1])
+
+        self.index.remove(2)
+        self.assertEqual(self.index.search("morango", threshold=0.3), [])
+        self.assertEqual(self.index.similar_words("morango", 0.3), [])
+        self.assertEqual(len(self.index), 2)
+
+
+class FuzzySignalTests(TestCase):
+    """
+    O índice do processo acompanha os cupcakes salvos e excluídos, e a
+    sincronização lê as alterações feitas por outros processos.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        cls.categoria = Categoria.objects.create(nome_categoria="Frutas")
+        cls.morango = create_cupcake(cls.categoria, "FUZZY-1", titulo="Cupcake de Morango")
+
+    def setUp(self):
+        # Constrói o índice nesta thread, em vez da thread da primeira busca
+        self.addCleanup(setattr, fuzzy, "_index", None)
+        fuzzy.build()
+
+    def test_save_and_delete(self):
+        self.assertEqual(fuzzy.search("morngo"), [self.morango.pk])
+
+        maracuja = create_cupcake(self.categoria, "FUZZY-2", titulo="Cupcake de Maracujá")
+        self.assertEqual(fuzzy.search("maracuja"), [maracuja.pk])
+
+        self.morango.titulo = "Cupcake de Amora"
+        self.morango.save()
+        self.assertEqual(fuzzy.search("morngo"), [])
+        self.assertEqual(fuzzy.search("amora"), [self.morango.pk])
+
+        maracuja.delete()
+        self.assertEqual(fuzzy.search("maracuja"), [])
+
+    def test_sync(self):
+        # Alterações sem os sinais deste processo, como as feitas por outro worker
+        Cupcake.objects.filter(pk=self.morango.pk).update(titulo="Cupcake de Amora", atualizado_em=timezone.now())
+        self.assertEqual(fuzzy.search("amora"), [])
+
+        fuzzy.sync()
+        self.assertEqual(fuzzy.search("amora"), [self.morango.pk])
+        self.assertEqual(fuzzy.search("morango"), [])
+
+
+class AutocompleteTests(TestCase):
+    """
+    Sugestões da busca da loja (`core.autocomplete` e `views.autocomplete`).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        cls.user = User.objects.create_user("cliente")
+        cls.frutas = Categoria.objects.create(nome_categoria="Frutas Vermelhas")
+        cls.morango = create_cupcake(cls.frutas, "AUTO-1", titulo="Cupcake de Morango")
+        cls.amora = create_cupcake(cls.frutas, "AUTO-2", titulo="Cupcake de Amora com Morango", esta_em_destaque=True)
+        cls.mousse = create_cupcake(cls.frutas, "AUTO-3", titulo="Mousse de Maracujá")
+
+    def setUp(self):
+        autocomplete.invalidate()
+        self.client.force_login(self.user)
+
+    def titles(self, query, limit=10):
+        return [titulo for _, titulo in autocomplete.suggest(query, limit)["cupcakes"]]
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self.titles("marac"), ["Mousse de Maracujá"])
+        self.assertEqual(self.titles("MARACUJÁ"), ["Mousse de Maracujá"])
+        self.assertEqual(self.titles("mor"), ["Cupcake de Amora com Morango", "Cupcake de Morango"])
+        # Mais de uma palavra: as palavras seguidas, a partir de qualquer uma delas
+        self.assertEqual(self.titles("de mor"), ["Cupcake de Morango"])
+        self.assertEqual(self.titles("xyz"), [])
+        self.assertEqual(self.titles("  "), [])
+        self.assertEqual(
+            [nome for _, nome in autocomplete.suggest("verm", 10)["categorias"]],
+            ["Frutas Vermelhas"],
+        )
+
+    def test_prefix_longer_than_trie(self):
+        self.assertGreater(len("cupcake de morango"), autocomplete.MAX_DEPTH)
+        self.assertEqual(self.titles("cupcake de morango"), ["Cupcake de Morango"])
+        self.assertEqual(self.titles("cupcake de morangx"), [])
+
+    def test_ranking_and_limit(self):
+        # Destaques primeiro, depois os mais avaliados e o título
+        self.assertEqual(self.titles("m"), ["Cupcake de Amora com Morango", "Cupcake de Morango", "Mousse de Maracujá"])
+
+        Cupcake.objects.filter(pk=self.mousse.pk).update(rating_count=3)
+        autocomplete.invalidate()
+        self.assertEqual(self.titles("m"), ["Cupcake de Amora com Morango", "Mousse de Maracujá", "Cupcake de Morango"])
+        self.assertEqual(self.titles("m", limit=1), ["Cupcake de Amora com Morango"])
+
+        trie = autocomplete.PrefixTrie(max_results=2)
+        for n in range(5):
+            trie.add(f"cupcake {n}", n)
+        self.assertEqual(trie.find("cup"), [0, 1])
+
+    def test_rebuilt_after_changes(self):
+        self.assertEqual(self.titles("coco"), [])
+
+        coco = create_cupcake(self.frutas, "AUTO-4", titulo="Cupcake de Coco")
+        self.assertEqual(self.titles("coco"), ["Cupcake de Coco"])
+
+        coco.titulo = "Cupcake de Nozes"
+        coco.save()
+        self.assertEqual(self.titles("coco"), [])
+        self.assertEqual(self.titles("noz"), ["Cupcake de Nozes"])
+
+        self.frutas.nome_categoria = "Frutas Tropicais"
+        self.frutas.save()
+        self.assertEqual([nome for _, nome in autocomplete.suggest("trop", 10)["categorias"]], ["Frutas Tropicais"])
+
+    def test_endpoint(self):
+        response = self.client.get(reverse("autocomplete"), {"q": "mor", "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], f"private, max-age={settings.AUTOCOMPLETE_TTL}")
+        self.assertEqual(
+            response.json(),
+            {
+                "cupcakes": [
+                    {
+                        "id": self.amora.pk,
+                        "titulo": "Cupcake de Amora com Morango",
+                        "url": reverse("product_details-page", args=[self.amora.pk]),
+                    }
+                ],
+                "categorias": [],
+            },
+        )
+
+        # O limite pedido não passa de AUTOCOMPLETE_MAX_RESULTS
+        with override_settings(AUTOCOMPLETE_MAX_RESULTS=2):
+            response = self.client.get(reverse("autocomplete"), {"q": "m", "limit": 50})
+        self.assertEqual(len(response.json()["cupcakes"]), 2)
+
+        self.assertEqual(self.client.get(reverse("autocomplete"), {"q": "m", "limit": "x"}).status_code, 400)
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_shop_search_box(self):
+        # O script da página lê a URL do endpoint do campo de busca e preenche o datalist
+        response = self.client.get(reverse("shop-page"))
+        self.assertContains(response, 'list="search-suggestions"')
+        self.assertContains(response, f'data-autocomplete-url="{reverse("autocomplete")}"')
+        self.assertContains(response, '<datalist id="search-suggestions"></datalist>', html=True)
+
+
+class FacetTests(TestCase):
+    """
+    Contagens da navegação facetada (`core.facets`) calculadas a partir de uma
+    única consulta agrupada.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        cls.chocolate = Categoria.objects.create(nome_categoria="Chocolate")
+        cls.frutas = Categoria.objects.create(nome_categoria="Frutas")
+        rows = [
+            (cls.chocolate, "Vegano", "Ganache", "4.99", None),
+            (cls.chocolate, "Tradicional", "Ganache", "5.00", None),
+            (cls.chocolate, "Tradicional", "Chantilly", "12.00", "9.99"),
+            (cls.frutas, "Vegano", "Chantilly", "10.00", None),
+            (cls.frutas, "Sem Glúten", "Morango", "25.00", "20.00"),
+            (cls.frutas, "Tradicional", "Morango", "19.99", None),
+            (cls.frutas, "Vegano", "Ganache", "30.00", None),
+        ]
+        for n, (categoria, etiqueta, cobertura, preco, preco_sale) in enumerate(rows):
+            create_cupcake(
+                categoria,
+                f"FACETA-{n}",
+                etiqueta=etiqueta,
+                cobertura=cobertura,
+                preco=Decimal(preco),
+                sale=preco_sale is not None,
+                preco_sale=Decimal(preco_sale) if preco_sale else None,
+            )
+
+    def setUp(self):
+        facets.invalidate()
+
+    def selected(self, query):
+        return facets.selected_options(QueryDict(query))
+
+    def test_price_band_edges(self):
+        self.assertEqual(
+            [(key, label) for key, _, _, label in facets.price_bands()],
+            [("0-5", "Até $5"), ("5-10", "$5 a $10"), ("10-20", "$10 a $20"), ("20-", "Acima de $20")],
+        )
+        bands = dict(
+            facets.with_price(Cupcake.objects.all())
+            .annotate(faixa=facets.band_expression())
+            .values_list("sku", "faixa")
+        )
+        # O limite inferior pertence à faixa; o preço promocional substitui o normal
+        self.assertEqual(
+            bands,
+            {
+                "FACETA-0": "0-5",
+                "FACETA-1": "5-10",
+                "FACETA-2": "5-10",
+                "FACETA-3": "10-20",
+                "FACETA-4": "20-",
+                "FACETA-5": "10-20",
+                "FACETA-6": "20-",
+            },
+        )
+        for key, skus in (("0-5", {"FACETA-0"}), ("20-", {"FACETA-4", "FACETA-6"})):
+            queryset = facets.filter_queryset(Cupcake.objects.all(), self.selected(f"preco={key}"))
+            self.assertEqual(set(queryset.values_list("sku", flat=True)), skus)
+
+    def test_counts_match_filtered_queryset(self):
+        cupcakes = Cupcake.objects.all()
+        rows = facets.cube(cupcakes)
+        for query in (
+            "",
+            f"categoria={self.chocolate.pk}",
+            "etiqueta=Vegano&etiqueta=Tradicional&cobertura=Ganache",
+            f"categoria={self.frutas.pk}&sale=0&preco=20-&preco=0-5",
+            "sale=1",
+        ):
+            with self.subTest(query=query):
+                params = QueryDict(query)
+                selected = facets.selected_options(params)
+                self.assertEqual(facets.total(rows, selected), facets.filter_queryset(cupcakes, selected).count())
+
+                for facet in facets.facet_counts(rows, selected, params):
+                    for option in facet["options"]:
+                        # A contagem de uma opção aplica os filtros das outras facetas
+                        others = {name: values for name, values in selected.items() if name != facet["name"]}
+                        others[facet["name"]] = {option["value"]}
+                        self.assertEqual(
+                            option["count"],
+                            facets.filter_queryset(cupcakes, others).count(),
+                            (facet["name"], option["value"]),
+                        )
+                        self.assertEqual(option["selected"], option["value"] in selected.get(facet["name"], ()))
+
+    def test_option_links(self):
+        params = QueryDict(f"categoria={self.chocolate.pk}&page=3&sort_by=5")
+        rows = facets.cube(Cupcake.objects.all())
+        (categorias,) = [
+            facet for facet in facets.facet_counts(rows, facets.selected_options(params), params)
+            if facet["name"] == "categoria"
+        ]
+        links = {option["label"]: QueryDict(option["query"]) for option in categorias["options"]}
+
+        # Marcar adiciona a opção, desmarcar a remove; a página volta para a primeira
+        self.assertEqual(
+            sorted(links["Frutas"].getlist("categoria")), sorted([str(self.chocolate.pk), str(self.frutas.pk)])
+        )
+        self.assertEqual(links["Chocolate"].getlist("categoria"), [])
+        for query in links.values():
+            self.assertNotIn("page", query)
+            self.assertEqual(query["sort_by"], "5")
+
+    def test_invalid_options_ignored(self):
+        self.assertEqual(
+            self.selected("categoria=abc&categoria=1&sale=2&preco=3-4&etiqueta=+&cobertura=Ganache"),
+            {"categoria": {"1"}, "cobertura": {"Ganache"}},
+        )
+
+    def test_catalog_cube_invalidated_on_save(self):
+        selected = self.selected("etiqueta=Diet")
+        self.assertEqual(facets.total(facets.catalog_cube(Cupcake.objects.all()), selected), 0)
+
+        create_cupcake(self.frutas, "FACETA-DIET", etiqueta="Diet")
+        self.assertEqual(facets.total(facets.catalog_cube(Cupcake.objects.all()), selected), 1)
+
+
+class ShopPaginationTests(TestCase):
+    """
+    Paginação por cursor da loja (`core.pagination`) em todas as ordenações de
+    `SHOP_ORDERINGS`, com empates no primeiro campo e `preco_sale` nulo.
+    """
+
+    PER_PAGE = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        create_default_asset()
+        categoria = Categoria.objects.create(nome_categoria="Chocolate")
+        rows = [
+            ("Cupcake de Morango", True, 1, "12.00", None),
+            ("Cupcake de Morango", False, 2, "8.00", "6.00"),
+            ("Cupcake de Baunilha", False, 1, "8.00", None),
+            ("Cupcake Red Velvet", True, 3, "15.00", "6.00"),
+            ("Cupcake de Limão", False, 3, "9.50", "7.25"),
+            ("Cupcake de Coco", True, 2, "8.00", None),
+            ("Cupcake de Baunilha", False, 4, "11.00", "5.00"),
+            ("Cupcake de Nozes", False, 2, "12.00", None),
+            ("Cupcake Floresta Negra", True, 4, "20.00", "18.00"),
+            ("Cupcake de Café", False, 1, "9.50", "7.25"),
+        ]
+        for n, (titulo, destaque, dia, preco, preco_sale) in enumerate(rows):
+            create_cupcake(
+                categoria,
+                f"PAG-{n}",
+                titulo=titulo,
+                esta_em_destaque=destaque,
+                data_lancamento=datetime.date(2024, 1, dia),
+                preco=Decimal(preco),
+                sale=preco_sale is not None,
+                preco_sale=Decimal(preco_sale) if preco_sale else None,
+            )
+
+    def expected(self, ordering):
+        # A mesma ordem calculada em Python, com os nulos depois dos demais valores
+        rows = list(Cupcake.objects.all())
+        for item in reversed(ordering):
+            name = item.lstrip("-")
+            rows.sort(
+                key=lambda row: (getattr(row, name) is None, getattr(row, name) or 0),
+                reverse=item.startswith("-"),
+            )
+        return [row.pk for row in rows]
+
+    def paginate(self, queryset, ordering, query="", count=None):
+        return pagination.paginate(queryset, ordering, QueryDict(query), self.PER_PAGE, count=count)
+
+    def walk(self, queryset, ordering, count=None):
+        """
+        Percorre as páginas pelos links "próxima" e depois volta pelos links
+        "anterior": `(páginas na ida, páginas na volta)`.
+        """
+        forward = []
+        page = self.paginate(queryset, ordering, count=count)
+        while True:
+            forward.append([cupcake.pk for cupcake in page])
+            links = page.links(QueryDict(""))
+            if links["next"] is None:
+                break
+            page = self.paginate(queryset, ordering, links["next"], count=count)
+            self.assertLessEqual(len(forward), Cupcake.objects.count())
+
+        backward = [[cupcake.pk for cupcake in page]]
+        while page.has_previous:
+            page = self.paginate(queryset, ordering, page.links(QueryDict(""))["previous"], count=count)
+            backward.insert(0, [cupcake.pk for cupcake in page])
+        return forward, backward
+
+    def test_every_ordering(self):
+        for sort_by, ordering in SHOP_ORDERINGS.items():
+            if sort_by == "0":
+                continue
+            with self.subTest(sort_by=sort_by):
+                expected = self.expected(ordering)
+                forward, backward = self.walk(Cupcake.objects.all(), ordering, count=len(expected))
+                self.assertEqual(sum(forward, []), expected)
+                self.assertEqual(backward, forward)
+                self.assertTrue(all(len(page) == self.PER_PAGE for page in forward[:-1]))
+
+    def test_search_rank(self):
+        ranked_ids = list(Cupcake.objects.order_by("-preco", "pk").values_list("pk", flat=True))[:8]
+        queryset = search.filter_ranked(Cupcake.objects.all(), ranked_ids)
+        forward, backward = self.walk(queryset, SHOP_ORDERINGS["0"])
+        self.assertEqual(sum(forward, []), ranked_ids)
+        self.assertEqual(backward, forward)
+
+    def test_numbered_links(self):
+        ordering = SHOP_ORDERINGS["4"]
+        expected = self.expected(ordering)
+        first = self.paginate(Cupcake.objects.all(), ordering, count=len(expected))
+        pages = dict(first.links(QueryDict(""))["pages"])
+        self.assertEqual(sorted(pages), [1, 2, 3])
+        self.assertIsNone(pages[1])
+
+        # Pula da página 1 direto para a 3 a partir do cursor da primeira
+        third = self.paginate(Cupcake.objects.all(), ordering, pages[3], count=len(expected))
+        self.assertEqual(third.number, 3)
+        self.assertEqual([cupcake.pk for cupcake in third], expected[6:9])
+
+        # E volta da 3 para a 1
+        pages = dict(third.links(QueryDict(""))["pages"])
+        first_again = self.paginate(Cupcake.objects.all(), ordering, pages[1], count=len(expected))
+        self.assertEqual([cupcake.pk for cupcake in first_again], expected[:3])
+
+    def test_stale_count(self):
+        # O total das facetas vem de um cache que pode estar desatualizado: a
+        # navegação depende só das linhas lidas
+        ordering = SHOP_ORDERINGS["1"]
+        expected = self.expected(ordering)
+        for count in (4, len(expected) + 9, 0):
+            with self.subTest(count=count):
+                forward, backward = self.walk(Cupcake.objects.all(), ordering, count=count)
+                self.assertEqual(sum(forward, []), expected)
+                self.assertEqual(backward, forward)
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_facet_link_after_paging(self):
+        # Um filtro escolhido na página 2 leva à página 1 do novo resultado, sem o cursor anterior
+        outra = Categoria.objects.create(nome_categoria="Baunilha")
+        for n in range(4):
+            create_cupcake(outra, f"PAG-B{n}", titulo=f"Cupcake A{n}")
+        self.client.force_login(User.objects.create_user("ana", password="senha"))
+
+        first = self.client.get(reverse("shop-page"))
+        second = self.client.get(f"{reverse('shop-page')}?{first.context['page_links']['next']}")
+        self.assertEqual(second.context["page_obj"].number, 2)
+
+        categoria = Cupcake.objects.get(sku="PAG-0").categoria_id
+        facet = next(facet for facet in second.context["facets"] if facet["name"] == "categoria")
+        option = next(option for option in facet["options"] if option["value"] == str(categoria))
+        self.assertNotIn("cursor", QueryDict(option["query"]))
+
+        response = self.client.get(f"{reverse('shop-page')}?{option['query']}")
+        expected = list(
+            Cupcake.objects.filter(categoria_id=categoria).order_by(*SHOP_ORDERINGS["1"]).values_list("pk", flat=True)
+        )
+        self.assertEqual(response.context["page_obj"].number, 1)
+        self.assertEqual([cupcake.pk for cupcake in response.context["cupcakes"]], expected[:6])
+
+    def test_invalid_cursor(self):
+        ordering = SHOP_ORDERINGS["1"]
+        page = self.paginate(Cupcake.objects.all(), ordering, "page=2&cursor=nao-e-um-cursor")
+        # Sem cursor válido a página é lida com OFFSET
+        self.assertEqual([cupcake.pk for cupcake in page], self.expected(ordering)[3:6])
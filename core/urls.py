@@ -14,6 +14,7 @@ urlpatterns = [
     
     # Shop and cart pages
     path("shop/", views.shop, name="shop-page"),
+    path("shop/autocomplete/", views.autocomplete, name="autocomplete"),
     path("cart", views.cart_view, name="cart-page"),
     path("checkout", views.process_checkout, name="process_checkout"),
     path("checkout/<int:id>", views.process_checkout, name="process_checkout"),
@@ -29,6 +30,7 @@ urlpatterns = [
     path("product_details/<int:id>/", views.product_details, name="product_details-page"),
     path("add_to_cart/<int:id>/", views.product_details, name="add_to_cart"),
     path("register-rating/", views.register_rating, name="register_rating"),
+    path("product_details/<int:id>/ratings/", views.rating_histogram, name="rating_histogram"),
 
     # Address management
     path("registe_address", views.registe_address, name="registe_address"),
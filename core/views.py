@@ -4,7 +4,6 @@ import logging
 import os
 import re
 from datetime import datetime
-from urllib.parse import quote
 
 # Bibliotecas do Django
 from django.conf import settings
@@ -12,9 +11,10 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.mail import send_mail
-from django.core.paginator import Paginator
-from django.http import Http404, HttpResponse, JsonResponse
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
@@ -22,13 +22,14 @@ from django.views.decorators.http import require_POST
 
 
 from libs import utils
+from core import autocomplete as autocomplete_index, facets, fuzzy, image_cache, pagination, search
+from core.responses import file_response
 from core.models import (
     Review,
     Testimonial,
     NewsletterSubscriber,
     Cart,
     CartItem,
-    Categoria,
     Order,
     Address,
     Cupcake,
@@ -156,7 +157,7 @@ def home(request):
 
     try:
         # Obtendo depoimentos
-        testimonials = Testimonial.objects.all()
+        testimonials = Testimonial.objects.select_related("user__profile")
         logger.info(f"Carregados {testimonials.count()} depoimentos.")
 
         context = {
@@ -166,13 +167,12 @@ def home(request):
         }
 
         # Filtrando cupcakes em destaque
-        cupcake_em_destaque = Cupcake.objects.filter(esta_em_destaque=True)
+        cupcake_em_destaque = Cupcake.objects.filter(esta_em_destaque=True).with_rating()
         logger.info(f"Encontrados {cupcake_em_destaque.count()} cupcakes em destaque.")
 
         for cupcake in cupcake_em_destaque:
-            # Obtendo imagens do cupcake
-            imagens = CupcakeImage.objects.filter(cupcake=cupcake)
-            imagem_urls = [imagem.normal.url for imagem in imagens]
+            # Obtendo imagens do cupcake (com as variantes responsivas)
+            imagens = list(CupcakeImage.objects.filter(cupcake=cupcake).select_related("asset"))
             
             # Calculando a média de avaliações
             cupcake.media_rating = utils.cupcake_rating_median(cupcake)
@@ -180,7 +180,7 @@ def home(request):
 
             # Adicionando cupcake ao contexto
             context["home_featured_products"].append(
-                {"cupcake": cupcake, "imagens": imagem_urls}
+                {"cupcake": cupcake, "imagens": imagens}
             )
 
         # Agrupando produtos em pares
@@ -197,57 +197,73 @@ def home(request):
 
     return render(request, "cupcakes/index.html", context)
 
+# Ordenações da loja (`sort_by`), sempre terminando no id para a paginação por cursor
+SHOP_ORDERINGS = {
+    '0': ('search_rank', 'pk'),  # Relevância (apenas em uma busca)
+    '1': ('titulo', 'pk'),  # Alfabeticamente, A-Z
+    '2': ('-esta_em_destaque', '-pk'),  # Ordenar por popularidade
+    '3': ('-data_lancamento', '-pk'),  # Ordenar por novidades
+    '4': ('preco_sale', 'pk'),  # Ordenar por preço: baixo para alto
+    '5': ('-preco', '-pk'),  # Ordenar por preço: alto para baixo
+    '6': ('-titulo', '-pk'),  # Nome do Produto: Z-A
+}
+
+
 @login_required
 def shop(request):
     # Obtém todos os cupcakes e suas imagens associadas
     data_GET = request.GET
     data_POST = request.POST
 
-    cupcakes = Cupcake.objects.all().prefetch_related("imagens")
-    categorias = Categoria.objects.all().prefetch_related("categoria_cupcakes")
+    cupcakes = Cupcake.objects.all().prefetch_related(
+        Prefetch("imagens", queryset=CupcakeImage.objects.select_related("asset"))
+    )
 
      # Verifica se há um termo de pesquisa enviado via get
     search_query = data_GET.get('search_query', '').strip()
     
     if search_query:
-        # Filtra os cupcakes pelo título que contenha o termo de pesquisa
-        cupcakes = cupcakes.filter(titulo__icontains=search_query)
-
-    for cupcake in cupcakes:
-        cupcake.media_rating = utils.cupcake_rating_median(cupcake)
-
-    # Define o critério de ordenação baseado nos valores do formulário
-    sort_by = data_GET.get('sort_by', '1')  # O valor padrão é '1' (Alfabeticamente, A-Z)
-    
-    if sort_by == '1':
-        cupcakes = cupcakes.order_by('titulo')  # Alfabeticamente, A-Z
-    elif sort_by == '2':
-        cupcakes = cupcakes.order_by('-esta_em_destaque')  # Ordenar por popularidade
-    elif sort_by == '3':
-        cupcakes = cupcakes.order_by('-data_lancamento')  # Ordenar por novidades
-    elif sort_by == '4':
-        cupcakes = cupcakes.order_by('preco_sale')  # Ordenar por preço: baixo para alto
-    elif sort_by == '5':
-        cupcakes = cupcakes.order_by('-preco')  # Ordenar por preço: alto para baixo
-    elif sort_by == '6':
-        cupcakes = cupcakes.order_by('-titulo')  # Nome do Produto: Z-A
-    
-
-    # Filtragem por categoria
-    categoria_id = request.GET.get('categoria')
-    if categoria_id:
-        cupcakes = cupcakes.filter(categoria__id=categoria_id)
+        # Índice textual do banco (título, descrição, ingredientes, etiqueta e cobertura),
+        # ranqueado por relevância; sem resultados, tenta a busca tolerante a erros de
+        # digitação no índice em memória (títulos e etiquetas)
+        ranked_ids = search.search(search_query)
+        if not ranked_ids:
+            ranked_ids = fuzzy.search(search_query) or ranked_ids
+        if ranked_ids is None:
+            cupcakes = search.fallback_filter(cupcakes, search_query)
+        else:
+            cupcakes = search.filter_ranked(cupcakes, ranked_ids)
 
     # Filtragem por cupcake específico (opcional)
     cupcake_titulo = request.GET.get('cupcake')
     if cupcake_titulo:
         cupcakes = cupcakes.filter(titulo=cupcake_titulo)
-    # Paginação
-    page_number = request.GET.get('page', 1)  # Pega o número da página atual (1 é o padrão)
-    paginator = Paginator(cupcakes, 6)  # Pagina com 6 cupcakes por página
 
-    # Obtém a página atual
-    page_obj = paginator.get_page(page_number)
+    # Facetas (categoria, etiqueta, cobertura, promoção, faixa de preço): as contagens vêm de
+    # uma consulta agrupada sobre o resultado da busca, ou do catálogo em cache sem busca
+    selected = facets.selected_options(data_GET)
+    if search_query or cupcake_titulo:
+        facet_rows = facets.cube(cupcakes)
+    else:
+        facet_rows = facets.catalog_cube(cupcakes)
+    cupcakes = facets.filter_queryset(cupcakes, selected)
+
+    # Define o critério de ordenação baseado nos valores do formulário
+    # O padrão é '1' (Alfabeticamente, A-Z); em uma busca, a ordem de relevância
+    sort_by = data_GET.get('sort_by', '0' if search_query else '1')
+    if sort_by not in SHOP_ORDERINGS or (sort_by == '0' and 'search_rank' not in cupcakes.query.annotations):
+        sort_by = '1'
+
+    # Paginação por cursor (6 cupcakes por página); o total das facetas só numera os links
+    page_obj = pagination.paginate(
+        cupcakes.with_rating(),
+        SHOP_ORDERINGS[sort_by],
+        data_GET,
+        per_page=6,
+        count=facets.total(facet_rows, selected),
+    )
+    for cupcake in page_obj.object_list:
+        cupcake.media_rating = utils.cupcake_rating_median(cupcake)
 
     # Renderiza o template com os dados paginados
     return render(
@@ -255,12 +271,77 @@ def shop(request):
         "cupcakes/shop.html",
         {
             "cupcakes": page_obj.object_list,  # Cupcakes da página atual
-            "categorias": categorias,
+            "facets": facets.facet_counts(facet_rows, selected, data_GET),
+            "filters": [(name, value) for name, values in selected.items() for value in sorted(values)],
             "search_query": search_query,
+            "sort_by": sort_by,
             "page_obj": page_obj,  # Página para controle de navegação
+            "page_links": page_obj.links(data_GET),
         },
     )
 
+@login_required
+def autocomplete(request):
+    """
+    Sugestões para a busca da loja: cupcakes e categorias com uma palavra
+    começando com o texto digitado (parâmetro `q`), servidas da árvore de
+    prefixos em memória (`core.autocomplete`), sem consultar o banco.
+
+    Estrutura da Resposta JSON:
+    {
+        "cupcakes": [{"id": int, "titulo": str, "url": str}, ...],
+        "categorias": [{"id": int, "nome": str, "url": str}, ...]
+    }
+    """
+    try:
+        limit = int(request.GET.get("limit", settings.AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError:
+        return HttpResponseBadRequest("limit inválido")
+    limit = min(max(limit, 1), settings.AUTOCOMPLETE_MAX_RESULTS)
+
+    suggestions = autocomplete_index.suggest(request.GET.get("q", ""), limit)
+    shop_url = reverse("shop-page")
+    response = JsonResponse(
+        {
+            "cupcakes": [
+                {"id": pk, "titulo": titulo, "url": reverse("product_details-page", args=[pk])}
+                for pk, titulo in suggestions["cupcakes"]
+            ],
+            "categorias": [
+                {"id": pk, "nome": nome, "url": f"{shop_url}?categoria={pk}"}
+                for pk, nome in suggestions["categorias"]
+            ],
+        }
+    )
+    # O navegador reaproveita as respostas enquanto o usuário apaga e redigita
+    response["Cache-Control"] = f"private, max-age={settings.AUTOCOMPLETE_TTL}"
+    return response
+
+@login_required
+def rating_histogram(request, id):
+    """
+    Retorna em JSON a distribuição das avaliações de um cupcake (de 5 a 1
+    estrela), a partir dos agregados guardados no cupcake, sem consultar as avaliações.
+
+    Estrutura da Resposta JSON:
+    {
+        "cupcake": int,
+        "count": int,  # Quantidade de avaliações
+        "average": float,  # Média das avaliações (0 sem avaliações)
+        "histogram": [{"stars": int, "count": int, "percent": int}, ...]
+    }
+    """
+    cupcake = get_object_or_404(Cupcake, id=id)
+    return JsonResponse(
+        {
+            "cupcake": cupcake.id,
+            "count": cupcake.rating_count,
+            "average": round(cupcake.rating_avg, 2),
+            "histogram": cupcake.rating_histogram(),
+        }
+    )
+
+
 @login_required
 def product_details(request, id):
     """
@@ -305,14 +386,14 @@ def product_details(request, id):
         context.update(reviews)
 
         # Obtendo o cupcake pelo ID
-        cupcake = get_object_or_404(Cupcake, id=id)
+        cupcake = get_object_or_404(Cupcake.objects.with_rating(), id=id)
         logger.info(f"Cupcake {cupcake.titulo} (ID: {id}) carregado.")
 
         # Obtendo imagens do cupcake
         imagens = CupcakeImage.objects.filter(cupcake=cupcake)
-        normal = [imagem.normal.url for imagem in imagens]
-        large_size = [imagem.large_size.url for imagem in imagens]
-        small_size = [imagem.small_size.url for imagem in imagens]
+        normal = [imagem.get_normal_url() for imagem in imagens]
+        large_size = [imagem.get_large_url() for imagem in imagens]
+        small_size = [imagem.get_small_url() for imagem in imagens]
 
         # Calculando a média de avaliações
         cupcake.media_rating = utils.cupcake_rating_median(cupcake)
@@ -329,16 +410,15 @@ def product_details(request, id):
         )
 
         # Cupcakes em destaque
-        cupcake_em_destaque = Cupcake.objects.filter(esta_em_destaque=True)
+        cupcake_em_destaque = Cupcake.objects.filter(esta_em_destaque=True).with_rating()
         logger.info(f"Carregados {cupcake_em_destaque.count()} cupcakes em destaque.")
 
         for cupcake in cupcake_em_destaque:
-            imagens = CupcakeImage.objects.filter(cupcake=cupcake)
-            imagem_urls = [imagem.normal.url for imagem in imagens]
+            imagens = list(CupcakeImage.objects.filter(cupcake=cupcake).select_related("asset"))
             cupcake.media_rating = utils.cupcake_rating_median(cupcake)
 
             context["home_featured_products"].append(
-                {"cupcake": cupcake, "imagens": imagem_urls}
+                {"cupcake": cupcake, "imagens": imagens}
             )
 
     except Cupcake.DoesNotExist:
@@ -830,8 +910,8 @@ def get_image(request, page, _type, name):
     Retorna uma imagem do sistema de arquivos com base nos parâmetros fornecidos.
 
     Esta view serve imagens armazenadas no servidor, determinando o caminho da imagem com base 
-    nos parâmetros fornecidos (`page`, `_type`, e `name`). Se a imagem existir, ela é retornada 
-    como uma resposta HTTP com o tipo de conteúdo adequado. Caso contrário, um erro 404 é gerado.
+    nos parâmetros fornecidos (`page`, `_type`, e `name`). Se a imagem existir, ela é enviada em
+    streaming com o tipo de conteúdo adequado. Caso contrário, um erro 404 é gerado.
 
     Parâmetros:
     request (HttpRequest): O objeto de requisição HTTP que contém os dados da requisição.
@@ -841,30 +921,42 @@ def get_image(request, page, _type, name):
 
     Retorna:
     HttpResponse: 
-    - Se a imagem existir, retorna uma resposta HTTP contendo a imagem com o tipo de conteúdo "image/jpeg" e o nome do arquivo como disposição de conteúdo.
-    - Se a imagem não for encontrada, gera uma exceção `Http404` com a mensagem "Image not found".
-
-    Comportamento:
-    - Constrói o caminho do arquivo da imagem com base nos parâmetros fornecidos e no diretório de mídia configurado.
-    - Verifica se o caminho da imagem existe.
-    - Se a imagem for encontrada, lê o arquivo e o retorna como uma resposta HTTP com o tipo de conteúdo apropriado.
-    - Se a imagem não for encontrada, lança um erro 404.
+    - Se a imagem existir, retorna um `FileResponse` com o tipo de conteúdo deduzido da extensão do arquivo.
+    - Se o navegador já tiver a versão atual (`If-None-Match`/`If-Modified-Since`), retorna 304 sem corpo.
+    - Se a requisição tiver um cabeçalho `Range`, retorna 206 apenas com o intervalo pedido.
+    - Se a imagem não for encontrada (ou o caminho for uma pasta), gera uma exceção `Http404` com a mensagem "Image not found".
+    - Se os parâmetros forem inválidos, ou o arquivo a transformar não for uma imagem, retorna 400.
+
+    Parâmetros da query string (opcionais):
+    w (int): Largura máxima, arredondada para uma das larguras de IMAGE_TRANSFORM_WIDTHS.
+    fm (str): Formato de saída ("webp", "avif", "jpeg" ou "png").
+    q (int): Qualidade de 1 a 100.
+    Com qualquer um deles a imagem é transformada uma única vez e servida do cache em disco
+    (ver `core.image_cache`).
 
     Observações:
-    - O tipo de conteúdo é fixado como "image/jpeg". Se outros tipos de imagem forem suportados, o tipo de conteúdo deve ser ajustado dinamicamente.
+    - As respostas incluem `ETag`, `Last-Modified` e `Cache-Control` (ver `core.responses`).
     """
 
-    if page != "null":
-        image_path = os.path.join(settings.MEDIA_ROOT, page, _type, name)
-    else:
-        image_path = os.path.join(settings.MEDIA_ROOT, _type, name)
-
-    if os.path.exists(image_path):
-        with open(image_path, "rb") as image_file:
-            response = HttpResponse(image_file.read(), content_type="image/jpeg")
-            response["Content-Disposition"] = f"inline; filename={quote(name)}"
-            return response
-    else:
+    try:
+        image_path = image_cache.media_path(page, _type, name)
+        transform = image_cache.parse_transform(request.GET, name)
+        if transform is None:
+            return file_response(request, image_path, filename=name)
+
+        # Cópia redimensionada/convertida, gerada na primeira requisição e servida do cache em disco
+        cached_path, key = image_cache.get_transformed(image_path, **transform)
+        return file_response(
+            request,
+            cached_path,
+            filename=image_cache.transformed_name(name, **transform),
+            etag=f'"{key[:32]}"',
+            last_modified=os.path.getmtime(image_path),
+        )
+    except ValueError as error:
+        # Parâmetros inválidos ou arquivo que não é uma imagem (`ImageRejected`)
+        return HttpResponseBadRequest(str(error))
+    except (SuspiciousFileOperation, FileNotFoundError, IsADirectoryError, NotADirectoryError):
         raise Http404("Image not found")
 
 
@@ -97,6 +97,61 @@ STATIC_ROOT =  BASE_DIR /  'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Imagem padrão dos cupcakes (relativa a MEDIA_ROOT); gerada uma vez com `manage.py prepare_default_image`
+DEFAULT_CUPCAKE_IMAGE = 'cupcakes-fotos/default_cupcakes.jpeg'
+
+# Variantes responsivas (srcset) geradas pelo pipeline de imagens; "avif" requer suporte no Pillow
+IMAGE_OUTPUT_FORMATS = config('IMAGE_OUTPUT_FORMATS', default='webp', cast=Csv())
+IMAGE_SRCSET_WIDTHS = config('IMAGE_SRCSET_WIDTHS', default='140,280,400,600,800', cast=Csv(int))
+IMAGE_SRCSET_SIZES = config('IMAGE_SRCSET_SIZES', default='(max-width: 575px) 100vw, (max-width: 991px) 50vw, 300px')
+IMAGE_WEBP_QUALITY = config('IMAGE_WEBP_QUALITY', default=80, cast=int)
+IMAGE_AVIF_QUALITY = config('IMAGE_AVIF_QUALITY', default=60, cast=int)
+IMAGE_JPEG_QUALITY = config('IMAGE_JPEG_QUALITY', default=85, cast=int)
+
+# Limites verificados antes de decodificar uma imagem (proteção contra "decompression bombs")
+IMAGE_MAX_UPLOAD_BYTES = config('IMAGE_MAX_UPLOAD_BYTES', default=25 * 1024 * 1024, cast=int)
+IMAGE_MAX_PIXELS = config('IMAGE_MAX_PIXELS', default=50_000_000, cast=int)
+
+# Cache HTTP das imagens servidas por views.get_image (segundos)
+IMAGE_CACHE_MAX_AGE = config('IMAGE_CACHE_MAX_AGE', default=86400, cast=int)
+
+# Transformações sob demanda de views.get_image (?w=&fm=&q=), guardadas em um cache em disco com LRU
+IMAGE_TRANSFORM_WIDTHS = config('IMAGE_TRANSFORM_WIDTHS', default='140,280,400,600,800,1200,1600,1920', cast=Csv(int))
+IMAGE_TRANSFORM_CACHE_DIR = config('IMAGE_TRANSFORM_CACHE_DIR', default=str(BASE_DIR / 'image-cache'))
+IMAGE_TRANSFORM_CACHE_MAX_BYTES = config('IMAGE_TRANSFORM_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+
+# Busca do catálogo (core.search): quantidade máxima de resultados ranqueados por busca
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=500, cast=int)
+# Busca tolerante a erros (core.fuzzy): similaridade mínima entre trigramas e intervalo de sincronização do índice
+FUZZY_THRESHOLD = config('FUZZY_THRESHOLD', default=0.3, cast=float)
+FUZZY_SYNC_INTERVAL = config('FUZZY_SYNC_INTERVAL', default=30, cast=float)  # segundos
+# Sugestões da busca (core.autocomplete): resultados por tipo e validade (segundos) da árvore de prefixos
+AUTOCOMPLETE_MAX_RESULTS = config('AUTOCOMPLETE_MAX_RESULTS', default=10, cast=int)
+AUTOCOMPLETE_TTL = config('AUTOCOMPLETE_TTL', default=60, cast=int)
+# Filtros da loja (core.facets): limites das faixas de preço e validade (segundos) das contagens do catálogo
+SHOP_PRICE_BANDS = config('SHOP_PRICE_BANDS', default='5,10,20', cast=Csv(int))
+FACETS_CACHE_TTL = config('FACETS_CACHE_TTL', default=60, cast=int)
+
+# Fila de processamento de imagens (manage.py image_worker)
+IMAGE_WORKER_PROCESSES = config('IMAGE_WORKER_PROCESSES', default=2, cast=int)
+IMAGE_WORKER_POLL_INTERVAL = config('IMAGE_WORKER_POLL_INTERVAL', default=2, cast=float)
+IMAGE_JOB_MAX_ATTEMPTS = config('IMAGE_JOB_MAX_ATTEMPTS', default=3, cast=int)
+IMAGE_JOB_TIMEOUT = config('IMAGE_JOB_TIMEOUT', default=600, cast=int)  # segundos
+IMAGE_REPROCESS_BATCH_SIZE = config('IMAGE_REPROCESS_BATCH_SIZE', default=4, cast=int)  # imagens por inferência do ONNX
+AVATAR_SIZE = config('AVATAR_SIZE', default=300, cast=int)  # lado (px) do avatar quadrado; 2x os 150px do depoimento
+IMAGE_ENCODE_THREADS = config('IMAGE_ENCODE_THREADS', default=0, cast=int)  # threads por processo para gerar as variantes; 0 = automático
+
+# Remoção de fundo: "auto" tenta o recorte rápido (sem ML) e só usa o rembg quando ele é incerto;
+# "matte" usa sempre o recorte rápido e "rembg" sempre o modelo
+IMAGE_BACKGROUND_TIER = config('IMAGE_BACKGROUND_TIER', default='auto')
+IMAGE_MATTE_TOLERANCE = config('IMAGE_MATTE_TOLERANCE', default=24, cast=int)  # diferença máxima por canal (0-255)
+IMAGE_MATTE_MIN_CONFIDENCE = config('IMAGE_MATTE_MIN_CONFIDENCE', default=0.9, cast=float)
+
+# Sessão do rembg/ONNX runtime, carregada uma vez por processo do worker
+REMBG_MODEL = config('REMBG_MODEL', default='u2net')
+REMBG_INTRA_OP_THREADS = config('REMBG_INTRA_OP_THREADS', default=0, cast=int)  # 0 = padrão do ONNX runtime
+REMBG_INTER_OP_THREADS = config('REMBG_INTER_OP_THREADS', default=0, cast=int)
+
 
 # Email configuration
 EMAIL_HOST = config('EMAIL_HOST', default='localhost')
@@ -16,13 +16,8 @@ def html_star(qtd):
 
 
 def cupcake_rating_median(cupcake: Cupcake):
-    reviews = Review.objects.filter(cupcake=cupcake)
-
-    if reviews:
-        media = sum([review.avaliacao for review in reviews]) // len(reviews)
-    else:
-        media = 0
-    avaliacao_html = html_star(media)
+    # Média de `Cupcake.objects.with_rating()` ou, sem a anotação, a guardada no cupcake
+    avaliacao_html = html_star(int(getattr(cupcake, "media_avaliacao", cupcake.rating_avg)))
 
     return avaliacao_html
 